@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""accounts module"""
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from . import utils
+from .notes_db import NotesDB
+
+class AccountConfig:
+    """
+    AccountConfig class
+
+    The config of an extra account: its own server, credentials and
+    db_path, everything else taken from the main config.
+    """
+    def __init__(self, config, name):
+        self.config = config
+        self.name = name
+        self.settings = config.accounts[name]
+
+    def get_config(self, name):
+        """Get a config value"""
+        if name in self.settings:
+            return self.settings[name]
+        return self.config.get_config(name)
+
+    def __getattr__(self, attr):
+        return getattr(self.config, attr)
+
+class AccountsStatus:
+    """The connection status of all accounts, as shown in the GUI"""
+    def __init__(self, accounts_db):
+        self.accounts_db = accounts_db
+
+    @property
+    def status(self):
+        """One status if all accounts agree, one per account otherwise"""
+        statuses = [(name or 'main', ndb.note.status)
+                    for name, ndb in self.accounts_db.dbs.items()]
+        if len(set(status for _, status in statuses)) == 1:
+            return statuses[0][1]
+        return ', '.join('{0}: {1}'.format(name, status)
+                         for name, status in statuses)
+
+def open_accounts(ndb, config, log):
+    """
+    Return ndb if config declares no extra accounts, otherwise an
+    AccountsDB merging it with the databases of the extra accounts
+    """
+    names = list(config.accounts)
+    if not names:
+        return ndb
+    return AccountsDB(ndb, config, log, names)
+
+class AccountsDB:
+    """
+    AccountsDB class
+
+    Presents the NotesDB of the main account and those of the extra
+    accounts as one database. Notes of extra accounts have keys of the
+    form 'account:key', which is how calls are routed to their NotesDB.
+    New notes go to the main account. Syncs run for all accounts at
+    once, each with its own NextCloud client.
+    """
+    def __init__(self, ndb, config, log, names):
+        self.config = config
+        self.main = ndb
+        self.dbs = collections.OrderedDict([('', ndb)])
+        for name in names:
+            self.dbs[name] = NotesDB(AccountConfig(config, name),
+                                     self._account_log(name, log),
+                                     ndb.update_view,
+                                     account=name)
+        self._log = log
+        self.go_cond = threading.Condition()
+        self.notes = collections.ChainMap(
+                *[account_db.notes for account_db in self.dbs.values()])
+        self.note = AccountsStatus(self)
+        self.stats_file = ndb.stats_file
+
+    @staticmethod
+    def _account_log(name, log):
+        """Return log, marking messages with the account name"""
+        prefix = '[{0}] '.format(name.replace('%', '%%'))
+        return lambda msg, *args: log(prefix + msg, *args)
+
+    @property
+    def log(self):
+        """The function messages are logged with"""
+        return self._log
+
+    @log.setter
+    def log(self, log):
+        self._log = log
+        for name, account_db in self.dbs.items():
+            account_db.log = self._account_log(name, log) if name else log
+
+    @property
+    def last_sync(self):
+        """The time of the oldest last sync of all accounts"""
+        return min(account_db.last_sync for account_db in self.dbs.values())
+
+    @last_sync.setter
+    def last_sync(self, last_sync):
+        for account_db in self.dbs.values():
+            account_db.last_sync = last_sync
+
+    def _db(self, key):
+        """Return the NotesDB holding the note with key"""
+        if isinstance(key, str) and ':' in key:
+            account_db = self.dbs.get(key.split(':', 1)[0])
+            if account_db is not None:
+                return account_db
+        return self.main
+
+    def _each(self, func):
+        """Call func with each NotesDB at once, return the results"""
+        with ThreadPoolExecutor(max_workers=len(self.dbs)) as pool:
+            return list(pool.map(func, self.dbs.values()))
+
+    def set_update_view(self, update_view):
+        """Set the update_view method"""
+        for account_db in self.dbs.values():
+            account_db.set_update_view(update_view)
+
+    def filtered_notes_sort(self, filtered_notes, sort_mode='date'):
+        """Sort filtered note set"""
+        if sort_mode != 'categories':
+            self.main.filtered_notes_sort(filtered_notes, sort_mode)
+            return
+        ranks = {'': -1}
+        for rank, (category, _) in enumerate(self.get_categories()):
+            ranks[category] = rank
+        utils.sort_notes_by_categories(
+                filtered_notes,
+                favorite_ontop=self.config.get_config('favorite_ontop'),
+                ranks=ranks)
+
+    def filter_notes(self, search_string=None, search_mode='gstyle',
+                     sort_mode='date'):
+        """Return the notes of all accounts filtered with search string"""
+        filtered_notes = []
+        match_regexp = None
+        active_notes = 0
+        for account_db in self.dbs.values():
+            account_notes, match_regexp, account_active = \
+                    account_db.filter_notes(search_string, search_mode,
+                                            sort_mode)
+            filtered_notes.extend(account_notes)
+            active_notes += account_active
+        self.filtered_notes_sort(filtered_notes, sort_mode)
+        return filtered_notes, match_regexp, active_notes
+
+    def get_categories(self):
+        """Return a sorted list of (category, number of notes) tuples"""
+        counts = collections.Counter()
+        for account_db in self.dbs.values():
+            for category, count in account_db.get_categories():
+                counts[category] += count
+        return sorted(counts.items(),
+                      key=lambda item: (item[0].casefold(), item[0]))
+
+    def import_note(self, note):
+        """Import a note into the main account"""
+        return self.main.import_note(note)
+
+    def create_note(self, content):
+        """Create a new note in the main account"""
+        return self.main.create_note(content)
+
+    def get_note(self, key):
+        """Get a note from the database"""
+        return self._db(key).get_note(key)
+
+    def current_key(self, key):
+        """Return the key of the note that had key"""
+        return self._db(key).current_key(key)
+
+    def note_lock(self, key):
+        """Return the lock to hold while changing the note with key"""
+        return self._db(key).note_lock(key)
+
+    def set_note_deleted(self, key, deleted):
+        """Mark a note for deletion"""
+        self._db(key).set_note_deleted(key, deleted)
+
+    def set_note_content(self, key, content):
+        """Set the content of a note in the database"""
+        self._db(key).set_note_content(key, content)
+
+    def set_note_category(self, key, category):
+        """Set the category of a note in the database"""
+        self._db(key).set_note_category(key, category)
+
+    def set_note_favorite(self, key, favorite):
+        """Mark a note in the database as a favorite"""
+        self._db(key).set_note_favorite(key, favorite)
+
+    def verify_all_saved(self):
+        """
+        Verify all notes in the local databases are saved to the
+        servers
+        """
+        return all(account_db.verify_all_saved()
+                   for account_db in self.dbs.values())
+
+    def sync_notes(self, server_sync=True, full_sync=True):
+        """Sync all accounts at once, return the number of errors"""
+        return sum(self._each(
+                lambda account_db: account_db.sync_notes(server_sync,
+                                                         full_sync)))
+
+    def sync_now(self, do_server_sync=True):
+        """Sync the notes of all accounts to their servers"""
+        self._each(lambda account_db: account_db.sync_now(do_server_sync))
+
+    def sync_worker(self, do_server_sync):
+        """The sync worker thread"""
+        time.sleep(1) # give some time to wait for GUI initialization
+        self.log('Sync worker: started')
+        self.sync_now(do_server_sync)
+        while True:
+            self.go_cond.acquire()
+            self.go_cond.wait(15)
+            self.sync_now(do_server_sync)
+            self.go_cond.release()
+
+    def sync_worker_go(self):
+        """Start the sync worker"""
+        self.go_cond.acquire()
+        self.go_cond.notify()
+        self.go_cond.release()
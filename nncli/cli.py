@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 """Command line interface module"""
+import os
+import re
+import sys
+
 import click
 
-from . import __version__
-from .nncli import Nncli
+from . import __version__, daemon as nncli_daemon
 
 # pylint: disable=unnecessary-pass
 
@@ -18,12 +21,38 @@ class StdinFlag(click.ParamType):
 
 STDIN_FLAG = StdinFlag()
 
+# a note key as typed: str.isdigit() also takes digits int() can't parse
+_KEY_DIGITS = re.compile('[0-9]+')
+
+class NoteKey(click.ParamType):
+    """NoteKey Click Parameter Type"""
+    name = "key"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        if _KEY_DIGITS.fullmatch(value):
+            return int(value)
+        account, _, key = value.partition(':')
+        if account and _KEY_DIGITS.fullmatch(key):
+            # a note of an extra account, as printed by list
+            return value
+        return self.fail('%s is not a valid note key' % value)
+
+NOTE_KEY = NoteKey()
+
+def require_key(ctx_obj):
+    """Return the note key given to the cat group, or fail"""
+    if ctx_obj['key'] is None:
+        raise click.UsageError('Missing option "-k" / "--key".')
+    return ctx_obj['key']
+
 @click.command()
 @click.pass_obj
 def rm_category(ctx_obj):
     """Remove note category."""
     nncli = ctx_obj['nncli']
-    key = ctx_obj['key']
+    key = require_key(ctx_obj)
     nncli.cli_note_category_rm(key)
 
 @click.command()
@@ -32,7 +61,7 @@ def rm_category(ctx_obj):
 def set_category(ctx_obj, category):
     """Set the note category."""
     nncli = ctx_obj['nncli']
-    key = ctx_obj['key']
+    key = require_key(ctx_obj)
     nncli.cli_note_category_set(key, category)
 
 @click.command(short_help="Print the note category.")
@@ -40,18 +69,24 @@ def set_category(ctx_obj, category):
 def get_category(ctx_obj):
     """Print the category for the given note on stdout."""
     nncli = ctx_obj['nncli']
-    key = ctx_obj['key']
+    key = require_key(ctx_obj)
     category = nncli.cli_note_category_get(key)
     if category:
         print(category)
 
+@click.command(short_help="List all categories.")
+@click.pass_obj
+def list_categories(ctx_obj):
+    """List all categories and the number of notes in each."""
+    nncli = ctx_obj['nncli']
+    nncli.cli_list_categories()
+
 @click.group()
 @click.option(
         '-k',
         '--key',
-        required=True,
-        type=click.INT,
-        help="Specify the note key."
+        type=NOTE_KEY,
+        help="Specify the note key (required except for list)."
         )
 @click.pass_context
 def cat(ctx, key):
@@ -64,13 +99,14 @@ def cat(ctx, key):
 cat.add_command(get_category, 'get')
 cat.add_command(set_category, 'set')
 cat.add_command(rm_category, 'rm')
+cat.add_command(list_categories, 'list')
 
 @click.command()
 @click.option(
         '-k',
         '--key',
         required=True,
-        type=click.INT,
+        type=NOTE_KEY,
         help="Specify the note key.")
 @click.pass_obj
 def favorite(nncli, key):
@@ -82,7 +118,7 @@ def favorite(nncli, key):
         '-k',
         '--key',
         required=True,
-        type=click.INT,
+        type=NOTE_KEY,
         help="Specify the note key."
         )
 @click.pass_obj
@@ -91,7 +127,7 @@ def unfavorite(nncli, key):
     nncli.cli_note_favorite(key, 0)
 
 @click.command(short_help="Print JSON-formatted note to stdout.")
-@click.option('-k', '--key', type=click.INT, help="Specify the note key.")
+@click.option('-k', '--key', type=NOTE_KEY, help="Specify the note key.")
 @click.option(
         '-r',
         '--regex',
@@ -111,7 +147,7 @@ def export(nncli, key, regex, search_terms):
         nncli.cli_export_notes(regex, ' '.join(search_terms))
 
 @click.command(short_help="Print note contents to stdout.")
-@click.option('-k', '--key', type=click.INT, help="Specify the note key.")
+@click.option('-k', '--key', type=NOTE_KEY, help="Specify the note key.")
 @click.option(
         '-r',
         '--regex',
@@ -154,12 +190,22 @@ def sync():
     """
     pass
 
+@click.command(short_help="Print timing stats.")
+@click.option('--reset', is_flag=True, help="Forget all recorded stats.")
+@click.pass_obj
+def stats(nncli, reset):
+    """
+    Print how long loading, searching, syncing and server requests
+    have taken in recent nncli runs, and how often they happened.
+    """
+    nncli.cli_stats(reset)
+
 @click.command()
 @click.option(
         '-k',
         '--key',
         required=True,
-        type=click.INT,
+        type=NOTE_KEY,
         help="Specify the note key."
         )
 @click.pass_obj
@@ -172,7 +218,7 @@ def delete(nncli, key):
         '-k',
         '--key',
         required=True,
-        type=click.INT,
+        type=NOTE_KEY,
         help="Specify the note key."
         )
 @click.pass_obj
@@ -203,6 +249,44 @@ def create(nncli, title, from_stdin):
     """
     nncli.cli_note_create(from_stdin, title)
 
+@click.command(short_help="Run commands from a resident process.")
+@click.option('--stop', is_flag=True, help="Stop the running daemon.")
+@click.pass_context
+def daemon(ctx, stop):
+    """
+    Keep the note database loaded and in sync in a resident process.
+    While it runs, commands that don't open the editor are sent to it
+    instead of loading the database themselves.
+    """
+    config_file = ctx.parent.params['config']
+    if stop:
+        if not nncli_daemon.stop(config_file):
+            raise click.ClickException('No daemon is running.')
+        return
+    try:
+        server = nncli_daemon.Daemon(
+                ctx.obj, nncli_daemon.socket_path(config_file),
+                lambda args: main.main(args=args, prog_name='nncli',
+                                       obj=ctx.obj))
+    except OSError as ex:
+        raise click.ClickException(str(ex))
+    server.serve()
+
+def start_profile(ctx):
+    """Profile the rest of the run, writing the results when it ends"""
+    from .profiler import Profiler
+    profiler = Profiler()
+
+    def stop_profile():
+        if ctx.obj is None:
+            return
+        directory = os.path.dirname(ctx.obj.logger.logfile)
+        for path in profiler.stop(directory):
+            click.echo('Profile written to {}'.format(path), err=True)
+
+    profiler.start()
+    ctx.call_on_close(stop_profile)
+
 @click.group(invoke_without_command=True)
 @click.option(
         '-n',
@@ -217,18 +301,45 @@ def create(nncli, title, from_stdin):
         type=click.Path(exists=True),
         help="Specify the config file to read from."
         )
-@click.option('-k', '--key', type=click.INT, help="Specify the note key.")
+@click.option('-k', '--key', type=NOTE_KEY, help="Specify the note key.")
+@click.option(
+        '--profile',
+        is_flag=True,
+        help="Profile the run and write a report next to nncli.log."
+        )
 @click.version_option(version=__version__, message='%(prog)s %(version)s')
 @click.pass_context
-def main(ctx, nosync, verbose, config, key):
+def main(ctx, nosync, verbose, config, key, profile):
     """
     Run the NextClound Note Command Line Interface. No COMMAND means
     to open the console GUI.
     """
+    if ctx.obj is not None:
+        # run by the daemon, reuse its notes database
+        ctx.obj.config.state.do_server_sync = not nosync
+        ctx.obj.config.state.verbose = verbose
+        if not nosync:
+            ctx.obj.ndb.sync_now()
+        return
+
+    command = ctx.invoked_subcommand
+    args = nncli_daemon.command_args(sys.argv[1:], command)
+    if not profile and nncli_daemon.forwardable(command, args):
+        status = nncli_daemon.forward(
+                config,
+                (['-n'] if nosync else []) + (['-v'] if verbose else []) + \
+                        [command] + args)
+        if status is not None:
+            ctx.exit(status)
+
+    if profile:
+        start_profile(ctx)
+    # loaded here so commands sent to the daemon don't pay for it
+    from .nncli import Nncli
     ctx.obj = Nncli(not nosync, verbose, config)
-    if ctx.invoked_subcommand is None:
+    if command is None:
         ctx.obj.gui(key)
-    elif not nosync:
+    elif not nosync and command != 'daemon':
         ctx.obj.ndb.sync_notes()
 
 main.add_command(create)
@@ -242,3 +353,5 @@ main.add_command(export)
 main.add_command(favorite)
 main.add_command(unfavorite)
 main.add_command(cat)
+main.add_command(stats)
+main.add_command(daemon)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""codec module
+
+Single entry point for JSON encoding and decoding in nncli. The fastest
+available backend is picked at import time (orjson, then ujson, then the
+standard library). Output is compact unless pretty printing is requested,
+which should only be done for output meant to be read by humans.
+"""
+import codecs
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+if orjson is not None:
+    BACKEND = 'orjson'
+elif ujson is not None:
+    BACKEND = 'ujson'
+else:
+    BACKEND = 'json'
+
+def dumpb(obj, pretty=False):
+    """Encode obj as UTF-8 JSON bytes"""
+    if BACKEND == 'orjson':
+        return orjson.dumps(obj,
+                            option=orjson.OPT_INDENT_2 if pretty else 0)
+    return dumps(obj, pretty=pretty).encode('utf-8')
+
+def dumps(obj, pretty=False):
+    """Encode obj as a JSON string"""
+    if BACKEND == 'orjson':
+        return dumpb(obj, pretty=pretty).decode('utf-8')
+    if BACKEND == 'ujson':
+        return ujson.dumps(obj, ensure_ascii=False,
+                           indent=2 if pretty else 0)
+    if pretty:
+        return json.dumps(obj, indent=2)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+def loads(data):
+    """Decode a JSON document given as str or bytes
+
+    Raises ValueError on malformed input, whatever the backend.
+    """
+    if BACKEND == 'orjson':
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf-8')
+    if BACKEND == 'ujson':
+        return ujson.loads(data)
+    return json.loads(data)
+
+def load_file(path):
+    """Read and decode the JSON file at path"""
+    with open(path, 'rb') as fobj:
+        return loads(fobj.read())
+
+def dump_file(obj, path, pretty=False):
+    """Encode obj and write it to the file at path"""
+    with open(path, 'wb') as fobj:
+        fobj.write(dumpb(obj, pretty=pretty))
+
+_DECODER = json.JSONDecoder()
+
+# characters that can end a number inside an array
+_DELIMITERS = ',] \t\r\n'
+
+def _is_number(value):
+    """True if value was decoded from a JSON number"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _read_more(buf, chunks, text, wanted):
+    """
+    Append at least wanted characters from chunks to buf, fewer at the
+    end of the input. Returns the new buffer and whether the input ended.
+    """
+    parts = [buf]
+    added = 0
+    for chunk in chunks:
+        part = text.decode(chunk)
+        parts.append(part)
+        added += len(part)
+        if added >= wanted:
+            return ''.join(parts), False
+    parts.append(text.decode(b'', final=True))
+    return ''.join(parts), True
+
+def iter_array(chunks):
+    """Decode a JSON array given as an iterable of UTF-8 byte chunks
+
+    Yields the elements one at a time as soon as they are complete, so
+    only the element being decoded has to be held in memory rather than
+    the whole document. Decoding uses the standard library whatever the
+    backend. Raises ValueError on malformed input.
+    """
+    chunks = iter(chunks)
+    text = codecs.getincrementaldecoder('utf-8')()
+    buf, pos, eof = '', 0, False
+    started = after_value = False
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise ValueError('unexpected end of JSON array')
+            buf, eof = _read_more(buf[pos:], chunks, text, 1)
+            pos = 0
+            continue
+        char = buf[pos]
+        if not started:
+            if char != '[':
+                raise ValueError('expected a JSON array')
+            started = True
+            pos += 1
+        elif char == ']':
+            return
+        elif after_value:
+            if char != ',':
+                raise ValueError('expected , or ] at {}'.format(pos))
+            after_value = False
+            pos += 1
+        else:
+            try:
+                value, end = _DECODER.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                end = None
+            # a number not followed by a delimiter may go on in the next
+            # chunk; read at least as much again as is buffered, so a
+            # long element isn't decoded over and over
+            if end is None or (not eof and _is_number(value) and
+                               (end == len(buf) or
+                                buf[end] not in _DELIMITERS)):
+                buf, eof = _read_more(buf[pos:], chunks, text,
+                                      len(buf) - pos)
+                pos = 0
+                continue
+            pos = end
+            after_value = True
+            yield value
@@ -29,21 +29,27 @@ class Config:
                 'cfg_nn_username'       : '',
                 'cfg_nn_password'       : '',
                 'cfg_nn_password_eval'  : '',
+                'cfg_nn_password_cache_ttl' : '0',
                 'cfg_db_path'           : self.cache_home,
                 'cfg_search_categories' : 'yes',  # with regex searches
+                'cfg_search_live'       : 'yes',
                 'cfg_sort_mode'         : 'date', # 'alpha' or 'date'
                 'cfg_favorite_ontop'    : 'yes',
                 'cfg_tabstop'           : '4',
                 'cfg_format_strftime'   : '%Y/%m/%d',
-                'cfg_format_note_title' : '[%D] %F %-N %T',
+                'cfg_format_note_title' : '[%D] %F %-N %T %A',
                 'cfg_status_bar'        : 'yes',
+                'cfg_editor_terminal'   : '',
                 'cfg_pager'             : os.environ['PAGER'] \
                         if 'PAGER' in os.environ else 'less -c',
                 'cfg_max_logs'          : '5',
                 'cfg_log_timeout'       : '5',
                 'cfg_log_reversed'      : 'yes',
+                'cfg_log_level'         : 'info',
                 'cfg_nn_host'           : '',
                 'cfg_tempdir'           : '',
+                'cfg_stats'             : 'yes',
+                'cfg_metrics_file'      : '',
 
                 'kb_help'            : 'h',
                 'kb_quit'            : 'q',
@@ -66,6 +72,7 @@ class Config:
                 'kb_view_next_note'  : 'J',
                 'kb_view_prev_note'  : 'K',
                 'kb_view_log'        : 'l',
+                'kb_view_stats'      : 'i',
                 'kb_tabstop2'        : '2',
                 'kb_tabstop4'        : '4',
                 'kb_tabstop8'        : '8',
@@ -150,6 +157,7 @@ class Config:
 
         # ordered dicts used to ease help
         self._create_configs_dict(parser, cfg_sec)
+        self._create_accounts_dict(parser)
         self._create_keybinds_dict(parser, cfg_sec)
         self._create_colors_dict(parser, cfg_sec)
 
@@ -214,6 +222,12 @@ class Config:
                         ['common'],
                         'View log'
                 ]
+        self.keybinds['view_stats'] = \
+                [
+                        parser.get(cfg_sec, 'kb_view_stats'),
+                        ['common'],
+                        'View timing stats'
+                ]
         self.keybinds['create_note'] = \
                 [
                         parser.get(cfg_sec, 'kb_create_note'),
@@ -529,6 +543,43 @@ class Config:
                         'Help description bg'
                 ]
 
+    def _eval_password(self, parser, cfg_sec, command):
+        """
+        Run the password command, or take its output from the credential
+        cache if cfg_nn_password_cache_ttl is set
+        """
+        from . import credcache
+        ttl = int(parser.get(cfg_sec, 'cfg_nn_password_cache_ttl'))
+        if ttl > 0 and credcache.available():
+            path = credcache.socket_path(self.cache_home)
+            key = credcache.secret_key(
+                    command,
+                    parser.get(cfg_sec, 'cfg_nn_username', raw=True),
+                    parser.get(cfg_sec, 'cfg_nn_host', raw=True))
+            nn_password = credcache.get(path, key)
+            if nn_password is not None:
+                return nn_password
+        else:
+            path = None
+
+        try:
+            nn_password = subprocess.check_output(
+                    command,
+                    shell=True,
+                    universal_newlines=True
+                    )
+            # remove trailing newlines to avoid requiring
+            # butchering shell commands (they can't usually be
+            # in passwords anyway)
+            nn_password = nn_password.rstrip('\n')
+        except subprocess.CalledProcessError as ex:
+            print('Error evaluating command for password: %s' % ex)
+            sys.exit(1)
+
+        if path is not None:
+            credcache.put(path, key, nn_password, ttl)
+        return nn_password
+
     def _create_configs_dict(self, parser, cfg_sec):
         """Create an OrderedDict object with the configs"""
 
@@ -538,19 +589,7 @@ class Config:
         if not nn_password:
             command = parser.get(cfg_sec, 'cfg_nn_password_eval', raw=True)
             if command:
-                try:
-                    nn_password = subprocess.check_output(
-                            command,
-                            shell=True,
-                            universal_newlines=True
-                            )
-                    # remove trailing newlines to avoid requiring
-                    # butchering shell commands (they can't usually be
-                    # in passwords anyway)
-                    nn_password = nn_password.rstrip('\n')
-                except subprocess.CalledProcessError as ex:
-                    print('Error evaluating command for password: %s' % ex)
-                    sys.exit(1)
+                nn_password = self._eval_password(parser, cfg_sec, command)
 
         self.configs = collections.OrderedDict()
         self.configs['nn_username'] = \
@@ -571,6 +610,11 @@ class Config:
                         parser.get(cfg_sec, 'cfg_search_categories'),
                         'Search categories as well'
                 ]
+        self.configs['search_live'] = \
+                [
+                        parser.get(cfg_sec, 'cfg_search_live'),
+                        'Search note list as you type'
+                ]
         self.configs['sort_mode'] = \
                 [parser.get(cfg_sec, 'cfg_sort_mode'), 'Sort mode']
         self.configs['favorite_ontop'] = \
@@ -594,6 +638,11 @@ class Config:
                 [parser.get(cfg_sec, 'cfg_status_bar'), 'Show the status bar']
         self.configs['editor'] = \
                 [parser.get(cfg_sec, 'cfg_editor'), 'Editor command']
+        self.configs['editor_terminal'] = \
+                [
+                        parser.get(cfg_sec, 'cfg_editor_terminal'),
+                        'Terminal to run the editor in'
+                ]
         self.configs['pager'] = \
                 [parser.get(cfg_sec, 'cfg_pager'), 'External pager command']
         self.configs['max_logs'] = \
@@ -602,12 +651,64 @@ class Config:
                 [parser.get(cfg_sec, 'cfg_log_timeout'), 'Log timeout']
         self.configs['log_reversed'] = \
                 [parser.get(cfg_sec, 'cfg_log_reversed'), 'Log file reversed']
+        self.configs['log_level'] = \
+                [parser.get(cfg_sec, 'cfg_log_level'), 'Log file level']
         self.configs['tempdir'] = \
                 [
                         None if parser.get(cfg_sec, 'cfg_tempdir') == '' \
                                 else parser.get(cfg_sec, 'cfg_tempdir'),
                         'Temporary directory for note storage'
                 ]
+        self.configs['stats'] = \
+                [parser.get(cfg_sec, 'cfg_stats'), 'Record timing stats']
+        self.configs['metrics_file'] = \
+                [
+                        None if parser.get(cfg_sec, 'cfg_metrics_file') == '' \
+                                else os.path.expanduser(
+                                        parser.get(cfg_sec,
+                                                   'cfg_metrics_file')),
+                        'Sync metrics textfile'
+                ]
+
+    def _create_accounts_dict(self, parser):
+        """
+        Create an OrderedDict object with the settings of the extra
+        accounts, each declared in an [account NAME] section
+        """
+        self.accounts = collections.OrderedDict()
+        for section in parser.sections():
+            if not section.startswith('account '):
+                continue
+            name = section[len('account '):].strip()
+            if not name or ':' in name or os.sep in name:
+                print('Invalid account name: %r' % name)
+                sys.exit(1)
+
+            nn_password = parser.get(section, 'cfg_nn_password', raw=True)
+            if not nn_password:
+                command = parser.get(section, 'cfg_nn_password_eval',
+                                     raw=True)
+                if command:
+                    nn_password = self._eval_password(parser, section,
+                                                      command)
+
+            db_path = parser.get(section, 'cfg_db_path')
+            if db_path == parser.defaults()['cfg_db_path']:
+                db_path = os.path.join(self.get_config('db_path'), name)
+
+            metrics_file = self.get_config('metrics_file')
+            if metrics_file:
+                root, ext = os.path.splitext(metrics_file)
+                metrics_file = '{0}-{1}{2}'.format(root, name, ext)
+
+            self.accounts[name] = {
+                    'nn_username': parser.get(section, 'cfg_nn_username',
+                                              raw=True),
+                    'nn_password': nn_password,
+                    'nn_host': parser.get(section, 'cfg_nn_host', raw=True),
+                    'db_path': os.path.expanduser(db_path),
+                    'metrics_file': metrics_file
+            }
 
     def get_config(self, name):
         """Get a config value"""
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""credcache module
+
+A small per-user agent that keeps secrets in memory for a limited time,
+so that an expensive cfg_nn_password_eval command only has to be run
+once per TTL instead of on every nncli launch. The agent listens on a
+Unix socket only its owner can reach, is started on demand by the first
+client that stores a secret and exits once it holds no more secrets.
+Requests and replies are single lines of JSON.
+"""
+import hashlib
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from . import ipc
+
+SOCKET_NAME = 'nncli-credcache.sock'
+
+# seconds a freshly started agent waits for its first secret
+AGENT_IDLE_TIMEOUT = 10.0
+
+# seconds a client waits for the agent to answer or to start
+CLIENT_TIMEOUT = 1.0
+
+def socket_path(cache_home):
+    """Return where the agent of the current user listens"""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, SOCKET_NAME)
+    return os.path.join(cache_home, SOCKET_NAME)
+
+def secret_key(*parts):
+    """Return the key a secret derived from parts is cached under"""
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+def available():
+    """True if the platform supports the agent"""
+    return hasattr(socket, 'AF_UNIX')
+
+class CredentialAgent(ipc.Server):
+    """
+    CredentialAgent class
+
+    Serves get and put requests for secrets kept in memory until
+    their TTL runs out.
+    """
+    def __init__(self, path):
+        # secret key -> (expiry time, secret)
+        self.secrets = {}
+        self.idle_deadline = time.monotonic() + AGENT_IDLE_TIMEOUT
+        # a socket already at path was left behind by an agent that
+        # died, a live one would have answered the client that started
+        # this agent
+        super(CredentialAgent, self).__init__(path)
+
+    def handle_request_data(self, request):
+        """Return the reply to a decoded request"""
+        self._expire()
+        operation = request['op']
+        if operation == 'get':
+            entry = self.secrets.get(request['key'])
+            if entry is None:
+                return {'status': 'miss'}
+            return {'status': 'ok', 'secret': entry[1]}
+        if operation == 'put':
+            self.secrets[request['key']] = \
+                    (time.monotonic() + float(request['ttl']),
+                     request['secret'])
+            return {'status': 'ok'}
+        return {'status': 'error'}
+
+    def _expire(self):
+        """Drop the secrets whose TTL ran out"""
+        now = time.monotonic()
+        self.secrets = {key: entry for key, entry in self.secrets.items()
+                        if entry[0] > now}
+
+    def serve(self):
+        """Serve requests until no secrets are left"""
+        try:
+            while True:
+                self._expire()
+                now = time.monotonic()
+                if self.secrets:
+                    deadline = min(entry[0]
+                                   for entry in self.secrets.values())
+                elif now < self.idle_deadline:
+                    deadline = self.idle_deadline
+                else:
+                    break
+                self.timeout = max(deadline - now, 0)
+                self.handle_request()
+        finally:
+            self.close()
+
+def _request(path, request):
+    """Send request to the agent at path, return the reply or None"""
+    return ipc.request(path, request, CLIENT_TIMEOUT, CLIENT_TIMEOUT)
+
+def _start_agent(path):
+    """Start an agent on path in the background"""
+    subprocess.Popen([sys.executable, '-m', 'nncli.credcache', path],
+                     stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+def get(path, key):
+    """Return the secret cached under key, None if there is none"""
+    reply = _request(path, {'op': 'get', 'key': key})
+    if reply is None or reply.get('status') != 'ok':
+        return None
+    return reply['secret']
+
+def put(path, key, secret, ttl):
+    """
+    Cache secret under key for ttl seconds, starting the agent if it
+    isn't running. Returns True if the secret was stored.
+    """
+    request = {'op': 'put', 'key': key, 'secret': secret, 'ttl': ttl}
+    if _request(path, request) is not None:
+        return True
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    _start_agent(path)
+    deadline = time.monotonic() + CLIENT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.02)
+        if _request(path, request) is not None:
+            return True
+    return False
+
+if __name__ == '__main__':
+    CredentialAgent(sys.argv[1]).serve()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""daemon module
+
+A resident nncli process that keeps the notes database loaded and the
+sync worker running, and runs CLI commands sent to it over a Unix
+socket. Each request is one line of JSON holding the command line and
+the data to use as stdin; the reply is one line of JSON holding the
+command's output and exit status. A client falls back to running the
+command itself whenever no daemon answers.
+"""
+import contextlib
+import hashlib
+import io
+import logging
+import os
+import socket
+import sys
+import time
+import traceback
+
+from appdirs import user_cache_dir
+
+from . import ipc
+
+# commands that don't need a terminal and can be run by the daemon
+FORWARDED_COMMANDS = ('list', 'dump', 'export', 'favorite', 'unfavorite',
+                      'delete', 'sync', 'cat', 'stats', 'create', 'import')
+
+# commands that open the editor unless given - to read from stdin
+STDIN_COMMANDS = ('create', 'import')
+
+# seconds a client waits for the daemon to answer a ping, or to take a
+# command; the command itself may run for as long as it needs
+CLIENT_TIMEOUT = 1.0
+
+# seconds between syncs of the daemon's notes database
+SYNC_INTERVAL = 15
+
+# options of the main command that take a value
+_VALUE_OPTIONS = ('-c', '--config', '-k', '--key')
+
+def socket_path(config_file=None):
+    """Return where the daemon for config_file listens"""
+    config_id = hashlib.sha256(
+            os.path.abspath(config_file).encode('utf-8')
+            if config_file else b'').hexdigest()[:16]
+    name = 'nncli-daemon-{}.sock'.format(config_id)
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, name)
+    return os.path.join(user_cache_dir('nncli', 'djmoch'), name)
+
+def command_args(argv, command):
+    """Return the arguments given to command in argv, None if not found"""
+    i = 0
+    while i < len(argv):
+        if argv[i] in _VALUE_OPTIONS:
+            i += 2
+            continue
+        if argv[i] == command:
+            return argv[i + 1:]
+        i += 1
+    return None
+
+def forwardable(command, args):
+    """True if the daemon can run command with args"""
+    if command not in FORWARDED_COMMANDS or args is None:
+        return False
+    if command in STDIN_COMMANDS:
+        return '-' in args
+    return True
+
+def _send(path, request, wait=False):
+    """
+    Send request to the daemon at path, return the reply or None. With
+    wait the reply is waited for however long it takes.
+    """
+    return ipc.request(path, request, CLIENT_TIMEOUT,
+                       None if wait else CLIENT_TIMEOUT)
+
+def forward(config_file, args):
+    """
+    Have the daemon for config_file run the command line args. Returns
+    the exit status, or None if no daemon is running, in which case the
+    command should be run in this process.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    path = socket_path(config_file)
+    if not os.path.exists(path):
+        return None
+    # a daemon that is wedged or busy still accepts connections, make
+    # sure it answers before handing it a command it might never run
+    if _send(path, {'op': 'ping'}) is None:
+        return None
+    stdin = None
+    if '-' in args:
+        stdin = sys.stdin.read()
+    reply = _send(path, {'op': 'run', 'args': args, 'stdin': stdin},
+                  wait=True)
+    if reply is None:
+        if stdin is not None:
+            # let the command read it again when run here
+            sys.stdin = io.StringIO(stdin)
+        return None
+    sys.stdout.write(reply['stdout'])
+    sys.stderr.write(reply['stderr'])
+    return reply['status']
+
+def stop(config_file=None):
+    """Ask the daemon for config_file to exit, True if it was running"""
+    return _send(socket_path(config_file), {'op': 'stop'}) is not None
+
+class Daemon(ipc.Server):
+    """
+    Daemon class
+
+    Runs requests one at a time with run(args), a function running the
+    command line args against the resident Nncli object, and syncs the
+    notes database in between. Everything runs on one thread, as it
+    would in a nncli process started for each command.
+    """
+    bad_request_reply = {'stdout': '', 'stderr': 'nncli: bad request\n',
+                         'status': 2}
+
+    def __init__(self, nncli, path, run):
+        self.nncli = nncli
+        self.run = run
+        self.stopped = False
+        self.next_sync = 0
+        if os.path.exists(path) and \
+                _send(path, {'op': 'ping'}) is not None:
+            raise OSError('nncli daemon already running on ' + path)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        super(Daemon, self).__init__(path)
+
+    def handle_request_data(self, request):
+        """Return the reply to a decoded request"""
+        operation = request['op']
+        if operation == 'ping':
+            return {'status': 0}
+        if operation == 'stop':
+            self.stopped = True
+            return {'status': 0}
+        return self._run(request['args'], request.get('stdin'))
+
+    def _run(self, args, stdin):
+        """Run a command line, capturing what it prints"""
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        saved_stdin = sys.stdin
+        sys.stdin = io.StringIO(stdin or '')
+        status = 0
+        try:
+            with contextlib.redirect_stdout(stdout), \
+                    contextlib.redirect_stderr(stderr):
+                self.run(args)
+        except SystemExit as ex:
+            if isinstance(ex.code, int):
+                status = ex.code
+            elif ex.code is not None:
+                stderr.write('{}\n'.format(ex.code))
+                status = 1
+        except Exception: # pylint: disable=broad-except
+            # report it as the command would have when run by the client
+            traceback.print_exc(file=stderr)
+            status = 1
+        finally:
+            sys.stdin = saved_stdin
+        return {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(),
+                'status': status}
+
+    def _sync(self):
+        """Sync the notes database, and schedule the next sync"""
+        try:
+            self.nncli.ndb.sync_now(self.nncli.config.state.do_server_sync)
+        except Exception: # pylint: disable=broad-except
+            # the daemon keeps serving, as the sync worker would
+            logging.exception('Daemon sync failed')
+        self.next_sync = time.monotonic() + SYNC_INTERVAL
+
+    def serve(self):
+        """Serve requests until stopped, syncing between them"""
+        ndb = self.nncli.ndb
+        self.nncli.logger.log('Daemon listening on %s', self.path)
+        try:
+            while not self.stopped:
+                self.timeout = max(self.next_sync - time.monotonic(), 0)
+                self.handle_request()
+                # due after the timeout, or after a request while busy
+                if not self.stopped and time.monotonic() >= self.next_sync:
+                    self._sync()
+        finally:
+            self.close()
+            ndb.sync_now(do_server_sync=False)
+            self.nncli.logger.log('Daemon stopped')
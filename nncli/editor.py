@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""editor module"""
+import ctypes
+import ctypes.util
+import functools
+import logging
+import os
+import select
+import struct
+import subprocess
+import threading
+
+from . import temp
+
+# seconds between checks of the file when inotify isn't available
+WATCH_POLL_INTERVAL = 0.5
+
+# seconds after the last save of a note before it is synced
+SAVE_SYNC_DELAY = 2.0
+
+# inotify(7) constants
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct('iIII')
+
+@functools.lru_cache(maxsize=None)
+def _libc():
+    """Return libc if it provides inotify, None otherwise"""
+    name = ctypes.util.find_library('c')
+    if not name:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+    return libc
+
+class _Inotify:
+    """Watches a directory for files being written or renamed into it"""
+    def __init__(self, libc, directory):
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # the directory is watched because editors often save by writing
+        # a new file and renaming it over the old one
+        watch = libc.inotify_add_watch(
+                self.fd, os.fsencode(directory),
+                _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE)
+        if watch < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+
+    def wait(self, name, timeout):
+        """
+        Wait up to timeout seconds for an event on the file called name,
+        return True if there was one
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return False
+        name = os.fsencode(name)
+        offset = 0
+        found = False
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            if data[offset:offset + length].rstrip(b'\0') == name:
+                found = True
+            offset += length
+        return found
+
+    def close(self):
+        """Stop watching"""
+        os.close(self.fd)
+
+class FileWatcher(threading.Thread):
+    """
+    FileWatcher class
+
+    Calls callback from a background thread every time the file at path
+    changes. Uses inotify where available and polls otherwise; either
+    way a change is only reported when the file's size, modification
+    time or inode differ from the last check.
+    """
+    def __init__(self, path, callback, interval=WATCH_POLL_INTERVAL):
+        super(FileWatcher, self).__init__(daemon=True)
+        self.path = path
+        self.callback = callback
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.signature = self._signature()
+        self.inotify = None
+
+    def _signature(self):
+        """Return what identifies the current version of the file"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def run(self):
+        libc = _libc()
+        if libc is not None:
+            try:
+                self.inotify = _Inotify(libc,
+                                        os.path.dirname(self.path) or '.')
+            except OSError:
+                self.inotify = None
+        name = os.path.basename(self.path)
+        while not self.stopped.is_set():
+            if self.inotify is not None:
+                self.inotify.wait(name, self.interval)
+            else:
+                self.stopped.wait(self.interval)
+            self.check()
+        if self.inotify is not None:
+            self.inotify.close()
+
+    def check(self):
+        """Call the callback if the file changed since the last check"""
+        signature = self._signature()
+        if signature is None or signature == self.signature:
+            return
+        self.signature = signature
+        try:
+            self.callback()
+        except Exception: # pylint: disable=broad-except
+            logging.exception('file watcher callback failed')
+
+    def stop(self):
+        """Stop watching and wait for the thread to finish"""
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+
+class Debouncer:
+    """Calls func once delay seconds have passed since the last trigger"""
+    def __init__(self, delay, func):
+        self.delay = delay
+        self.func = func
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def trigger(self):
+        """(Re)start the countdown"""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.delay, self.func)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """Call func now if a countdown is running"""
+        with self.lock:
+            timer, self.timer = self.timer, None
+        if timer is not None:
+            timer.cancel()
+            self.func()
+
+class EditSession:
+    """
+    EditSession class
+
+    An external editor working on a note's temp file. Every save of the
+    file is applied to the note database right away and a sync is
+    scheduled once the saves stop, so nothing is lost if the session
+    ends badly and other clients see the changes during long edits.
+    """
+    def __init__(self, ndb, key, tfile, on_change=None):
+        self.ndb = ndb
+        self.key = key
+        self.tfile = tfile
+        self.on_change = on_change
+        self.original = ndb.get_note(key)['content']
+        self.applied = self.original
+        # set once a save couldn't be applied because the note is gone
+        self.failed = False
+        self.sync = Debouncer(SAVE_SYNC_DELAY, ndb.sync_worker_go)
+        self.watcher = FileWatcher(temp.tempfile_name(tfile), self.apply)
+
+    def apply(self):
+        """Apply the current contents of the temp file to the note"""
+        content = temp.tempfile_content(self.tfile)
+        if self.failed or not content or content == '\n' or \
+                content == self.applied:
+            return
+        # the sync worker may be pushing the note right now, and may
+        # give a new note another key
+        with self.ndb.note_lock(self.key):
+            self.key = self.ndb.current_key(self.key)
+            try:
+                self.ndb.set_note_content(self.key, content)
+            except KeyError:
+                logging.warning('Edited note is gone (key=%s)', self.key)
+                self.failed = True
+                return
+        self.applied = content
+        self.sync.trigger()
+        if self.on_change is not None:
+            self.on_change()
+
+    @property
+    def changed(self):
+        """True if the note differs from when the session started"""
+        return self.applied != self.original
+
+    def run(self, cmd_list):
+        """Run the editor, blocking until it exits"""
+        self.watcher.start()
+        try:
+            subprocess.call(cmd_list)
+        finally:
+            self.finish()
+
+    def start(self, cmd_list, on_exit):
+        """
+        Run the editor in the background; on_exit is called from another
+        thread once it has exited and its last save was applied
+        """
+        try:
+            process = subprocess.Popen(cmd_list,
+                                       stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL)
+        except OSError:
+            temp.tempfile_delete(self.tfile)
+            raise
+
+        def wait():
+            process.wait()
+            self.finish()
+            if on_exit is not None:
+                on_exit(self)
+
+        self.watcher.start()
+        threading.Thread(target=wait, daemon=True).start()
+
+    def finish(self):
+        """Apply the last save and clean up"""
+        self.watcher.stop()
+        try:
+            self.apply()
+        finally:
+            temp.tempfile_delete(self.tfile)
+            self.sync.flush()
@@ -1,12 +1,56 @@
 # -*- coding: utf-8 -*-
 """nncli_gui module"""
+import collections
 import hashlib
+import os
 import subprocess
 import threading
+import time
 
 import urwid
-from . import view_titles, view_note, view_help, view_log, user_input
-from .utils import exec_cmd_on_note, get_pager
+from . import view_titles, view_note, view_help, view_log, view_stats, \
+        user_input, stats
+from .utils import edit_note_session, exec_cmd_on_note, get_pager
+
+# seconds of typing inactivity before a live search is run
+SEARCH_LIVE_DELAY = 0.05
+
+# keybinds whose repeats read in one go are applied as a single move
+REPEATABLE_KEYBINDS = ('down', 'up', 'page_down', 'page_up',
+                       'half_page_down', 'half_page_up',
+                       'view_next_note', 'view_prev_note')
+
+# keys typed before a key to give its count
+DIGIT_KEYS = tuple('0123456789')
+
+class RepeatedKey(str):
+    """A key pressed repeat times in a row"""
+    repeat = 1
+
+class RedrawMainLoop(urwid.MainLoop):
+    """
+    RedrawMainLoop class
+
+    A MainLoop that only redraws the screen when input was handled or
+    the GUI marked it dirty, so all the changes made while handling one
+    event are drawn together.
+    """
+    def __init__(self, *args, **kwargs):
+        self.dirty = True
+        super(RedrawMainLoop, self).__init__(*args, **kwargs)
+
+    def process_input(self, keys):
+        self.dirty = True
+        return super(RedrawMainLoop, self).process_input(keys)
+
+    def entering_idle(self):
+        if self.dirty:
+            self.dirty = False
+            super(RedrawMainLoop, self).entering_idle()
+
+    def draw_screen(self):
+        with stats.timer('gui.draw'):
+            super(RedrawMainLoop, self).draw_screen()
 
 # pylint: disable=too-many-instance-attributes, unused-argument
 class NncliGui:
@@ -21,9 +65,27 @@ class NncliGui:
                 self.config.get_config('sort_mode')
 
 
+        # footer log messages as (expiry time, message), oldest first
         self.log_lock = threading.Lock()
-        self.log_alarms = 0
-        self.logs = []
+        self.logs = collections.deque(
+                maxlen=int(self.config.get_config('max_logs')))
+        self.log_alarm = None
+
+        # count and keys typed so far of a multi-key command
+        self.key_count = ''
+        self.key_pending = ()
+        self._gui_build_keymap()
+
+        # calls handed to the main loop by other threads, in order
+        self.pending_lock = threading.Lock()
+        self.pending_calls = collections.OrderedDict()
+
+        # edit sessions whose editor runs in its own terminal
+        self.edit_sessions = set()
+
+        # pending live search alarm and the search to restore on cancel
+        self.search_live_alarm = None
+        self.search_live_restore = None
 
         self.thread_sync = threading.Thread(
                 target=self.ndb.sync_worker,
@@ -51,6 +113,7 @@ class NncliGui:
                     )
 
         self.view_log = view_log.ViewLog(self.config, self.logger)
+        self.view_stats = view_stats.ViewStats(self.config, self.ndb)
         self.view_help = view_help.ViewHelp(self.config)
 
         palette = \
@@ -177,40 +240,69 @@ class NncliGui:
                 footer=urwid.Pile([urwid.Pile([]), urwid.Pile([])]),
                 focus_part='body')
 
-        self.nncli_loop = urwid.MainLoop(self.master_frame,
+        self.nncli_loop = RedrawMainLoop(self.master_frame,
                                          palette,
-                                         handle_mouse=False)
+                                         handle_mouse=False,
+                                         input_filter=self._gui_input_filter)
 
         self.nncli_loop.set_alarm_in(0, self._gui_init_view, \
                 bool(key))
 
+        # other threads write here to wake the main loop up
+        self.wakeup_pipe = self.nncli_loop.watch_pipe(self._gui_run_pending)
+
     def run(self):
         """Run the GUI"""
         self.nncli_loop.run()
 
+    def _gui_redraw(self):
+        """Redraw the screen once the current event has been handled"""
+        self.nncli_loop.dirty = True
+
+    def _gui_call_soon(self, func):
+        """
+        Have the main loop call func. May be called from any thread;
+        repeated requests for the same func before it runs are merged.
+        """
+        with self.pending_lock:
+            wakeup = not self.pending_calls
+            self.pending_calls[func] = None
+        if wakeup:
+            os.write(self.wakeup_pipe, b'x')
+
+    def _gui_run_pending(self, data):
+        """Run the calls handed over by other threads"""
+        with self.pending_lock:
+            calls = list(self.pending_calls)
+            self.pending_calls.clear()
+        for func in calls:
+            func()
+        self._gui_redraw()
+        return True
+
     def _gui_header_clear(self):
         """Clear the console GUI header row"""
         self.master_frame.contents['header'] = (None, None)
-        self.nncli_loop.draw_screen()
+        self._gui_redraw()
 
     def _gui_header_set(self, widget):
         """Set the content of the console GUI header row"""
         self.master_frame.contents['header'] = (widget, None)
-        self.nncli_loop.draw_screen()
+        self._gui_redraw()
 
     def _gui_footer_log_clear(self):
         """Clear the log at the bottom of the GUI"""
         gui = self._gui_footer_input_get()
         self.master_frame.contents['footer'] = \
                 (urwid.Pile([urwid.Pile([]), urwid.Pile([gui])]), None)
-        self.nncli_loop.draw_screen()
+        self._gui_redraw()
 
     def _gui_footer_log_set(self, pile):
         """Set the log at the bottom of the GUI"""
         gui = self._gui_footer_input_get()
         self.master_frame.contents['footer'] = \
                 (urwid.Pile([urwid.Pile(pile), urwid.Pile([gui])]), None)
-        self.nncli_loop.draw_screen()
+        self._gui_redraw()
 
     def _gui_footer_log_get(self):
         """Get the log at the bottom of the GUI"""
@@ -221,14 +313,14 @@ class NncliGui:
         pile = self._gui_footer_log_get()
         self.master_frame.contents['footer'] = \
                 (urwid.Pile([urwid.Pile([pile]), urwid.Pile([])]), None)
-        self.nncli_loop.draw_screen()
+        self._gui_redraw()
 
     def _gui_footer_input_set(self, gui):
         """Set the input at the bottom of the GUI"""
         pile = self._gui_footer_log_get()
         self.master_frame.contents['footer'] = \
                 (urwid.Pile([urwid.Pile([pile]), urwid.Pile([gui])]), None)
-        self.nncli_loop.draw_screen()
+        self._gui_redraw()
 
     def _gui_footer_input_get(self):
         """Get the input at the bottom of the GUI"""
@@ -243,7 +335,6 @@ class NncliGui:
         """Set the GUI body"""
         self.master_frame.contents['body'] = (widget, None)
         self._gui_update_status_bar()
-        self.nncli_loop.draw_screen()
 
     def gui_body_get(self):
         """Get the GUI body"""
@@ -258,6 +349,17 @@ class NncliGui:
         if not self.config.state.do_gui:
             return
 
+        if threading.current_thread() is not threading.main_thread():
+            # called by the sync worker, widgets belong to the main loop
+            self._gui_call_soon(self.gui_update_view)
+            return
+
+        with stats.timer('gui.update_view'):
+            self._gui_update_view()
+
+    def _gui_update_view(self):
+        """Refilter the note list and refresh the current view"""
+
         try:
             cur_key = self.view_titles.note_list \
                     [self.view_titles.focus_position].note['localkey']
@@ -266,6 +368,7 @@ class NncliGui:
 
         self.view_titles.update_note_list(
                 self.view_titles.search_string,
+                self.view_titles.search_mode,
                 sort_mode=self.config.state.current_sort_mode
                 )
         self.view_titles.focus_note(cur_key)
@@ -324,6 +427,16 @@ class NncliGui:
         self._gui_footer_input_clear()
         self._gui_body_focus()
         self.master_frame.keypress = self._gui_frame_keypress
+        restore = self._gui_search_live_cancel()
+        if restore is not None and not search_string:
+            # put back the list from before the search was started
+            self.view_titles.update_note_list(
+                    restore[0],
+                    restore[1],
+                    sort_mode=self.config.state.current_sort_mode,
+                    log_empty=False
+                    )
+            self._gui_body_set(self.view_titles)
         if search_string:
             if self.gui_body_get() == self.view_note:
                 self.config.state.search_direction = args[1]
@@ -339,6 +452,38 @@ class NncliGui:
                         )
                 self._gui_body_set(self.view_titles)
 
+    def _gui_search_change(self, args, search_string):
+        """Schedule a live search after the search input changed"""
+        if self.search_live_alarm is not None:
+            self.nncli_loop.remove_alarm(self.search_live_alarm)
+        self.search_live_alarm = self.nncli_loop.set_alarm_in(
+                SEARCH_LIVE_DELAY, self._gui_search_live,
+                (args[0], search_string))
+
+    def _gui_search_live(self, loop, args):
+        """Filter the note list with the search typed so far"""
+        self.search_live_alarm = None
+        self.view_titles.update_note_list(
+                args[1] if args[1] else None,
+                args[0],
+                sort_mode=self.config.state.current_sort_mode,
+                log_empty=False
+                )
+        self._gui_update_status_bar()
+
+    def _gui_search_live_cancel(self):
+        """
+        Drop any pending live search. Returns the (search_string,
+        search_mode) in effect before the live search started, or None
+        if no live search was in progress.
+        """
+        if self.search_live_alarm is not None:
+            self.nncli_loop.remove_alarm(self.search_live_alarm)
+            self.search_live_alarm = None
+        restore = self.search_live_restore
+        self.search_live_restore = None
+        return restore
+
     def _gui_category_input(self, args, category):
         """Create a category input at the GUI footer"""
         self._gui_footer_input_clear()
@@ -381,445 +526,587 @@ class NncliGui:
                 pipe.stdin.close()
                 pipe.wait()
             except OSError as ex:
-                self.log('Pipe error: %s' % ex)
+                self.log('Pipe error: %s', ex)
             finally:
                 self._gui_reset()
 
-    # pylint: disable=too-many-return-statements, too-many-branches
-    # pylint: disable=too-many-statements
+    def _gui_build_keymap(self):
+        """
+        Build the table mapping key sequences, as tuples of keys, to the
+        _key_* methods handling them. A keybind may be a sequence of
+        keys separated by commas, e.g. 'g,g'. When keybinds collide the
+        first one in the config wins.
+        """
+        self.keymap = {}
+        self.keymap_prefixes = set()
+        self.keymap_repeatable = set()
+        self.key_digits = {}
+        for name in self.config.keybinds:
+            keys = self.config.get_keybind(name)
+            sequence = tuple(keys.split(',')) \
+                    if len(keys) > 1 and ',' in keys else (keys,)
+            if len(sequence) == 1 and sequence[0] in DIGIT_KEYS:
+                self.key_digits.setdefault(sequence[0], set()).update(
+                        self.config.get_keybind_use(name))
+            handler = getattr(self, '_key_' + name, None)
+            if handler is None:
+                # handled by the view itself
+                continue
+            self.keymap.setdefault(sequence, handler)
+            for end in range(1, len(sequence)):
+                self.keymap_prefixes.add(sequence[:end])
+            if len(sequence) == 1 and name in REPEATABLE_KEYBINDS and \
+                    self.keymap[sequence] == handler:
+                self.keymap_repeatable.add(sequence[0])
+
+    def _gui_key_context(self):
+        """Return the keybind context of the current view"""
+        contents = self.gui_body_get()
+        if isinstance(contents, view_titles.ViewTitles):
+            return 'titles'
+        if isinstance(contents, view_note.ViewNote):
+            return 'notes'
+        return 'common'
+
+    def _gui_input_filter(self, keys, raw):
+        """
+        Collapse runs of the same movement key read in one go, as when a
+        key is held down, into one RepeatedKey so the net movement is
+        applied and rendered once. Stops at the first other key, which
+        may hand the keyboard to a footer input.
+        """
+        if self.master_frame.keypress != self._gui_frame_keypress or \
+                self.key_pending:
+            return keys
+
+        filtered = []
+        for index, key in enumerate(keys):
+            if key == ' ':
+                key = 'space'
+            if not isinstance(key, str) or \
+                    key not in self.keymap_repeatable:
+                filtered.extend(keys[index:])
+                break
+            if filtered and filtered[-1] == key:
+                filtered[-1].repeat += 1
+            else:
+                filtered.append(RepeatedKey(key))
+        return filtered
+
     def _gui_frame_keypress(self, size, key):
         """Keypress handler for the GUI"""
+        with stats.timer('gui.keypress'):
+            return self._gui_handle_keypress(size, key)
+
+    def _gui_handle_keypress(self, size, key):
+        """
+        Act on a keypress in the GUI body. Digits typed before a key
+        give the count for it, e.g. 50j moves down 50 lines.
+        """
         # convert space character into name
         if key == ' ':
             key = 'space'
 
-        contents = self.gui_body_get()
+        if key in DIGIT_KEYS and not self.key_pending and \
+                (self.key_count or key != '0') and \
+                (self.key_count or self._gui_key_context() not in
+                 self.key_digits.get(key, ())):
+            self.key_count += key
+            return None
+
+        if key == 'esc' and (self.key_count or self.key_pending):
+            self.key_count = ''
+            self.key_pending = ()
+            return None
+
+        sequence = self.key_pending + (key,)
+        if sequence not in self.keymap and self.key_pending and \
+                sequence not in self.keymap_prefixes:
+            # the pending keys lead nowhere, start over with this key
+            sequence = (key,)
+        if sequence in self.keymap_prefixes and sequence not in self.keymap:
+            self.key_pending = sequence
+            return None
+
+        count = int(self.key_count) if self.key_count else None
+        self.key_count = ''
+        self.key_pending = ()
+        repeat = getattr(key, 'repeat', 1)
+        if repeat > 1:
+            count = (count or 1) + repeat - 1
+
+        handler = self.keymap.get(sequence)
+        if handler is None:
+            return self.gui_body_get().keypress(size, key)
+
+        if handler(size, key, count) is not None:
+            return key
 
-        if key == self.config.get_keybind('quit'):
-            self._gui_switch_frame_body(None)
+        self._gui_update_status_bar()
+        return None
 
-        elif key == self.config.get_keybind('help'):
-            self._gui_switch_frame_body(self.view_help)
+    @staticmethod
+    def _gui_move_focus(contents, size, next_focus, coming_from):
+        """Move the focus of a list view to next_focus, kept in range"""
+        last = len(contents.body.positions()) - 1
+        contents.change_focus(size, max(0, min(next_focus, last)),
+                              offset_inset=0,
+                              coming_from=coming_from)
+
+    def _key_quit(self, size, key, count):
+        """Leave the current view"""
+        self._gui_switch_frame_body(None)
+
+    def _key_help(self, size, key, count):
+        """Show the help view"""
+        self._gui_switch_frame_body(self.view_help)
+
+    def _key_sync(self, size, key, count):
+        """Start a full sync"""
+        self.ndb.last_sync = 0
+        self.ndb.sync_worker_go()
 
-        elif key == self.config.get_keybind('sync'):
-            self.ndb.last_sync = 0
-            self.ndb.sync_worker_go()
+    def _key_view_log(self, size, key, count):
+        """Show the log view"""
+        self.view_log.update_log()
+        self._gui_switch_frame_body(self.view_log)
 
-        elif key == self.config.get_keybind('view_log'):
-            self.view_log.update_log()
-            self._gui_switch_frame_body(self.view_log)
+    def _key_view_stats(self, size, key, count):
+        """Show the stats view"""
+        self.view_stats.update_stats()
+        self._gui_switch_frame_body(self.view_stats)
 
-        elif key == self.config.get_keybind('down'):
-            if not contents.body.positions():
-                return None
-            last = len(contents.body.positions())
-            if contents.focus_position == (last - 1):
-                return None
-            contents.focus_position += 1
-            contents.render(size)
+    def _key_down(self, size, key, count):
+        """Move the focus down count lines"""
+        contents = self.gui_body_get()
+        if not contents.body.positions():
+            return None
+        last = len(contents.body.positions())
+        contents.focus_position = \
+                min(contents.focus_position + (count or 1), last - 1)
+        return None
 
-        elif key == self.config.get_keybind('up'):
-            if not contents.body.positions():
-                return None
-            if contents.focus_position == 0:
-                return None
-            contents.focus_position -= 1
-            contents.render(size)
+    def _key_up(self, size, key, count):
+        """Move the focus up count lines"""
+        contents = self.gui_body_get()
+        if not contents.body.positions():
+            return None
+        contents.focus_position = \
+                max(contents.focus_position - (count or 1), 0)
+        return None
 
-        elif key == self.config.get_keybind('page_down'):
-            if not contents.body.positions():
-                return None
+    def _key_page_down(self, size, key, count):
+        """Move the focus down count pages"""
+        contents = self.gui_body_get()
+        if not contents.body.positions():
+            return None
+        self._gui_move_focus(
+                contents, size,
+                contents.focus_position + size[1] * (count or 1),
+                'above')
+        return None
+
+    def _key_page_up(self, size, key, count):
+        """Move the focus up count pages"""
+        contents = self.gui_body_get()
+        if not contents.body.positions():
+            return None
+        step = size[1] * (count or 1)
+        if 'bottom' in contents.ends_visible(size):
             last = len(contents.body.positions())
-            next_focus = contents.focus_position + size[1]
-            if next_focus >= last:
-                next_focus = last - 1
-            contents.change_focus(size, next_focus,
-                                  offset_inset=0,
-                                  coming_from='above')
-
-        elif key == self.config.get_keybind('page_up'):
-            if not contents.body.positions():
-                return None
-            if 'bottom' in contents.ends_visible(size):
-                last = len(contents.body.positions())
-                next_focus = last - size[1] - size[1]
-            else:
-                next_focus = contents.focus_position - size[1]
-            if next_focus < 0:
-                next_focus = 0
-            contents.change_focus(size, next_focus,
-                                  offset_inset=0,
-                                  coming_from='below')
-
-        elif key == self.config.get_keybind('half_page_down'):
-            if not contents.body.positions():
-                return None
+            next_focus = last - size[1] - step
+        else:
+            next_focus = contents.focus_position - step
+        self._gui_move_focus(contents, size, next_focus, 'below')
+        return None
+
+    def _key_half_page_down(self, size, key, count):
+        """Move the focus down count half pages"""
+        contents = self.gui_body_get()
+        if not contents.body.positions():
+            return None
+        self._gui_move_focus(
+                contents, size,
+                contents.focus_position + (size[1] // 2) * (count or 1),
+                'above')
+        return None
+
+    def _key_half_page_up(self, size, key, count):
+        """Move the focus up count half pages"""
+        contents = self.gui_body_get()
+        if not contents.body.positions():
+            return None
+        step = (size[1] // 2) * (count or 1)
+        if 'bottom' in contents.ends_visible(size):
             last = len(contents.body.positions())
-            next_focus = contents.focus_position + (size[1] // 2)
-            if next_focus >= last:
-                next_focus = last - 1
-            contents.change_focus(size, next_focus,
-                                  offset_inset=0,
-                                  coming_from='above')
-
-        elif key == self.config.get_keybind('half_page_up'):
-            if not contents.body.positions():
-                return None
-            if 'bottom' in contents.ends_visible(size):
-                last = len(contents.body.positions())
-                next_focus = last - size[1] - (size[1] // 2)
-            else:
-                next_focus = contents.focus_position - (size[1] // 2)
-            if next_focus < 0:
-                next_focus = 0
-            contents.change_focus(size, next_focus,
-                                  offset_inset=0,
-                                  coming_from='below')
-
-        elif key == self.config.get_keybind('bottom'):
-            if not contents.body.positions():
-                return None
-            contents.change_focus(size, (len(contents.body.positions()) - 1),
-                                  offset_inset=0,
-                                  coming_from='above')
+            next_focus = last - size[1] - step
+        else:
+            next_focus = contents.focus_position - step
+        self._gui_move_focus(contents, size, next_focus, 'below')
+        return None
+
+    def _key_bottom(self, size, key, count):
+        """Move the focus to the last line, or to line count"""
+        contents = self.gui_body_get()
+        if not contents.body.positions():
+            return None
+        next_focus = count - 1 if count else \
+                len(contents.body.positions()) - 1
+        self._gui_move_focus(contents, size, next_focus, 'above')
+        return None
 
-        elif key == self.config.get_keybind('top'):
+    def _key_top(self, size, key, count):
+        """Move the focus to the first line, or to line count"""
+        contents = self.gui_body_get()
+        if not contents.body.positions():
+            return None
+        next_focus = count - 1 if count else 0
+        self._gui_move_focus(contents, size, next_focus, 'below')
+        return None
+
+    def _gui_view_other_note(self, step):
+        """Show the note step positions away in the note list"""
+        if self.gui_body_get().__class__ != view_note.ViewNote:
+            return False
+
+        if not self.view_titles.body.positions():
+            return True
+        last = len(self.view_titles.body.positions())
+        next_focus = max(0, min(self.view_titles.focus_position + step,
+                                last - 1))
+        if next_focus == self.view_titles.focus_position:
+            return True
+        self.view_titles.focus_position = next_focus
+        self.view_note.update_note_view(
+                self.view_titles. \
+                        note_list[self.view_titles. \
+                        focus_position].note['localkey']
+                )
+        self._gui_switch_frame_body(self.view_note)
+        return True
+
+    def _key_view_next_note(self, size, key, count):
+        """Show the count-th next note"""
+        return None if self._gui_view_other_note(count or 1) else key
+
+    def _key_view_prev_note(self, size, key, count):
+        """Show the count-th previous note"""
+        return None if self._gui_view_other_note(-(count or 1)) else key
+
+    def _key_status(self, size, key, count):
+        """Toggle the status bar"""
+        if self.status_bar == 'yes':
+            self.status_bar = 'no'
+        else:
+            self.status_bar = self.config.get_config('status_bar')
+
+    def _key_create_note(self, size, key, count):
+        """Create a note in the external editor"""
+        if self.gui_body_get().__class__ != view_titles.ViewTitles:
+            return key
+
+        self._gui_clear()
+        content = exec_cmd_on_note(None, self.config, self, self.logger)
+        self._gui_reset()
+
+        if content:
+            self.log('New note created')
+            self.ndb.create_note(content)
+            self.gui_update_view()
+            self.ndb.sync_worker_go()
+        return None
+
+    def _gui_focused_note(self, for_edit=True):
+        """
+        Return the note in focus in the titles or note view, or None if
+        there is none. In the note view, the version being looked at is
+        returned unless for_edit is set.
+        """
+        contents = self.gui_body_get()
+        if contents.__class__ == view_titles.ViewTitles:
             if not contents.body.positions():
                 return None
-            contents.change_focus(size, 0,
-                                  offset_inset=0,
-                                  coming_from='below')
+            return contents.note_list[contents.focus_position].note
+        # contents.__class__ == view_note.ViewNote
+        if for_edit:
+            return contents.note
+        return contents.old_note if contents.old_note else contents.note
+
+    def _gui_in_note_views(self):
+        """True if the titles or the note view is shown"""
+        return self.gui_body_get().__class__ in (view_titles.ViewTitles,
+                                                 view_note.ViewNote)
+
+    def _gui_run_on_note(self, key, raw=False):
+        """View the note in focus in the pager"""
+        if not self._gui_in_note_views():
+            return key
 
-        elif key == self.config.get_keybind('view_next_note'):
-            if self.gui_body_get().__class__ != view_note.ViewNote:
-                return key
+        contents = self.gui_body_get()
+        note = self._gui_focused_note(for_edit=False)
+        if note is None:
+            return None
+
+        self._gui_clear()
+        content = exec_cmd_on_note(
+                note,
+                self.config,
+                self,
+                self.logger,
+                cmd=get_pager(self.config, self.logger),
+                raw=raw
+                )
+        self._gui_reset()
 
-            if not self.view_titles.body.positions():
-                return None
-            last = len(self.view_titles.body.positions())
-            if self.view_titles.focus_position == (last - 1):
-                return None
-            self.view_titles.focus_position += 1
-            contents.update_note_view(
-                    self.view_titles. \
-                            note_list[self.view_titles. \
-                            focus_position].note['localkey']
-                    )
-            self._gui_switch_frame_body(self.view_note)
+        if not content:
+            return None
 
-        elif key == self.config.get_keybind('view_prev_note'):
-            if self.gui_body_get().__class__ != view_note.ViewNote:
-                return key
+        md5_old = hashlib.md5(note['content'].encode('utf-8')).digest()
+        md5_new = hashlib.md5(content.encode('utf-8')).digest()
 
-            if not self.view_titles.body.positions():
-                return None
-            if self.view_titles.focus_position == 0:
-                return None
-            self.view_titles.focus_position -= 1
-            contents.update_note_view(
-                    self.view_titles. \
-                            note_list[self.view_titles. \
-                            focus_position].note['localkey']
-                    )
-            self._gui_switch_frame_body(self.view_note)
+        if md5_old != md5_new:
+            self.log('Note updated')
+            self.ndb.set_note_content(note['localkey'], content)
+            if contents.__class__ == view_titles.ViewTitles:
+                contents.update_note_title()
+            else: # contents.__class__ == view_note.ViewNote:
+                contents.update_note_view()
+            self.ndb.sync_worker_go()
+        else:
+            self.log('Note unchanged')
+        return None
 
-        elif key == self.config.get_keybind('status'):
-            if self.status_bar == 'yes':
-                self.status_bar = 'no'
-            else:
-                self.status_bar = self.config.get_config('status_bar')
+    def _key_edit_note(self, size, key, count):
+        """
+        Edit the note in focus in the external editor. Saves are applied
+        to the note as they happen; with cfg_editor_terminal set the
+        editor gets its own terminal and the GUI keeps running.
+        """
+        if not self._gui_in_note_views():
+            return key
 
-        elif key == self.config.get_keybind('create_note'):
-            if self.gui_body_get().__class__ != view_titles.ViewTitles:
-                return key
+        note = self._gui_focused_note()
+        if note is None:
+            return None
 
+        detached = bool(self.config.get_config('editor_terminal'))
+        if not detached:
             self._gui_clear()
-            content = exec_cmd_on_note(None, self.config, self, self.logger)
+        session = edit_note_session(self.ndb, note['localkey'],
+                                    self.config, self, self.logger,
+                                    on_change=self.gui_update_view,
+                                    on_exit=self._gui_edit_done)
+        if not detached:
             self._gui_reset()
+            if session is not None:
+                self._gui_edit_done(session)
+        elif session is not None:
+            self.edit_sessions.add(session)
+        return None
+
+    def _gui_edit_done(self, session):
+        """Report the outcome of an edit session"""
+        self.edit_sessions.discard(session)
+        if session.failed:
+            self.log('ERROR: Failed to save edited note, it was deleted '
+                     '(key=%s)', session.key)
+        elif session.changed:
+            self.log('Note updated')
+        else:
+            self.log('Note unchanged')
 
-            if content:
-                self.log('New note created')
-                self.ndb.create_note(content)
-                self.gui_update_view()
-                self.ndb.sync_worker_go()
+    def _key_view_note_ext(self, size, key, count):
+        """View the note in focus in the pager"""
+        return self._gui_run_on_note(key)
 
-        elif key == self.config.get_keybind('edit_note') or \
-             key == self.config.get_keybind('view_note_ext') or \
-             key == self.config.get_keybind('view_note_json'):
-            if self.gui_body_get().__class__ != view_titles.ViewTitles and \
-               self.gui_body_get().__class__ != view_note.ViewNote:
-                return key
+    def _key_view_note_json(self, size, key, count):
+        """View the note in focus as JSON in the pager"""
+        return self._gui_run_on_note(key, raw=True)
 
-            if self.gui_body_get().__class__ == view_titles.ViewTitles:
-                if not contents.body.positions():
-                    return None
-                note = contents.note_list[contents.focus_position].note
-            else: # self.gui_body_get().__class__ == view_note.ViewNote:
-                if key == self.config.get_keybind('edit_note'):
-                    note = contents.note
-                else:
-                    note = contents.old_note if contents.old_note \
-                            else contents.note
+    def _key_view_note(self, size, key, count):
+        """Show the note in focus in the note view"""
+        contents = self.gui_body_get()
+        if contents.__class__ != view_titles.ViewTitles:
+            return key
+
+        if not contents.body.positions():
+            return None
+        self.view_note.update_note_view(
+                contents.note_list[contents.focus_position]. \
+                        note['localkey'])
+        self._gui_switch_frame_body(self.view_note)
+        return None
 
-            self._gui_clear()
-            if key == self.config.get_keybind('edit_note'):
-                content = exec_cmd_on_note(note, self.config, self,
-                                           self.logger)
-            elif key == self.config.get_keybind('view_note_ext'):
-                content = exec_cmd_on_note(
-                        note,
-                        self.config,
-                        self,
-                        self.logger,
-                        cmd=get_pager(self.config, self.logger))
-            else: # key == self.config.get_keybind('view_note_json')
-                content = exec_cmd_on_note(
-                        note,
-                        self.config,
-                        self,
-                        self.logger,
-                        cmd=get_pager(self.config, self.logger),
-                        raw=True
+    def _gui_footer_prompt(self, caption, edit_text, callback, args,
+                           change_func=None):
+        """Prompt for input in the footer"""
+        self._gui_footer_input_set(
+                urwid.AttrMap(
+                        user_input.UserInput(
+                                self.config,
+                                caption,
+                                edit_text,
+                                callback,
+                                args,
+                                change_func
+                                ),
+                        'user_input_bar'
                         )
+                )
+        self._gui_footer_focus_input()
+        self.master_frame.keypress = \
+                self._gui_footer_input_get().keypress
+
+    def _key_pipe_note(self, size, key, count):
+        """Pipe the note in focus to a command"""
+        if not self._gui_in_note_views():
+            return key
+
+        if self._gui_focused_note(for_edit=False) is None:
+            return None
+        self._gui_footer_prompt(key, '', self._gui_pipe_input, None)
+        return None
 
-            self._gui_reset()
+    def _key_note_delete(self, size, key, count):
+        """Delete the note in focus, after asking"""
+        if not self._gui_in_note_views():
+            return key
+
+        note = self._gui_focused_note()
+        if note is None:
+            return None
+        self._gui_footer_prompt('Delete (y/n): ', '',
+                                self._gui_yes_no_input,
+                                [self._delete_note_callback,
+                                 note['localkey']])
+        return None
 
-            if not content:
-                return None
+    def _key_note_favorite(self, size, key, count):
+        """Toggle the favorite flag of the note in focus"""
+        if not self._gui_in_note_views():
+            return key
 
-            md5_old = hashlib.md5(note['content'].encode('utf-8')).digest()
-            md5_new = hashlib.md5(content.encode('utf-8')).digest()
-
-            if md5_old != md5_new:
-                self.log('Note updated')
-                self.ndb.set_note_content(note['localkey'], content)
-                if self.gui_body_get().__class__ == view_titles.ViewTitles:
-                    contents.update_note_title()
-                else: # self.gui_body_get().__class__ == view_note.ViewNote:
-                    contents.update_note_view()
-                self.ndb.sync_worker_go()
-            else:
-                self.log('Note unchanged')
+        note = self._gui_focused_note()
+        if note is None:
+            return None
 
-        elif key == self.config.get_keybind('view_note'):
-            if self.gui_body_get().__class__ != view_titles.ViewTitles:
-                return key
+        favorite = not note['favorite']
 
-            if not contents.body.positions():
-                return None
-            self.view_note.update_note_view(
-                    contents.note_list[contents.focus_position]. \
-                            note['localkey'])
-            self._gui_switch_frame_body(self.view_note)
+        self.ndb.set_note_favorite(note['localkey'], favorite)
 
-        elif key == self.config.get_keybind('pipe_note'):
-            if self.gui_body_get().__class__ != view_titles.ViewTitles and \
-               self.gui_body_get().__class__ != view_note.ViewNote:
-                return key
+        if self.gui_body_get().__class__ == view_titles.ViewTitles:
+            self.view_titles.update_note_title()
 
-            if self.gui_body_get().__class__ == view_titles.ViewTitles:
-                if not contents.body.positions():
-                    return None
-                note = contents.note_list[contents.focus_position].note
-            else: # self.gui_body_get().__class__ == view_note.ViewNote:
-                note = contents.old_note if contents.old_note else contents.note
-
-            self._gui_footer_input_set(
-                    urwid.AttrMap(
-                            user_input.UserInput(
-                                    self.config,
-                                    key,
-                                    '',
-                                    self._gui_pipe_input,
-                                    None
-                                    ),
-                            'user_input_bar'
-                            )
-                    )
-            self._gui_footer_focus_input()
-            self.master_frame.keypress = \
-                    self._gui_footer_input_get().keypress
+        self.ndb.sync_worker_go()
+        return None
 
-        elif key == self.config.get_keybind('note_delete'):
-            if self.gui_body_get().__class__ != view_titles.ViewTitles and \
-               self.gui_body_get().__class__ != view_note.ViewNote:
-                return key
+    def _key_note_category(self, size, key, count):
+        """Set the category of the note in focus"""
+        if not self._gui_in_note_views():
+            return key
 
-            if self.gui_body_get().__class__ == view_titles.ViewTitles:
-                if not contents.body.positions():
-                    return None
-                note = contents.note_list[contents.focus_position].note
-            else: # self.gui_body_get().__class__ == view_note.ViewNote:
-                note = contents.note
-
-            self._gui_footer_input_set(
-                    urwid.AttrMap(
-                            user_input.UserInput(
-                                    self.config,
-                                    'Delete (y/n): ',
-                                    '',
-                                    self._gui_yes_no_input,
-                                    [
-                                            self._delete_note_callback,
-                                            note['localkey']
-                                    ]
-                                    ),
-                            'user_input_bar'
-                            )
-                    )
-            self._gui_footer_focus_input()
-            self.master_frame.keypress = \
-                    self._gui_footer_input_get().keypress
+        note = self._gui_focused_note()
+        if note is None:
+            return None
+        self._gui_footer_prompt('Category: ', note['category'],
+                                self._gui_category_input, None)
+        return None
 
-        elif key == self.config.get_keybind('note_favorite'):
-            if self.gui_body_get().__class__ != view_titles.ViewTitles and \
-               self.gui_body_get().__class__ != view_note.ViewNote:
-                return key
+    def _gui_search_start(self, key, mode, direction):
+        """Prompt for a search string"""
+        if not self._gui_in_note_views():
+            return key
 
-            if self.gui_body_get().__class__ == view_titles.ViewTitles:
-                if not contents.body.positions():
-                    return None
-                note = contents.note_list[contents.focus_position].note
-            else: # self.gui_body_get().__class__ == view_note.ViewNote:
-                note = contents.note
+        if self.gui_body_get().__class__ == view_note.ViewNote:
+            self.view_note.search_direction = direction
 
-            favorite = not note['favorite']
+        caption = '{}{}'.format('(regex) ' if mode == 'regex' else '',
+                                '/' if direction == 'forward' else '?')
 
-            self.ndb.set_note_favorite(note['localkey'], favorite)
+        change_func = None
+        if self.gui_body_get().__class__ == view_titles.ViewTitles and \
+                self.config.get_config('search_live') == 'yes':
+            change_func = self._gui_search_change
+            self.search_live_restore = (self.view_titles.search_string,
+                                        self.view_titles.search_mode)
 
-            if self.gui_body_get().__class__ == view_titles.ViewTitles:
-                contents.update_note_title()
+        self._gui_footer_prompt(caption, '', self._gui_search_input,
+                                [mode, direction], change_func)
+        return None
 
-            self.ndb.sync_worker_go()
+    def _key_search_gstyle(self, size, key, count):
+        """Search forward with a Google style search"""
+        return self._gui_search_start(key, 'gstyle', 'forward')
 
-        elif key == self.config.get_keybind('note_category'):
-            if self.gui_body_get().__class__ != view_titles.ViewTitles and \
-               self.gui_body_get().__class__ != view_note.ViewNote:
-                return key
+    def _key_search_regex(self, size, key, count):
+        """Search forward with a regex"""
+        return self._gui_search_start(key, 'regex', 'forward')
 
-            if self.gui_body_get().__class__ == view_titles.ViewTitles:
-                if not contents.body.positions():
-                    return None
-                note = contents.note_list[contents.focus_position].note
-            else: # self.gui_body_get().__class__ == view_note.ViewNote:
-                note = contents.note
-
-            self._gui_footer_input_set(
-                    urwid.AttrMap(
-                            user_input.UserInput(
-                                    self.config,
-                                    'Category: ',
-                                    note['category'],
-                                    self._gui_category_input,
-                                    None
-                                    ),
-                            'user_input_bar'
-                            )
-                    )
-            self._gui_footer_focus_input()
-            self.master_frame.keypress = \
-                    self._gui_footer_input_get().keypress
-
-        elif key == self.config.get_keybind('search_gstyle') or \
-             key == self.config.get_keybind('search_regex') or \
-             key == self.config.get_keybind('search_prev_gstyle') or \
-             key == self.config.get_keybind('search_prev_regex'):
-            if self.gui_body_get().__class__ != view_titles.ViewTitles and \
-                 self.gui_body_get().__class__ != view_note.ViewNote:
-                return key
-
-            if self.gui_body_get().__class__ == view_note.ViewNote:
-                if key == self.config.get_keybind('search_prev_gstyle') or \
-                     key == self.config.get_keybind('search_prev_regex'):
-                    self.view_note.search_direction = 'backward'
-                else:
-                    self.view_note.search_direction = 'forward'
-
-            options = [
-                    'gstyle' if key == self.config.get_keybind('search_gstyle')
-                    or key == self.config.get_keybind('search_prev_gstyle')
-                    else 'regex',
-                    'backward' if key ==
-                    self.config.get_keybind('search_prev_gstyle')
-                    or key == self.config.get_keybind('search_prev_regex')
-                    else 'forward'
-            ]
-
-            caption = '{}{}'.format('(regex) '
-                                    if options[0] == 'regex'
-                                    else '',
-                                    '/' if options[1] == 'forward'
-                                    else '?')
-
-            self._gui_footer_input_set(
-                    urwid.AttrMap(
-                            user_input.UserInput(
-                                    self.config,
-                                    caption,
-                                    '',
-                                    self._gui_search_input,
-                                    options
-                                    ),
-                            'user_input_bar'
-                            )
-                    )
-            self._gui_footer_focus_input()
-            self.master_frame.keypress = \
-                    self._gui_footer_input_get().keypress
+    def _key_search_prev_gstyle(self, size, key, count):
+        """Search backward with a Google style search"""
+        return self._gui_search_start(key, 'gstyle', 'backward')
+
+    def _key_search_prev_regex(self, size, key, count):
+        """Search backward with a regex"""
+        return self._gui_search_start(key, 'regex', 'backward')
 
-        elif key == self.config.get_keybind('search_next'):
-            if self.gui_body_get().__class__ != view_note.ViewNote:
-                return key
+    def _key_search_next(self, size, key, count):
+        """Go to the count-th next search match in the note"""
+        if self.gui_body_get().__class__ != view_note.ViewNote:
+            return key
 
+        for _ in range(count or 1):
             self.view_note.search_note_view_next()
+        return None
 
-        elif key == self.config.get_keybind('search_prev'):
-            if self.gui_body_get().__class__ != view_note.ViewNote:
-                return key
+    def _key_search_prev(self, size, key, count):
+        """Go to the count-th previous search match in the note"""
+        if self.gui_body_get().__class__ != view_note.ViewNote:
+            return key
 
+        for _ in range(count or 1):
             self.view_note.search_note_view_prev()
+        return None
 
-        elif key == self.config.get_keybind('clear_search'):
-            if self.gui_body_get().__class__ != view_titles.ViewTitles:
-                return key
-
-            self.view_titles.update_note_list(
-                    None,
-                    sort_mode=self.config.state.current_sort_mode
-                    )
-            self._gui_body_set(self.view_titles)
-
-        elif key == self.config.get_keybind('sort_date'):
-            if self.gui_body_get().__class__ != view_titles.ViewTitles:
-                return key
-
-            self.config.state.current_sort_mode = 'date'
-            self.view_titles.sort_note_list('date')
+    def _key_clear_search(self, size, key, count):
+        """Show all notes again"""
+        if self.gui_body_get().__class__ != view_titles.ViewTitles:
+            return key
 
-        elif key == self.config.get_keybind('sort_alpha'):
-            if self.gui_body_get().__class__ != view_titles.ViewTitles:
-                return key
+        self.view_titles.update_note_list(
+                None,
+                sort_mode=self.config.state.current_sort_mode
+                )
+        self._gui_body_set(self.view_titles)
+        return None
 
-            self.config.state.current_sort_mode = 'alpha'
-            self.view_titles.sort_note_list('alpha')
+    def _gui_sort(self, key, sort_mode):
+        """Sort the note list"""
+        if self.gui_body_get().__class__ != view_titles.ViewTitles:
+            return key
 
-        elif key == self.config.get_keybind('sort_categories'):
-            if self.gui_body_get().__class__ != view_titles.ViewTitles:
-                return key
+        self.config.state.current_sort_mode = sort_mode
+        self.view_titles.sort_note_list(sort_mode)
+        return None
 
-            self.config.state.current_sort_mode = 'categories'
-            self.view_titles.sort_note_list('categories')
+    def _key_sort_date(self, size, key, count):
+        """Sort the note list by date"""
+        return self._gui_sort(key, 'date')
 
-        elif key == self.config.get_keybind('copy_note_text'):
-            if self.gui_body_get().__class__ != view_note.ViewNote:
-                return key
+    def _key_sort_alpha(self, size, key, count):
+        """Sort the note list by title"""
+        return self._gui_sort(key, 'alpha')
 
-            self.view_note.copy_note_text()
+    def _key_sort_categories(self, size, key, count):
+        """Sort the note list by category"""
+        return self._gui_sort(key, 'categories')
 
-        else:
-            return contents.keypress(size, key)
+    def _key_copy_note_text(self, size, key, count):
+        """Copy the line in focus to the clipboard"""
+        if self.gui_body_get().__class__ != view_note.ViewNote:
+            return key
 
-        self._gui_update_status_bar()
+        self.view_note.copy_note_text()
         return None
 
     def _gui_init_view(self, loop, show_note):
@@ -835,13 +1122,14 @@ class NncliGui:
 
     def _gui_clear(self):
         """Clear the GUI"""
+        # drawn right away, the caller is about to hand over the terminal
         self.nncli_loop.widget = urwid.Filler(urwid.Text(''))
         self.nncli_loop.draw_screen()
 
     def _gui_reset(self):
         """Reset the GUI"""
         self.nncli_loop.widget = self.master_frame
-        self.nncli_loop.draw_screen()
+        self._gui_redraw()
 
     def _gui_stop(self):
         """Stop the GUI"""
@@ -850,6 +1138,13 @@ class NncliGui:
         # NOTE: this was originally causing hangs on exit with urllib2
         # should not be a problem now since using the requests library
         # ref https://github.com/insanum/sncli/issues/18#issuecomment-105517773
+        if self.edit_sessions:
+            # their last save would be lost with the threads waiting
+            # for them
+            self.log('WARNING: Close the editor of %d note%s first',
+                     len(self.edit_sessions),
+                     '' if len(self.edit_sessions) == 1 else 's')
+            return
         if self.ndb.verify_all_saved():
             # clear the screen and exit the urwid run loop
             self._gui_clear()
@@ -857,54 +1152,52 @@ class NncliGui:
         self.log('WARNING: Not all notes saved'
                  'to disk (wait for sync worker)')
 
-    def log(self, msg):
-        """Log as message, displaying to the user as appropriate"""
-        self.logger.log(msg)
-
-        self.log_lock.acquire()
-
-        self.log_alarms += 1
-        self.logs.append(msg)
-
-        if len(self.logs) > int(self.config.get_config('max_logs')):
-            self.log_alarms -= 1
-            self.logs.pop(0)
-
-        log_pile = []
-        for log in self.logs:
-            log_pile.append(urwid.AttrMap(urwid.Text(log), 'log'))
-
-        if self.config.state.verbose:
-            self._gui_footer_log_set(log_pile)
+    def log(self, msg, *args):
+        """
+        Log as message, formatted with args as by Logger.log, displaying
+        to the user as appropriate. May be called from any thread; the
+        footer is updated by the main loop, once for however many
+        messages arrived in between.
+        """
+        self.logger.log(msg, *args)
+        if args:
+            msg = msg % args
 
-        self.nncli_loop.set_alarm_in(
-                int(self.config.get_config('log_timeout')),
-                self._log_timeout, None)
+        if not self.config.state.verbose:
+            return
 
-        self.log_lock.release()
+        with self.log_lock:
+            self.logs.append(
+                    (time.time() + int(self.config.get_config('log_timeout')),
+                     msg))
+        self._gui_call_soon(self._log_render)
 
-    def _log_timeout(self, loop, arg):
+    def _log_render(self):
         """
-        Run periodically to check for new log entries to append to
-        the GUI footer
+        Drop expired messages, redraw the footer log and set the expiry
+        timer for the oldest message left
         """
-        self.log_lock.acquire()
-
-        self.log_alarms -= 1
-
-        if self.log_alarms == 0:
-            self._gui_footer_log_clear()
-            self.logs = []
+        now = time.time()
+        with self.log_lock:
+            while self.logs and self.logs[0][0] <= now:
+                self.logs.popleft()
+            logs = list(self.logs)
+
+        if logs:
+            self._gui_footer_log_set(
+                    [urwid.AttrMap(urwid.Text(msg), 'log')
+                     for _, msg in logs])
         else:
-            if self.logs:
-                self.logs.pop(0)
-
-            log_pile = []
-
-            for log in self.logs:
-                log_pile.append(urwid.AttrMap(urwid.Text(log), 'log'))
+            self._gui_footer_log_clear()
 
-            if self.config.state.verbose:
-                self._gui_footer_log_set(log_pile)
+        if self.log_alarm is not None:
+            self.nncli_loop.remove_alarm(self.log_alarm)
+            self.log_alarm = None
+        if logs:
+            self.log_alarm = self.nncli_loop.set_alarm_at(
+                    logs[0][0], self._log_timeout)
 
-        self.log_lock.release()
+    def _log_timeout(self, loop, arg):
+        """Clear the footer log messages that have expired"""
+        self.log_alarm = None
+        self._log_render()
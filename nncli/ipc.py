@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""ipc module
+
+Requests and replies between nncli processes over a Unix socket only
+its owner can reach. Each request and each reply is a single line of
+JSON; a server answers one request per connection.
+"""
+import os
+import socket
+import socketserver
+import struct
+
+from . import codec
+
+def peer_is_owner(sock):
+    """True if the peer on the Unix socket sock runs as the same user"""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        # the socket file's permissions are all there is
+        return True
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', creds)
+    return uid == os.getuid()
+
+def request(path, message, timeout, reply_timeout=None):
+    """
+    Send message to the server at path, return the reply or None if
+    there is no answer. Connecting and sending give up after timeout
+    seconds; the reply is waited for reply_timeout seconds, or for as
+    long as it takes if that is None.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall(codec.dumpb(message) + b'\n')
+            sock.settimeout(reply_timeout)
+            data = b''
+            while not data.endswith(b'\n'):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        return codec.loads(data)
+    except (OSError, ValueError):
+        # socket.timeout is an OSError
+        return None
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Answers one request"""
+    def handle(self):
+        if not peer_is_owner(self.request):
+            return
+        try:
+            message = codec.loads(self.rfile.readline())
+            reply = self.server.handle_request_data(message)
+        except (ValueError, KeyError, TypeError):
+            reply = self.server.bad_request_reply
+        self.wfile.write(codec.dumpb(reply) + b'\n')
+
+class Server(socketserver.UnixStreamServer):
+    """
+    Server class
+
+    Listens on path, replacing the socket a dead server left behind.
+    Subclasses answer decoded requests with handle_request_data and
+    malformed ones with bad_request_reply.
+    """
+    bad_request_reply = {'status': 'error'}
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)
+        umask = os.umask(0o077)
+        try:
+            super(Server, self).__init__(path, _Handler)
+        finally:
+            os.umask(umask)
+
+    def handle_request_data(self, message):
+        """Return the reply to a decoded request"""
+        raise NotImplementedError
+
+    def close(self):
+        """Stop listening and remove the socket"""
+        self.server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
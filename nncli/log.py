@@ -1,40 +1,151 @@
 # -*- coding: utf-8 -*-
 """log module"""
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import queue
+import threading
+import time
 
 import os
 
+LOG_LEVELS = {
+        'debug': logging.DEBUG,
+        'info': logging.INFO,
+        'warning': logging.WARNING,
+        'error': logging.ERROR
+}
+
+# messages of one type passed through per interval before suppressing
+LOG_RATE_BURST = 20
+LOG_RATE_INTERVAL = 1.0
+
+class RateLimitFilter(logging.Filter):
+    """
+    RateLimitFilter class
+
+    Lets through at most LOG_RATE_BURST records of each message type per
+    LOG_RATE_INTERVAL seconds, where the type is the unformatted message.
+    Suppressed records are counted and reported in a single summary
+    record once the type is let through again or on flush().
+    """
+    def __init__(self, burst=LOG_RATE_BURST, interval=LOG_RATE_INTERVAL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.lock = threading.Lock()
+        # msg type -> [window start, records passed, records suppressed]
+        self.windows = {}
+        self.pruned = time.monotonic()
+
+    def _prune(self, now):
+        """
+        Drop the windows that are over and have nothing to report, so
+        message types that stopped coming don't pile up
+        """
+        self.windows = {msg_type: window
+                        for msg_type, window in self.windows.items()
+                        if window[2] or now - window[0] < self.interval}
+        self.pruned = now
+
+    def filter(self, record):
+        now = time.monotonic()
+        msg_type = (record.levelno, str(record.msg))
+        with self.lock:
+            if now - self.pruned >= self.interval:
+                self._prune(now)
+            window = self.windows.get(msg_type)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self.windows[msg_type] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            self._summarize(record, suppressed)
+        return True
+
+    @staticmethod
+    def _summarize(record, suppressed):
+        """Rewrite record to also report the suppressed count"""
+        record.msg = '{} [{} similar messages suppressed]'.format(
+                record.getMessage(), suppressed)
+        record.args = None
+
+    def flush(self):
+        """Return summary records for all pending suppressed messages"""
+        with self.lock:
+            pending = [(msg_type, window[2])
+                       for msg_type, window in self.windows.items()
+                       if window[2]]
+            self.windows = {}
+        return [logging.LogRecord('root', levelno, __file__, 0,
+                                  '%d similar messages suppressed: %s',
+                                  (suppressed, msg), None)
+                for (levelno, msg), suppressed in pending]
+
 # pylint: disable=unused-argument, too-few-public-methods
 class Logger:
-    """Handles logging for the application"""
+    """
+    Handles logging for the application. Records are put on a queue and
+    written to the log file by a background thread so logging never
+    blocks the GUI or a sync on file I/O.
+    """
     def __init__(self, config):
         self.config = config
         self.logfile = os.path.join(
                 config.get_config('db_path'),
                 'nncli.log'
                 )
+        self.level = LOG_LEVELS.get(config.get_config('log_level'),
+                                    logging.INFO)
         self.loghandler = RotatingFileHandler(
                 self.logfile,
                 maxBytes=100000,
                 backupCount=1
                 )
-        self.loghandler.setLevel(logging.DEBUG)
+        self.loghandler.setLevel(self.level)
         self.loghandler.setFormatter(
                 logging.Formatter(
                         fmt='%(asctime)s [%(levelname)s] %(message)s'
                         )
                 )
+        self.ratelimit = RateLimitFilter()
+        self.queuehandler = QueueHandler(queue.SimpleQueue())
+        self.queuehandler.addFilter(self.ratelimit)
+        self.listener = QueueListener(self.queuehandler.queue,
+                                      self.loghandler,
+                                      respect_handler_level=True)
         self.logger = logging.getLogger()
-        self.logger.setLevel(logging.DEBUG)
-        self.logger.addHandler(self.loghandler)
+        self.logger.setLevel(self.level)
+        self.logger.addHandler(self.queuehandler)
+        self.listener.start()
+        atexit.register(self.close)
 
         logging.debug('nncli logging initialized')
 
-    def log(self, msg):
-        """Log as message, displaying to the user as appropriate"""
-        logging.debug(msg)
+    def log(self, msg, *args):
+        """
+        Log as message, displaying to the user as appropriate. Values
+        that vary are passed as args for msg to be formatted with, in
+        the style of the logging module, so msg names the message type.
+        """
+        logging.info(msg, *args)
 
         if not self.config.state.do_gui:
             if self.config.state.verbose:
-                print(msg)
+                print(msg % args if args else msg)
+
+    def close(self):
+        """Write out pending records and stop the writer thread"""
+        if self.listener is None:
+            return
+        for record in self.ratelimit.flush():
+            self.queuehandler.enqueue(record)
+        self.listener.stop()
+        self.listener = None
+        self.logger.removeHandler(self.queuehandler)
+        self.loghandler.close()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""metrics module"""
+import collections
+import os
+import time
+
+from . import stats
+
+class SyncRun:
+    """
+    SyncRun class
+
+    Collects the metrics of a single run of NotesDB.sync_notes. Phase
+    durations and counts are also passed on to the stats module, which
+    keeps totals across runs.
+    """
+    def __init__(self, full_sync):
+        self.full_sync = full_sync
+        self.timestamp = time.time()
+        self.start = self.phase_start = stats.clock()
+        self.phases = collections.OrderedDict()
+        self.counts = collections.Counter()
+        self.http = collections.Counter()
+        self.errors = 0
+        self.status = None
+
+    def end_phase(self, name):
+        """Record the time since the previous phase ended as name"""
+        now = stats.clock()
+        self.phases[name] = now - self.phase_start
+        stats.elapsed('sync.' + name, self.phase_start)
+        self.phase_start = now
+
+    def count(self, name, amount=1):
+        """Add amount to the count name, e.g. pushed or pulled"""
+        self.counts[name] += amount
+        stats.count('sync.' + name, amount)
+
+    def finish(self, errors, http_before, note):
+        """
+        Record the total duration, errors, the HTTP requests made since
+        http_before was taken from note.http and the server status
+        """
+        self.phases['total'] = stats.clock() - self.start
+        stats.elapsed('sync.total', self.start)
+        self.errors = errors
+        stats.count('sync.errors', errors)
+        self.http = note.http - http_before
+        self.status = note.status
+
+def _escape(value):
+    """Escape a label value"""
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+                     .replace('\n', r'\n')
+
+def _format_value(value):
+    """Format a sample value"""
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+def openmetrics_lines(run, last_success=None):
+    """
+    Format a SyncRun as OpenMetrics text. last_success is the time of
+    the last sync without errors, if any.
+    """
+    families = [
+            ('nncli_sync_duration_seconds',
+             'Duration of the last sync by phase.',
+             [({'phase': name}, seconds)
+              for name, seconds in run.phases.items()]),
+            ('nncli_sync_notes',
+             'Notes handled by the last sync.',
+             [({'action': action}, run.counts[action])
+              for action in ('pushed', 'pulled', 'deleted', 'saved')]),
+            ('nncli_sync_http_requests',
+             'HTTP requests made by the last sync.',
+             [({}, run.http['requests'])]),
+            ('nncli_sync_http_bytes',
+             'HTTP bytes transferred by the last sync.',
+             [({'direction': 'in'}, run.http['bytes_in']),
+              ({'direction': 'out'}, run.http['bytes_out'])]),
+            ('nncli_sync_http_errors',
+             'HTTP error responses in the last sync.',
+             [({}, run.http['errors'])]),
+            ('nncli_sync_errors',
+             'Notes or listings that failed to sync in the last sync.',
+             [({}, run.errors)]),
+            ('nncli_sync_full',
+             'Whether the last sync was a full sync.',
+             [({}, int(run.full_sync))]),
+            ('nncli_sync_status',
+             'Server status after the last sync.',
+             [({'status': run.status}, 1)]),
+            ('nncli_sync_last_run_timestamp_seconds',
+             'Time the last sync started.',
+             [({}, int(run.timestamp))]),
+    ]
+    if last_success:
+        families.append(('nncli_sync_last_success_timestamp_seconds',
+                         'Time the last sync without errors started.',
+                         [({}, int(last_success))]))
+
+    lines = []
+    for name, help_text, samples in families:
+        lines.append('# TYPE {} gauge'.format(name))
+        lines.append('# HELP {} {}'.format(name, help_text))
+        for labels, value in samples:
+            label_text = ','.join('{}="{}"'.format(key, _escape(val))
+                                  for key, val in labels.items())
+            lines.append('{}{} {}'.format(
+                    name,
+                    '{' + label_text + '}' if label_text else '',
+                    _format_value(value)))
+    lines.append('# EOF')
+    return lines
+
+def write_textfile(path, run, last_success=None):
+    """
+    Write a SyncRun to path as an OpenMetrics textfile. The file is
+    replaced atomically so collectors never read a partial file.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as textfile:
+        for line in openmetrics_lines(run, last_success):
+            textfile.write(line + '\n')
+    os.replace(tmp_path, path)
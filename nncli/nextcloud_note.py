@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 """nextcloud_note module"""
+import collections
 import logging
 import time
 import traceback
@@ -7,6 +8,30 @@ import traceback
 import requests
 from requests.exceptions import RequestException
 
+from . import codec, stats
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+API_URL = 'https://{}/index.php/apps/notes/api/{}/notes'
+
+# most notes with all properties in one chunk of the note list, when
+# the server supports fetching it in chunks (Notes API v1.2 and up)
+NOTE_LIST_CHUNK_SIZE = 100
+
+# bytes read at a time from streamed responses
+STREAM_CHUNK_SIZE = 65536
+
+def supports_v1(headers):
+    """
+    True unless the API versions listed in the response headers leave
+    out v1
+    """
+    versions = headers.get('X-Notes-API-Versions')
+    if versions is None:
+        return True
+    return any(version.strip().startswith('1.')
+               for version in versions.split(','))
+
 class NextcloudNote:
     """ Class for interacting with the NextCloud Notes web service """
 
@@ -14,10 +39,27 @@ class NextcloudNote:
         """ object constructor """
         self.username = username
         self.password = password
-        self.url = \
-            'https://{}/index.php/apps/notes/api/v0.2/notes'. \
-            format(host)
+        self.host = host
+        # v0.2 until the first note list shows the server supports v1
+        self.url = API_URL.format(host, 'v0.2')
+        self.api_version = None
         self.status = 'offline'
+        # one session so requests reuse connections to the server
+        self.session = requests.Session()
+        # requests, bytes_in, bytes_out and errors since startup
+        self.http = collections.Counter()
+
+    def _count(self, name, amount=1):
+        """Add amount to the HTTP counter name"""
+        self.http[name] += amount
+        stats.count('http.' + name, amount)
+
+    def _count_response(self, res):
+        """Count a completed HTTP request"""
+        self._count('requests')
+        self._count('bytes_in', len(res.content))
+        if res.status_code >= 400:
+            self._count('errors')
 
     def get_note(self, noteid):
         """ method to get a specific note
@@ -36,9 +78,12 @@ class NextcloudNote:
         url = '{}/{}'.format(self.url, str(noteid))
         #logging.debug('REQUEST: ' + self.url+params)
         try:
-            res = requests.get(url, auth=(self.username, self.password))
+            with stats.timer('http.get_note'):
+                res = self.session.get(url,
+                                       auth=(self.username, self.password))
+            self._count_response(res)
             res.raise_for_status()
-            note = res.json()
+            note = codec.loads(res.content)
             self.status = 'online'
         except ConnectionError as ex:
             self.status = 'offline, connection error'
@@ -88,20 +133,26 @@ class NextcloudNote:
         #logging.debug('REQUEST: ' + url + ' - ' + str(note))
         try:
             logging.debug('NOTE: %s', note)
-            if url != self.url:
-                res = requests.put(
-                        url,
-                        auth=(self.username, self.password),
-                        json=note
-                        )
-            else:
-                res = requests.post(
-                        url, auth=(self.username, self.password),
-                        json=note
-                        )
-            note = res.json()
+            data = codec.dumpb(note)
+            self._count('bytes_out', len(data))
+            with stats.timer('http.update_note'):
+                if url != self.url:
+                    res = self.session.put(
+                            url,
+                            auth=(self.username, self.password),
+                            data=data,
+                            headers=JSON_HEADERS
+                            )
+                else:
+                    res = self.session.post(
+                            url, auth=(self.username, self.password),
+                            data=data,
+                            headers=JSON_HEADERS
+                            )
+            self._count_response(res)
+            note = codec.loads(res.content)
             res.raise_for_status()
-            logging.debug('NOTE (from response): %s', res.json())
+            logging.debug('NOTE (from response): %s', note)
             self.status = 'online'
         except ConnectionError as ex:
             self.status = 'offline, connection error'
@@ -116,66 +167,121 @@ class NextcloudNote:
         #logging.debug('RESPONSE OK: ' + str(note))
         return note, 0
 
-    def get_note_list(self, category=None):
-        """ function to get the note list
+    def _get_list(self, url, params):
+        """Request a note list, return the response"""
+        logging.debug('REQUEST: %s %s', url, params)
+        try:
+            with stats.timer('http.get_note_list'):
+                res = self.session.get(url,
+                                       auth=(self.username, self.password),
+                                       params=params)
+        except ConnectionError:
+            self.status = 'offline, connection error'
+            raise
+        self._count_response(res)
+        return res
+
+    def iter_note_chunks(self, prune_before=None,
+                         chunk_size=NOTE_LIST_CHUNK_SIZE):
+        """ generator over the note list, one chunk at a time
+
+        The first call negotiates the API version: v1 is used from then
+        on if the server offers it, v0.2 otherwise.
 
-        The function can be passed optional arguments to limit the
-        date range of the list returned and/or limit the list to notes
-        containing a certain category. If omitted a list of all notes
-        is returned.
+        With v1 the list comes in chunks of at most chunk_size notes
+        with all properties, content included; notes not changed since
+        the Unix time prune_before only have their `id` set. Servers
+        older than v1.2 send a single chunk.
+
+        With v0.2 the list comes in a single chunk of notes with all
+        properties set except `content`.
 
         Arguments:
-            - category=None category as string: return notes tagged to
-              this category
+            - prune_before=None: Unix time, return notes changed before
+              it with only their `id` (v1 only)
+            - chunk_size: most notes with all properties per chunk
 
-        Returns:
-            A tuple `(notes, status)`
+        Yields:
+            A tuple `(notes, last)`
 
-            - notes (list): A list of note objects with all properties
-              set except `content`.
-            - status (int): 0 on sucesss and -1 otherwise
+            - notes (list): note objects
+            - last (bool): True for the last chunk
+
+        Raises:
+            ConnectionError, RequestException or ValueError if a
+            request fails or returns bad JSON data.
 
         """
-        # initialize data
-        status = 0
-        note_list = {}
+        if self.api_version != '0.2':
+            url = API_URL.format(self.host, 'v1')
+            params = {'chunkSize': chunk_size}
+            if prune_before:
+                params['pruneBefore'] = int(prune_before)
+            while True:
+                res = self._get_list(url, dict(params))
+                if self.api_version is None:
+                    if res.status_code == 404 or \
+                            not supports_v1(res.headers):
+                        self.api_version = '0.2'
+                        break
+                    res.raise_for_status()
+                    self.api_version = '1'
+                    self.url = url
+                res.raise_for_status()
+                notes = codec.loads(res.content)
+                self.status = 'online'
+                cursor = res.headers.get('X-Notes-Chunk-Cursor')
+                yield notes, not cursor
+                if not cursor:
+                    return
+                params['chunkCursor'] = cursor
+
+        res = self._get_list(self.url, {'exclude': 'content'})
+        res.raise_for_status()
+        notes = codec.loads(res.content)
+        self.status = 'online'
+        yield notes, True
+
+    def iter_notes(self):
+        """ generator over all notes, content included
+
+        The full note list is streamed from the server and decoded
+        as it arrives, so notes are yielded one at a time without the
+        whole response being held in memory.
+
+        Yields:
+            - note (dict): note object
 
-        # get the note index
-        params = {'exclude': 'content'}
+        Raises:
+            ConnectionError, RequestException or ValueError if the
+            request fails or the response is not a JSON list of notes.
 
-        # perform initial HTTP request
+        """
+        logging.debug('REQUEST: %s', self.url)
         try:
-            logging.debug('REQUEST: %s', self.url + '?exclude=content')
-            res = requests.get(
-                    self.url,
-                    auth=(self.username, self.password),
-                    params=params
-                    )
-            res.raise_for_status()
-            #logging.debug('RESPONSE OK: ' + str(res))
-            note_list = res.json()
-            self.status = 'online'
+            with stats.timer('http.iter_notes'):
+                res = self.session.get(self.url,
+                                       auth=(self.username, self.password),
+                                       stream=True)
         except ConnectionError:
-            logging.exception('connection error')
             self.status = 'offline, connection error'
-            status = -1
-        except RequestException:
-            # if problem with network request/response
-            logging.exception('request error')
-            status = -1
-        except ValueError:
-            # if invalid json data
-            status = -1
-            logging.exception('request returned bad JSON data')
-
-        # Can only filter for category at end, once all notes have been
-        # retrieved. Below based on simplenote.vim, except we return
-        # deleted notes as well
-        if category is not None:
-            note_list = \
-                [n for n in note_list if n["category"] == category]
-
-        return note_list, status
+            raise
+        with res:
+            self._count('requests')
+            if res.status_code >= 400:
+                self._count('errors')
+            res.raise_for_status()
+            self.status = 'online'
+            for note in codec.iter_array(self._counted_chunks(res)):
+                if not isinstance(note, dict):
+                    raise ValueError('note list holds a non-note')
+                yield note
+
+    def _counted_chunks(self, res):
+        """Yield the body of a streamed response, counting its bytes"""
+        for chunk in res.iter_content(STREAM_CHUNK_SIZE):
+            self._count('bytes_in', len(chunk))
+            yield chunk
 
     def delete_note(self, note):
         """ method to permanently delete a note
@@ -194,7 +300,11 @@ class NextcloudNote:
 
         try:
             logging.debug('REQUEST DELETE: %s', url)
-            res = requests.delete(url, auth=(self.username, self.password))
+            with stats.timer('http.delete_note'):
+                res = self.session.delete(url,
+                                          auth=(self.username,
+                                                self.password))
+            self._count_response(res)
             res.raise_for_status()
             self.status = 'online'
         except ConnectionError as ex:
@@ -1,15 +1,15 @@
 # -*- coding: utf-8 -*-
 """nncli module"""
+import atexit
 import hashlib
-import json
 import os
 import signal
 import sys
 import time
 
-from . import utils, __version__
+from . import codec, stats, utils, __version__
+from .accounts import open_accounts
 from .config import Config
-from .gui import NncliGui
 from .log import Logger
 from .notes_db import NotesDB, ReadError, WriteError
 from .utils import exec_cmd_on_note
@@ -29,17 +29,28 @@ class Nncli:
 
         self.logger = Logger(self.config)
 
+        # timing stats of this run are merged into the stats file of the
+        # main account on exit; stats turned on only for a profile are
+        # left out of it
+        save_stats = self.config.get_config('stats') == 'yes'
+        if save_stats:
+            stats.enable()
+
         try:
             self.ndb = NotesDB(
                     self.config,
                     self.logger.log
                     )
+            if save_stats:
+                atexit.register(stats.save, self.ndb.stats_file)
+            self.ndb = open_accounts(self.ndb, self.config, self.logger.log)
         except (ReadError, WriteError) as ex:
             self.logger.log(str(ex))
             sys.exit(1)
 
-        self.nncli_gui = NncliGui(self.config, self.logger, self.ndb)
-        self.ndb.set_update_view(self.nncli_gui.gui_update_view)
+        # the console GUI, and urwid with it, is only loaded when shown
+        self.nncli_gui = None
+        self.ndb.set_update_view(self.update_view)
 
         if force_full_sync:
             # The note database doesn't exist so force a full sync. It is
@@ -52,8 +63,15 @@ class Nncli:
             self.ndb.sync_now()
             self.config.state.verbose = verbose
 
+    def update_view(self):
+        """Update the GUI, if it is shown"""
+        if self.nncli_gui is not None:
+            self.nncli_gui.gui_update_view()
+
     def gui(self, key):
         """Method to initialize and display the GUI"""
+        from .gui import NncliGui
+        self.nncli_gui = NncliGui(self.config, self.logger, self.ndb)
         self.config.state.do_gui = True
         self.ndb.log = self.nncli_gui.log
         self.nncli_gui.run()
@@ -142,14 +160,27 @@ class Nncli:
 
         if raw:
             try:
-                note = json.loads(raw)
+                note = codec.loads(raw)
                 self.logger.log('New note created')
                 self.ndb.import_note(note)
                 self.ndb.sync_now()
             except ValueError as ex:
-                self.logger.log('(IMPORT) ValueError: {}'.format(ex))
+                self.logger.log('(IMPORT) ValueError: %s', ex)
                 sys.exit(1)
 
+    def cli_stats(self, reset):
+        """Print the recorded timing stats on the command line"""
+        if reset:
+            stats.STATS.reset()
+            if os.path.exists(self.ndb.stats_file):
+                os.unlink(self.ndb.stats_file)
+            return
+
+        snapshot = stats.merge(stats.load(self.ndb.stats_file),
+                               stats.STATS.snapshot())
+        for line in stats.report_lines(snapshot):
+            print(line)
+
     def cli_note_export(self, key):
         """Export a note to the command line"""
         note = self.ndb.get_note(key)
@@ -157,7 +188,7 @@ class Nncli:
             self.logger.log('ERROR: Key does not exist')
             return
 
-        print(json.dumps(note, indent=2))
+        print(codec.dumps(note, pretty=True))
 
     def cli_export_notes(self, regex, search_string):
         """Export multiple notes to the command line"""
@@ -168,7 +199,7 @@ class Nncli:
                     sort_mode=self.config.get_config('sort_mode'))
 
         notes_data = [n.note for n in note_list]
-        print(json.dumps(notes_data, indent=2))
+        print(codec.dumps(notes_data, pretty=True))
 
     def cli_note_edit(self, key):
         """Edit a note from the command line"""
@@ -232,6 +263,11 @@ class Nncli:
         self.ndb.set_note_category(key, category.lower())
         self.ndb.sync_now()
 
+    def cli_list_categories(self):
+        """List the categories on the command line"""
+        for category, count in self.ndb.get_categories():
+            print('{0} ({1})'.format(category, count))
+
     def cli_note_category_rm(self, key):
         """Remove a note category from the command line"""
         note = self.ndb.get_note(key)
@@ -1,16 +1,17 @@
 # -*- coding: utf-8 -*-
 """notes_db module"""
+import collections
 import copy
 import glob
-import json
+import logging
 import os
 import re
 import threading
 import time
-from requests.exceptions import RequestException
 
-from . import utils
-from .nextcloud_note import NextcloudNote
+from . import codec, metrics, stats, utils
+from .oplog import OperationLog
+from .search import CategoryIndex, ParallelRegexSearch, TrigramIndex
 
 # pylint: disable=too-many-instance-attributes, too-many-locals
 # pylint: disable=too-many-branches, too-many-statements
@@ -23,33 +24,92 @@ class WriteError(RuntimeError):
     """Exception thrown on a write error"""
     pass
 
+# number of recent filter_notes results kept for reuse
+SEARCH_CACHE_SIZE = 16
+
+# a sync takes the notes it needs from one listing of all notes with
+# their content, rather than fetching them one by one, when it needs at
+# least this many notes and this share of the notes on the server
+BULK_FETCH_MIN_NOTES = 10
+BULK_FETCH_MIN_SHARE = 0.1
+
+# seconds the changes listed with their content reach back before the
+# last change of a synced note (Notes API v1)
+PRUNE_MARGIN = 24 * 60 * 60
+
+def use_bulk_fetch(wanted, listed):
+    """
+    True if wanted of the listed notes on the server are better fetched
+    with one listing of all notes than with one request each
+    """
+    return wanted >= BULK_FETCH_MIN_NOTES and \
+            wanted >= listed * BULK_FETCH_MIN_SHARE
+
+def request_errors():
+    """
+    The exceptions a failed request to the server raises, importing
+    requests only once a sync needs it
+    """
+    from requests.exceptions import RequestException
+    return (ConnectionError, RequestException, ValueError)
+
 class NotesDB():
     """
     NotesDB will take care of the local notes database and syncing with
     NextCloud Notes
     """
-    def __init__(self, config, log, update_view=None):
+    def __init__(self, config, log, update_view=None, account=None):
         self.config = config
         self.log = log
         self.update_view = update_view
 
+        # notes of an extra account are keyed 'account:key' in memory so
+        # keys stay unique when several accounts are merged, on disk and
+        # on the server they keep their plain key
+        self.account = account
+        self.key_prefix = account + ':' if account else ''
+
         self.last_sync = 0 # set to zero to trigger a full sync
         self.sync_lock = threading.Lock()
+        # the keys new notes had before their first push -> the keys the
+        # server gave them, for whoever still holds an old key
+        self.moved_keys = {}
         self.go_cond = threading.Condition()
 
+        # bumped on every change to the notes so cached search results
+        # from an older generation are never reused
+        self.generation = 0
+        self.search_cache = collections.OrderedDict()
+        self.search_cache_lock = threading.Lock()
+        self.regex_search = ParallelRegexSearch()
+        self.trigram_index = TrigramIndex()
+        self.category_index = CategoryIndex()
+
         # create db dir if it does not exist
         if not os.path.exists(self.config.get_config('db_path')):
             os.mkdir(self.config.get_config('db_path'))
 
+        # where the timing stats of past runs are kept
+        self.stats_file = os.path.join(self.config.get_config('db_path'),
+                                       'nncli.stats')
+
+        # metrics of each server sync are optionally exported to a file
+        self.metrics_file = self.config.get_config('metrics_file')
+
+        load_start = stats.clock()
         now = int(time.time())
         # now read all .json files from disk
         fnlist = glob.glob(self._helper_key_to_fname('*'))
 
         self.notes = {}
+        # keys of the notes changed since they were last saved to disk,
+        # and of those changed since they were last synced to the server
+        self.needs_save = {}
+        self.needs_push = {}
 
         for func in fnlist:
             try:
-                note = json.load(open(func, 'r'))
+                note = codec.load_file(func)
             except IOError as ex:
                 raise ReadError('Error opening {0}: {1}'.format(func, str(ex)))
             except ValueError as ex:
@@ -61,6 +121,9 @@ class NotesDB():
                         'localkey',
                         os.path.splitext(os.path.basename(func))[0]
                         )
+                if self.key_prefix:
+                    localkey = self.key_prefix + \
+                            os.path.splitext(os.path.basename(func))[0]
                 # we maintain in memory a timestamp of the last save
                 # these notes have just been read, so at this moment
                 # they're in sync with the disc.
@@ -72,12 +135,56 @@ class NotesDB():
 
                 # add the note to our database
                 self.notes[localkey] = note
-
-        # initialise the NextCloud instance we're going to use
-        # this does not yet need network access
-        self.note = NextcloudNote(self.config.get_config('nn_username'),
-                                  self.config.get_config('nn_password'),
-                                  self.config.get_config('nn_host'))
+                if not note.get('id') or float(note['modified']) > \
+                        float(note.get('syncdate', 0)):
+                    self.needs_push[localkey] = True
+
+        # changes made since the notes were last saved to disk
+        self.oplog = OperationLog(
+                os.path.join(self.config.get_config('db_path'),
+                             'nncli.oplog'))
+        replayed = 0
+        for operation in self.oplog.replay():
+            replayed += self._replay_operation(operation)
+
+        self.category_index.build(self.notes)
+        stats.elapsed('db.load', load_start)
+        stats.count('db.notes_loaded', len(self.notes))
+
+        # the NextCloud instance is only created, and requests only
+        # imported, once a sync needs it
+        self._note = None
+
+        self._log_count('Recovered %d unsaved change%s', replayed)
+
+    @property
+    def note(self):
+        """The NextCloud instance we're syncing with"""
+        if self._note is None:
+            from .nextcloud_note import NextcloudNote
+            self._note = NextcloudNote(self.config.get_config('nn_username'),
+                                       self.config.get_config('nn_password'),
+                                       self.config.get_config('nn_host'))
+        return self._note
+
+    @note.setter
+    def note(self, note):
+        self._note = note
+
+    def _local_key(self, note_id):
+        """Return the key of the note with the server ID note_id"""
+        if self.key_prefix:
+            return self.key_prefix + str(note_id)
+        return note_id
+
+    def _new_key(self):
+        """Return a random key no note has yet"""
+        # need to get a key unique to this database. not really important
+        # what it is, as long as it's unique.
+        new_key = self.key_prefix + utils.generate_random_key()
+        while new_key in self.notes:
+            new_key = self.key_prefix + utils.generate_random_key()
+        return new_key
 
     def set_update_view(self, update_view):
         """Set the update_view method"""
@@ -85,6 +192,11 @@ class NotesDB():
 
     def filtered_notes_sort(self, filtered_notes, sort_mode='date'):
         """Sort filtered note set"""
+        with stats.timer('db.sort'):
+            self._helper_sort(filtered_notes, sort_mode)
+
+    def _helper_sort(self, filtered_notes, sort_mode):
+        """Sort filtered note set in place"""
         if sort_mode == 'date':
             if self.config.get_config('favorite_ontop') == 'yes':
                 filtered_notes.sort(key=utils.sort_by_modify_date_favorite,
@@ -101,7 +213,8 @@ class NotesDB():
         elif sort_mode == 'categories':
             favorite = self.config.get_config('favorite_ontop')
             utils.sort_notes_by_categories(filtered_notes, \
-                    favorite_ontop=favorite)
+                    favorite_ontop=favorite,
+                    ranks=self.category_index.ranks())
 
     def filter_notes(self, search_string=None, search_mode='gstyle',
                      sort_mode='date'):
@@ -111,60 +224,153 @@ class NotesDB():
         this method will call the appropriate helper method to do the
         actual work of filtering the notes.
 
+        Recent results are cached. A Google-style query that narrows a
+        cached one (e.g. 'foo' refined into 'foo bar') only filters the
+        notes matched by the cached query.
+
         Returns a list of filtered notes with selected search mode and sorted
         according to configuration. Two more elements in tuple: a regular
         expression that can be used for highlighting strings in the text widget
         and the total number of notes in memory.
         """
-
+        cache_key = (search_string, search_mode, sort_mode, self.generation)
+        cached = self._search_cache_get(cache_key)
+        if cached is not None:
+            stats.count('db.filter_cache_hits')
+            filtered_notes, match_regexp, active_notes = cached
+            return list(filtered_notes), match_regexp, active_notes
+
+        filter_start = stats.clock()
         if search_mode == 'gstyle':
             filtered_notes, match_regexp, active_notes = \
-                self._filter_notes_gstyle(search_string)
+                self._filter_notes_gstyle(
+                        search_string,
+                        self._search_cache_candidates(cache_key)
+                        )
         else:
             filtered_notes, match_regexp, active_notes = \
                 self._filter_notes_regex(search_string)
 
+        stats.elapsed('db.filter_' + search_mode, filter_start)
+
         self.filtered_notes_sort(filtered_notes, sort_mode)
 
-        return filtered_notes, match_regexp, active_notes
+        self._search_cache_put(cache_key,
+                               (filtered_notes, match_regexp, active_notes))
+
+        return list(filtered_notes), match_regexp, active_notes
+
+    def _touch(self):
+        """Record that the notes changed, invalidating cached searches"""
+        self.generation += 1
+
+    def _index_note(self, key):
+        """Update the search indexes after a note was added or changed"""
+        self.trigram_index.update(key, self.notes[key].get('content'))
+        self.category_index.update(key, self.notes[key].get('category'))
+
+    def _unindex_note(self, key):
+        """Update the search indexes after a note was removed"""
+        self.trigram_index.remove(key)
+        self.category_index.remove(key)
+
+    def get_categories(self):
+        """Return a sorted list of (category, number of notes) tuples"""
+        return self.category_index.categories()
+
+    def _search_cache_get(self, cache_key):
+        """Get a cached filter result, dropping stale generations"""
+        with self.search_cache_lock:
+            for key in list(self.search_cache.keys()):
+                if key[3] != self.generation:
+                    del self.search_cache[key]
+            result = self.search_cache.get(cache_key)
+            if result is not None:
+                self.search_cache.move_to_end(cache_key)
+            return result
+
+    def _search_cache_put(self, cache_key, result):
+        """Cache a filter result, evicting the least recently used"""
+        if cache_key[3] != self.generation:
+            # the notes changed while filtering
+            return
+        with self.search_cache_lock:
+            self.search_cache[cache_key] = result
+            while len(self.search_cache) > SEARCH_CACHE_SIZE:
+                self.search_cache.popitem(last=False)
+
+    def _search_cache_candidates(self, cache_key):
+        """
+        Return the keys of the smallest cached Google-style result that
+        is a superset of the result for cache_key, or None
+        """
+        search_string, _, _, generation = cache_key
+        if not search_string:
+            return None
+        new_pats = self._helper_gstyle_parse(search_string)
+
+        candidates = None
+        with self.search_cache_lock:
+            for key, result in self.search_cache.items():
+                if key[1] != 'gstyle' or key[3] != generation or not key[0]:
+                    continue
+                if candidates is not None and \
+                        len(result[0]) >= len(candidates):
+                    continue
+                old_pats = self._helper_gstyle_parse(key[0])
+                if self._helper_gstyle_narrows(old_pats, new_pats):
+                    candidates = [n.key for n in result[0]]
+        return candidates
 
     @staticmethod
-    def _helper_gstyle_categorymatch(cat_pats, note):
-        """Match categories using a Google-style search string"""
-        # Returns:
-        #  2 = match    - no category patterns specified
-        #  1 = match    - all category patterns match a category on this
-        #                 note
-        #  0 = no match - note has no category or not all category
-        #                 patterns match
-
-        if not cat_pats:
-            # match because no category patterns were specified
-            return 2
-
-        note_category = note.get('category')
-
-        if not note_category:
-            # category patterns specified but note has no categories,
-            # so no match
-            return 0
+    def _helper_gstyle_parse(search_string):
+        """
+        Split a Google-style search string into
+        [[cat_pats], [multi_word_pats], [single_word_pats]]
+        """
+        # group0: category:([^\s]+)
+        # group1: multiple words in quotes
+        # group2: single words
 
-        # for each cat_pat, we have to find a matching category
-        # .lower() used for case-insensitive search
-        cat_pats_matched = 0
-        for cat_pat in cat_pats:
-            cat_pat = cat_pat.lower()
-            for pat in note_category:
-                if cat_pat in pat.lower():
-                    cat_pats_matched += 1
-                    break
-
-        if cat_pats_matched == len(cat_pats):
-            # all category patterns specified matched a category on this note
-            return 1
+        # example result for: 'category:category1 category:category2
+        # word1 "word2 word3" category:category3'
+        # [ ('category1', '',            ''),
+        #   ('category2', '',            ''),
+        #   ('',     '',            'word1'),
+        #   ('',     'word2 word3', ''),
+        #   ('category3', '',            '') ]
+
+        groups = re.findall(
+                r'category:([^\s]+)|"([^"]+)"|([^\s]+)', search_string
+                )
+        all_pats = [[] for _ in range(3)]
+
+        # we end up with [[cat_pats],[multi_word_pats],[single_word_pats]]
+        for group in groups:
+            for i in range(3):
+                if group[i]:
+                    all_pats[i].append(group[i])
 
-        # note doesn't match
-        return 0
+        return all_pats
+
+    @staticmethod
+    def _helper_gstyle_narrows(old_pats, new_pats):
+        """
+        True if every note matching new_pats also matches old_pats
+
+        Words are matched by case-insensitive substring search and
+        categories by case-insensitive prefix, so this holds when each old
+        pattern is contained in (or for categories, starts) a new pattern
+        of the same kind.
+        """
+        new_cats = [pat.casefold() for pat in new_pats[0]]
+        if not all(any(npat.startswith(pat.casefold()) for npat in new_cats)
+                   for pat in old_pats[0]):
+            return False
+
+        new_words = [pat.lower() for pat in new_pats[1] + new_pats[2]]
+        return all(any(pat.lower() in npat for npat in new_words)
+                   for pat in old_pats[1] + old_pats[2])
 
     @staticmethod
     def _helper_gstyle_wordmatch(word_pats, content):
@@ -184,65 +390,53 @@ class NotesDB():
 
         return False
 
-    def _filter_notes_gstyle(self, search_string=None):
-        """Filter the notes based of a Google-style search string"""
+    def _filter_notes_gstyle(self, search_string=None, candidates=None):
+        """
+        Filter the notes based of a Google-style search string
+
+        If candidates is given only the notes with those keys are
+        considered.
+        """
         filtered_notes = []
-        active_notes = 0
+        active_notes = len(self.notes)
 
         if not search_string:
             for key in self.notes:
                 note = self.notes[key]
-                active_notes += 1
                 filtered_notes.append(
                         utils.KeyValueObject(key=key, note=note, catfound=0)
                         )
 
             return filtered_notes, [], active_notes
 
-        # group0: category:([^\s]+)
-        # group1: multiple words in quotes
-        # group2: single words
-
-        # example result for: 'category:category1 category:category2
-        # word1 "word2 word3" category:category3'
-        # [ ('category1', '',            ''),
-        #   ('category2', '',            ''),
-        #   ('',     '',            'word1'),
-        #   ('',     'word2 word3', ''),
-        #   ('category3', '',            '') ]
-
-        groups = re.findall(
-                r'category:([^\s]+)|"([^"]+)"|([^\s]+)', search_string
-                )
-        all_pats = [[] for _ in range(3)]
-
-        # we end up with [[cat_pats],[multi_word_pats],[single_word_pats]]
-        for group in groups:
-            for i in range(3):
-                if group[i]:
-                    all_pats[i].append(group[i])
-
-        for key in self.notes:
-            note = self.notes[key]
-
-            active_notes += 1
-
-            catmatch = self._helper_gstyle_categorymatch(all_pats[0],
-                                                         note)
-
-            word_pats = all_pats[1] + all_pats[2]
+        all_pats = self._helper_gstyle_parse(search_string)
+        word_pats = all_pats[1] + all_pats[2]
+
+        # all category patterns have to match the start of the category
+        catfound = 0
+        if all_pats[0]:
+            catfound = 1
+            cat_keys = None
+            for cat_pat in all_pats[0]:
+                keys = self.category_index.keys_with_prefix(cat_pat)
+                cat_keys = keys if cat_keys is None else cat_keys & keys
+            candidates = [key for key in
+                          (self.notes if candidates is None else candidates)
+                          if key in cat_keys]
+
+        for key in self.notes if candidates is None else candidates:
+            note = self.notes.get(key)
+            if note is None:
+                continue
 
-            if catmatch and \
-               self._helper_gstyle_wordmatch(word_pats, note.get('content')):
+            if self._helper_gstyle_wordmatch(word_pats, note.get('content')):
                 # we have a note that can go through!
                 filtered_notes.append(
                         utils.KeyValueObject(key=key,
                                              note=note,
-                                             catfound=1 \
-                                                     if catmatch == 1 \
-                                                     else 0))
+                                             catfound=catfound))
 
-        return filtered_notes, '|'.join(all_pats[1] + all_pats[2]), active_notes
+        return filtered_notes, '|'.join(word_pats), active_notes
 
     def _filter_notes_regex(self, search_string=None):
         """
@@ -252,47 +446,63 @@ class NotesDB():
         sspat = utils.build_regex_search(search_string)
 
         filtered_notes = []
-        active_notes = 0 # total number of notes, including deleted ones
-
-        for key in self.notes:
-            note = self.notes[key]
-
-            active_notes += 1
+        active_notes = len(self.notes) # total number of notes
 
-            if not sspat:
+        if not sspat:
+            for key in self.notes:
                 filtered_notes.append(
-                        utils.KeyValueObject(key=key, note=note, catfound=0)
+                        utils.KeyValueObject(key=key,
+                                             note=self.notes[key],
+                                             catfound=0)
                         )
-                continue
+            return filtered_notes, '', active_notes
 
-            if self.config.get_config('search_categories') == 'yes':
-                cat_matched = False
-                for cat in note.get('category'):
-                    if sspat.search(cat):
-                        cat_matched = True
-                        filtered_notes.append(
-                                utils.KeyValueObject(key=key,
-                                                     note=note, catfound=1)
-                                )
-                        break
-                if cat_matched:
-                    continue
+        cat_matched = set()
+        if self.config.get_config('search_categories') == 'yes':
+            cat_matched = self.category_index.keys_matching(sspat)
+
+        if not self.trigram_index.built:
+            self.trigram_index.build(self.notes)
+        candidates = self.trigram_index.candidates(sspat)
+
+        content_matched = self._regex_search_contents(
+                sspat, [key for key in self.notes
+                        if key not in cat_matched and
+                        (candidates is None or key in candidates)])
 
-            if sspat.search(note.get('content')):
+        for key in self.notes:
+            if key in cat_matched or key in content_matched:
                 filtered_notes.append(
-                        utils.KeyValueObject(key=key, note=note, catfound=0)
+                        utils.KeyValueObject(key=key,
+                                             note=self.notes[key],
+                                             catfound=1 \
+                                                     if key in cat_matched \
+                                                     else 0)
                         )
 
-        match_regexp = search_string if sspat else ''
-        return filtered_notes, match_regexp, active_notes
+        return filtered_notes, search_string, active_notes
+
+    def _regex_search_contents(self, sspat, keys):
+        """
+        Return the set of keys whose note content matches sspat, using
+        worker processes when the database is large enough
+        """
+        if self.regex_search.usable(self.notes):
+            try:
+                return self.regex_search.search(sspat, self.notes, keys,
+                                                self.generation)
+            except (OSError, RuntimeError) as ex:
+                self.log('Parallel search failed, searching serially: %s',
+                         ex)
+        return {key for key in keys
+                if sspat.search(self.notes[key].get('content'))}
 
     def import_note(self, note):
         """Import a note into the database"""
-        # need to get a key unique to this database. not really important
-        # what it is, as long as it's unique.
-        new_key = note['id'] if note.get('id') else utils.generate_random_key()
-        while new_key in self.notes:
-            new_key = utils.generate_random_key()
+        new_key = self._local_key(note['id']) if note.get('id') \
+                else self._new_key()
+        if new_key in self.notes:
+            new_key = self._new_key()
 
         timestamp = int(time.time())
 
@@ -332,16 +542,17 @@ class NotesDB():
             raise ValueError('"favorite" must be a boolean')
 
         self.notes[new_key] = new_note
+        self._mark_changed(new_key)
+        self._log_operation({'op': 'create', 'key': new_key,
+                             'note': new_note})
+        self._index_note(new_key)
+        self._touch()
 
         return new_key
 
     def create_note(self, content):
         """Create a new note in the database"""
-        # need to get a key unique to this database. not really important
-        # what it is, as long as it's unique.
-        new_key = utils.generate_random_key()
-        while new_key in self.notes:
-            new_key = utils.generate_random_key()
+        new_key = self._new_key()
 
         timestamp = int(time.time())
         title = content.split('\n')[0]
@@ -361,6 +572,11 @@ class NotesDB():
                 }
 
         self.notes[new_key] = new_note
+        self._mark_changed(new_key)
+        self._log_operation({'op': 'create', 'key': new_key,
+                             'note': new_note})
+        self._index_note(new_key)
+        self._touch()
 
         return new_key
 
@@ -368,6 +584,22 @@ class NotesDB():
         """Get a note from the database"""
         return self.notes[key]
 
+    def current_key(self, key):
+        """
+        Return the key of the note that had key, which changes when a
+        new note is first pushed to the server
+        """
+        while key in self.moved_keys:
+            key = self.moved_keys[key]
+        return key
+
+    def note_lock(self, key):
+        """
+        Return the lock to hold while changing the note with key from
+        another thread than the sync worker's
+        """
+        return self.sync_lock
+
     @staticmethod
     def _flag_what_changed(note, what_changed):
         """Flag a note field as changed"""
@@ -376,60 +608,119 @@ class NotesDB():
         if what_changed not in note['what_changed']:
             note['what_changed'].append(what_changed)
 
+    def _set_note_field(self, key, field, value, modified):
+        """
+        Set a field of a note as a change to sync and record it in the
+        operation log
+        """
+        self._apply_note_field(key, field, value, modified)
+        self._log_operation({'op': field, 'key': key, 'value': value,
+                             'modified': modified})
+
+    def _apply_note_field(self, key, field, value, modified):
+        """Set a field of a note as a change to sync"""
+        note = self.notes[key]
+        note[field] = value
+        note['modified'] = modified
+        self._flag_what_changed(note, field)
+        self._mark_changed(key)
+
+    def _log_operation(self, operation):
+        """Append an operation to the operation log"""
+        try:
+            self.oplog.append(operation)
+        except (IOError, OSError) as ex:
+            self.log('ERROR: Failed to write operation log: %s', ex)
+
+    def _replay_operation(self, operation):
+        """
+        Apply an operation read back from the operation log unless the
+        note on disk already has the change. Returns 1 if it was
+        applied, 0 otherwise.
+        """
+        try:
+            key = operation['key']
+            if operation['op'] == 'create':
+                if key in self.notes:
+                    return 0
+                self.notes[key] = dict(operation['note'], localkey=key)
+                self._mark_changed(key)
+                return 1
+            field = operation['op']
+            note = self.notes.get(key)
+            if note is None or note.get(field) == operation['value'] or \
+                    float(note['modified']) > operation['modified']:
+                return 0
+            self._apply_note_field(key, field, operation['value'],
+                                   operation['modified'])
+            return 1
+        except (KeyError, TypeError, ValueError):
+            logging.warning('Skipping bad operation %s', operation)
+            return 0
+
+    def _mark_changed(self, key):
+        """Record that a note needs to be saved to disk and synced"""
+        self.needs_save[key] = True
+        self.needs_push[key] = True
+
     def set_note_deleted(self, key, deleted):
         """Mark a note for deletion"""
         note = self.notes[key]
         old_deleted = note['deleted'] if 'deleted' in note else 0
         if old_deleted != deleted:
-            note['deleted'] = deleted
-            note['modified'] = int(time.time())
-            self._flag_what_changed(note, 'deleted')
-            self.log('Note marked for deletion (key={0})'.format(key))
+            self._set_note_field(key, 'deleted', deleted, int(time.time()))
+            self._touch()
+            self.log('Note marked for deletion (key=%s)', key)
 
     def set_note_content(self, key, content):
         """Set the content of a note in the database"""
         note = self.notes[key]
         old_content = note.get('content')
         if content != old_content:
-            note['content'] = content
-            note['modified'] = int(time.time())
-            self._flag_what_changed(note, 'content')
-            self.log('Note content updated (key={0})'.format(key))
+            self._set_note_field(key, 'content', content, int(time.time()))
+            self._index_note(key)
+            self._touch()
+            self.log('Note content updated (key=%s)', key)
 
     def set_note_category(self, key, category):
         """Set the category of a note in the database"""
         note = self.notes[key]
         old_category = note.get('category')
         if category != old_category:
-            note['category'] = category
-            note['modified'] = int(time.time())
-            self._flag_what_changed(note, 'category')
-            self.log('Note category updated (key={0})'.format(key))
+            self._set_note_field(key, 'category', category, int(time.time()))
+            self.category_index.update(key, category)
+            self._touch()
+            self.log('Note category updated (key=%s)', key)
 
     def set_note_favorite(self, key, favorite):
         """Mark a note in the database as a favorite"""
         note = self.notes[key]
         old_favorite = utils.note_favorite(note)
         if favorite != old_favorite:
-            note['favorite'] = favorite
-            note['modified'] = int(time.time())
-            self._flag_what_changed(note, 'favorite')
-            self.log('Note {0} (key={1})'. \
-                    format('favorite' if favorite else \
-                    'unfavorited', key))
+            self._set_note_field(key, 'favorite', favorite, int(time.time()))
+            self._touch()
+            self.log('Note %s (key=%s)',
+                     'favorite' if favorite else 'unfavorited', key)
 
     def _helper_key_to_fname(self, k):
         """Convert a note key into a file name"""
-        return os.path.join(self.config.get_config('db_path'), str(k)) + '.json'
+        fname = str(k)
+        if self.key_prefix and fname.startswith(self.key_prefix):
+            fname = fname[len(self.key_prefix):]
+        return os.path.join(self.config.get_config('db_path'), fname) + '.json'
 
     def _helper_save_note(self, k, note):
         """Save a note to the file system"""
         # Save a single note to disc.
         func = self._helper_key_to_fname(k)
-        json.dump(note, open(func, 'w'), indent=2)
+        try:
+            codec.dump_file(note, func)
+        except (IOError, TypeError) as ex:
+            raise WriteError('Error writing {0}: {1}'.format(func, str(ex)))
 
         # record that we saved this to disc.
         note['savedate'] = int(time.time())
+        self.needs_save.pop(k, None)
 
     def sync_notes(self, server_sync=True, full_sync=True):
         """Perform a full bi-directional sync with server.
@@ -452,174 +743,182 @@ class NotesDB():
                    PERMANENT DELETE, remove note from local store
         """
 
-        local_updates = {}
+        # notes changed since they were last saved to disk are saved after
+        # the sync, even if offline or the sync fails
+        local_updates = dict.fromkeys(self.needs_save, True)
         local_deletes = {}
+        # notes pulled and saved to disk with their chunk of the index
+        local_saves = {}
         server_keys = {}
         now = int(time.time())
 
         sync_start_time = int(time.time())
         sync_errors = 0
         skip_remote_syncing = False
+        # no request is made without server_sync
+        failed_request = request_errors() if server_sync else ()
 
         if server_sync and full_sync:
             self.log("Starting full sync")
 
+        run = metrics.SyncRun(full_sync)
+        http_before = collections.Counter(self.note.http)
+
         # 1. for any note changed locally, including new notes:
         #        save note to server, update note with response
-        for _, local_key in enumerate(self.notes.keys()):
+        for local_key in list(self.needs_push):
             note = self.notes[local_key]
 
-            if not note.get('id') or \
-               float(note.get('modified')) > float(note.get('syncdate')):
-
-                savedate = float(note.get('savedate'))
-                if float(note.get('modified')) > savedate or \
-                   float(note.get('syncdate')) > savedate:
-                    # this will trigger a save to disk after sync algorithm
-                    # we want this note saved even if offline or sync fails
-                    local_updates[local_key] = True
-
-                if not server_sync:
-                    # the 'what_changed' field will be written to disk and
-                    # picked up whenever the next full server sync occurs
-                    continue
-
-                # only send required fields
-                cnote = copy.deepcopy(note)
-                if 'what_changed' in note:
-                    del note['what_changed']
-
-                if 'localkey' in cnote:
-                    del cnote['localkey']
-
-                if 'minversion' in cnote:
-                    del cnote['minversion']
-                del cnote['syncdate']
-                del cnote['savedate']
-                del cnote['deleted']
-                if 'etag' in cnote:
-                    del cnote['etag']
-                if 'title' in cnote:
-                    del cnote['title']
-
-                if 'what_changed' in cnote:
-                    if 'content' not in cnote['what_changed'] \
-                            and 'category' not in cnote['what_changed']:
-                        del cnote['content']
-                    if 'category' not in cnote['what_changed']:
-                        del cnote['category']
-                    if 'favorite' not in cnote['what_changed']:
-                        del cnote['favorite']
-                    del cnote['what_changed']
+            if not server_sync:
+                # the 'what_changed' field will be written to disk and
+                # picked up whenever the next full server sync occurs
+                continue
 
-                try:
-                    if note['deleted']:
-                        uret = self.note.delete_note(cnote)
-                    else:
-                        uret = self.note.update_note(cnote)
-
-                    # if this is a new note our local key is not valid anymore
-                    # merge the note we got back (content could be empty)
-                    # record syncdate and save the note at the assigned key
-                    del self.notes[local_key]
-                    key = uret[0].get('id')
-                    category = uret[0].get('category')
-                    category = category if category is not None else ''
-                    note.update(uret[0])
-                    note['syncdate'] = now
-                    note['localkey'] = key
-                    note['category'] = category
-                    self.notes[key] = note
+            # only send required fields
+            cnote = copy.deepcopy(note)
+            if 'what_changed' in note:
+                del note['what_changed']
+
+            if 'localkey' in cnote:
+                del cnote['localkey']
+
+            if 'minversion' in cnote:
+                del cnote['minversion']
+            del cnote['syncdate']
+            del cnote['savedate']
+            del cnote['deleted']
+            if 'etag' in cnote:
+                del cnote['etag']
+            if 'readonly' in cnote:
+                del cnote['readonly']
+            if 'title' in cnote:
+                del cnote['title']
+
+            if 'what_changed' in cnote:
+                if 'content' not in cnote['what_changed'] \
+                        and 'category' not in cnote['what_changed']:
+                    del cnote['content']
+                if 'category' not in cnote['what_changed']:
+                    del cnote['category']
+                if 'favorite' not in cnote['what_changed']:
+                    del cnote['favorite']
+                del cnote['what_changed']
 
-                    local_updates[key] = True
-                    if local_key != key:
-                        # if local_key was a different key it should be deleted
-                        local_deletes[local_key] = True
-                        if local_key in local_updates:
-                            del local_updates[local_key]
-
-                    self.log(
-                            'Synced note to server (key={0})'.format(local_key)
-                            )
-                except (ConnectionError, RequestException, ValueError):
-                    self.log(
-                            'ERROR: Failed to sync note to server (key={0})'.
-                            format(local_key)
-                            )
-                    sync_errors += 1
-
-        # 2. get the note index
-        if not server_sync:
-            note_list = []
-        else:
-            note_list = self.note.get_note_list()
+            try:
+                if note['deleted']:
+                    uret = self.note.delete_note(cnote)
+                else:
+                    uret = self.note.update_note(cnote)
+
+                # if this is a new note our local key is not valid anymore
+                # merge the note we got back (content could be empty)
+                # record syncdate and save the note at the assigned key
+                del self.notes[local_key]
+                key = self._local_key(uret[0].get('id'))
+                category = uret[0].get('category')
+                category = category if category is not None else ''
+                note.update(uret[0])
+                note['syncdate'] = now
+                note['localkey'] = key
+                note['category'] = category
+                self.notes[key] = note
+                self._unindex_note(local_key)
+                self._index_note(key)
+
+                self.needs_push.pop(local_key, None)
+                self.needs_save[key] = True
+                local_updates[key] = True
+                if local_key != key:
+                    # if local_key was a different key it should be deleted
+                    local_deletes[local_key] = True
+                    self.moved_keys[local_key] = key
+                    self.needs_save.pop(local_key, None)
+                    if local_key in local_updates:
+                        del local_updates[local_key]
+
+                run.count('pushed')
+                logging.debug('Synced note to server (key=%s)',
+                              local_key)
+            except failed_request:
+                logging.warning('Failed to sync note to server (key=%s)',
+                                local_key)
+                run.count('push_failed')
+                sync_errors += 1
 
-            if note_list[1] == 0:  # success
-                note_list = note_list[0]
-            else:
+        run.end_phase('push')
+        self._log_count('Synced %d note%s to server', run.counts['pushed'])
+        self._log_count('ERROR: Failed to sync %d note%s to server',
+                        run.counts['push_failed'])
+
+        # 2. get the note index, in chunks when the server supports it
+        #        a listed note changed since the last sync comes with
+        #        its content when the server supports that; it is pulled
+        #        right away and saved to disk with the rest of its chunk
+        #    collect the listed notes that are new or changed but came
+        #    without content
+        wanted = collections.OrderedDict()
+        if server_sync:
+            chunks = 0
+            listed = 0
+            try:
+                for chunk, last in \
+                        self.note.iter_note_chunks(self._prune_before()):
+                    chunks += 1
+                    listed += len(chunk)
+                    pulled = self._list_chunk(chunk, server_keys, wanted, now)
+                    for key in pulled:
+                        self._helper_save_note(key, self.notes[key])
+                        local_updates.pop(key, None)
+                        local_saves[key] = True
+                        run.count('pulled')
+                    if chunks > 1 or not last:
+                        self.log('Listed %d notes from server', listed)
+            except failed_request:
+                logging.warning('Failed to get note list', exc_info=True)
                 self.log('ERROR: Failed to get note list from server')
                 sync_errors += 1
-                note_list = []
                 skip_remote_syncing = True
 
+        run.end_phase('index')
+
         # 3. for each remote note
         #        if remote modified > local modified ||
         #           a new note and key is not in local store
         #            retrieve note, update note with response
+        #    when many notes are needed they are all taken from one
+        #    listing of the notes with their content
         if not skip_remote_syncing:
-            for _, note in enumerate(note_list):
-                key = note.get('id')
-                category = note.get('category') \
-                        if note.get('category') is not None \
-                        else ''
-                server_keys[key] = True
-                # this works because in the prior step we rewrite local keys to
-                # server keys when we get an updated note back from the server
-                if key in self.notes:
-                    # we already have this note
-                    # if the server note has a newer syncnum we need to get it
-                    if int(note.get('modified')) > \
-                            int(self.notes[key].get('modified')):
-                        gret = self.note.get_note(key)
-                        if gret[1] == 0:
-                            self.notes[key].update(gret[0])
+            if use_bulk_fetch(len(wanted), len(server_keys)):
+                run.count('bulk_fetches')
+                try:
+                    for server_note in self.note.iter_notes():
+                        note = wanted.pop(server_note.get('id'), None)
+                        if note is not None:
+                            key = self._pull_note(note, server_note, now)
                             local_updates[key] = True
-                            self.notes[key]['syncdate'] = now
-                            self.notes[key]['localkey'] = key
-                            self.notes[key]['category'] = category
-                            self.notes[key]['deleted'] = False
-
-                            self.log(
-                                    'Synced newer note from server (key={0})'.
-                                    format(key)
-                                    )
-                        else:
-                            self.log(
-                                    'ERROR: Failed to sync newer note '
-                                    'from server (key={0})'.format(key)
-                                    )
-                            sync_errors += 1
+                            run.count('pulled')
+                except failed_request:
+                    # whatever is left is fetched one note at a time
+                    logging.warning('Failed to list notes with content',
+                                    exc_info=True)
+
+            for note_id, note in wanted.items():
+                gret = self.note.get_note(note_id)
+                if gret[1] == 0:
+                    key = self._pull_note(note, gret[0], now)
+                    local_updates[key] = True
+                    run.count('pulled')
                 else:
-                    # this is a new note
-                    gret = self.note.get_note(key)
-                    if gret[1] == 0:
-                        self.notes[key] = gret[0]
-                        local_updates[key] = True
-                        self.notes[key]['syncdate'] = now
-                        self.notes[key]['localkey'] = key
-                        self.notes[key]['category'] = category
-                        self.notes[key]['deleted'] = False
-
-                        self.log(
-                                'Synced new note from server (key={0})'.
-                                format(key)
-                                )
-                    else:
-                        self.log(
-                                'ERROR: Failed syncing new note from'
-                                'server (key={0})'.format(key)
-                                )
-                        sync_errors += 1
+                    logging.warning(
+                            'Failed to sync note from server (key=%s)',
+                            self._local_key(note_id))
+                    run.count('pull_failed')
+                    sync_errors += 1
+
+        run.end_phase('pull')
+        self._log_count('Synced %d note%s from server', run.counts['pulled'])
+        self._log_count('ERROR: Failed to sync %d note%s from server',
+                        run.counts['pull_failed'])
 
         # 4. for each local note not in the index
         #        PERMANENT DELETE, remove note from local store
@@ -628,7 +927,13 @@ class NotesDB():
             for local_key in list(self.notes.keys()):
                 if local_key not in server_keys:
                     del self.notes[local_key]
+                    self._unindex_note(local_key)
+                    self.needs_save.pop(local_key, None)
+                    self.needs_push.pop(local_key, None)
                     local_deletes[local_key] = True
+                    run.count('deleted')
+
+        run.end_phase('prune')
 
         # sync done, now write changes to db_path
 
@@ -637,19 +942,45 @@ class NotesDB():
                 self._helper_save_note(key, self.notes[key])
             except WriteError as ex:
                 raise WriteError(str(ex))
-            self.log("Saved note to disk (key={0})".format(key))
+            logging.debug('Saved note to disk (key=%s)', key)
 
+        # the changes saved to disk are no longer needed in the log; drop
+        # them before unlinking, or a crash in between would replay the
+        # changes of a note pushed under a new key at its old key
+        try:
+            self.oplog.compact(
+                    lambda operation: operation.get('key') in self.needs_save)
+        except (IOError, OSError) as ex:
+            self.log('ERROR: Failed to compact operation log: %s', ex)
+
+        removed = 0
         for key in list(local_deletes.keys()):
             fnote = self._helper_key_to_fname(key)
             if os.path.exists(fnote):
                 os.unlink(fnote)
-                self.log("Deleted note from disk (key={0})".format(key))
+                removed += 1
+                logging.debug('Deleted note from disk (key=%s)', key)
+
+        run.end_phase('save')
+        saved = len(local_updates) + len(local_saves)
+        run.count('saved', saved)
+        self._log_count('Saved %d note%s to disk', saved)
+        self._log_count('Deleted %d note%s from disk', removed)
+        run.finish(sync_errors, http_before, self.note)
 
         if not sync_errors:
             self.last_sync = sync_start_time
 
+        if server_sync and self.metrics_file:
+            try:
+                metrics.write_textfile(self.metrics_file, run,
+                                       self.last_sync)
+            except (IOError, OSError) as ex:
+                self.log('ERROR: Failed to write sync metrics: %s', ex)
+
         # if there were any changes then update the current view
-        if local_updates or local_deletes:
+        if local_updates or local_deletes or local_saves:
+            self._touch()
             self.update_view()
 
         if server_sync and full_sync:
@@ -657,29 +988,85 @@ class NotesDB():
 
         return sync_errors
 
-    def _get_note_status(self, key):
-        """Get the note status"""
-        note = self.notes[key]
-        obj = utils.KeyValueObject(saved=False, synced=False, modified=False)
-        modified = float(note['modified'])
-        savedate = float(note['savedate'])
+    def _prune_before(self):
+        """
+        Return the Unix time before which notes on the server are taken
+        to be unchanged since they were synced, None if no note was.
+        It trails the last change of a synced note by PRUNE_MARGIN, as
+        clients set modification times with their own clocks.
+        """
+        modified = [float(note['modified']) for note in self.notes.values()
+                    if note.get('id') and
+                    float(note['modified']) <= float(note['syncdate'])]
+        if not modified:
+            return None
+        return max(modified) - PRUNE_MARGIN
+
+    def _list_chunk(self, chunk, server_keys, wanted, now):
+        """
+        Go through a chunk of the note index: record the keys of the
+        listed notes in server_keys, pull the new or changed notes that
+        came with their content and add those that didn't to wanted.
+        Returns the keys of the pulled notes.
+        """
+        pulled = []
+        for note in chunk:
+            note_id = note.get('id')
+            key = self._local_key(note_id)
+            server_keys[key] = True
+            # this works because in the prior step we rewrite local keys to
+            # server keys when we get an updated note back from the server
+            # notes listed with only their id are unchanged
+            if key in self.notes and \
+                    ('modified' not in note or
+                     int(note.get('modified')) <=
+                     int(self.notes[key].get('modified'))):
+                continue
+            if 'content' in note:
+                wanted.pop(note_id, None)
+                pulled.append(self._pull_note(note, note, now))
+            else:
+                wanted[note_id] = note
+        return pulled
 
-        if savedate > modified:
-            obj.saved = True
-        return obj
+    def _pull_note(self, note, server_note, now):
+        """
+        Store server_note, the note listed in the index as note, as
+        retrieved from the server. Returns its key.
+        """
+        key = self._local_key(note.get('id'))
+        category = server_note.get('category', note.get('category'))
+        category = category if category is not None else ''
+        if key in self.notes:
+            self.notes[key].update(server_note)
+            logging.debug('Synced newer note from server (key=%s)', key)
+        else:
+            self.notes[key] = server_note
+            logging.debug('Synced new note from server (key=%s)', key)
+        self.notes[key]['syncdate'] = now
+        self.notes[key]['localkey'] = key
+        self.notes[key]['category'] = category
+        self.notes[key]['deleted'] = False
+        self._index_note(key)
+        self.needs_push.pop(key, None)
+        self.needs_save[key] = True
+        return key
+
+    def _log_count(self, msg, count):
+        """
+        Log msg formatted with count and a plural suffix, unless count is
+        zero
+        """
+        if count:
+            self.log(msg, count, '' if count == 1 else 's')
 
     def verify_all_saved(self):
         """
         Verify all notes in the local database are saved to the
         server
         """
-        all_saved = True
         self.sync_lock.acquire()
-        for k in list(self.notes.keys()):
-            obj = self._get_note_status(k)
-            if not obj.saved:
-                all_saved = False
-                break
+        all_saved = not self.needs_save
         self.sync_lock.release()
         return all_saved
 
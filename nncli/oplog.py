@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""oplog module
+
+An append-only log of the changes made to the notes database, kept so
+that edits survive a crash between the time they are made and the time
+the changed notes are written to their files by the next sync. Each
+operation is one line of JSON, flushed and synced to disk when it is
+appended. A partly written last line, left behind by a crash, is
+ignored when the log is read back.
+"""
+import logging
+import os
+import threading
+
+from . import codec
+
+class OperationLog:
+    """
+    OperationLog class
+
+    The operation log at path. Operations are dicts with at least an
+    'op' and a 'key' entry.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.count = 0
+        self.file = None
+
+    def _open(self):
+        """Open the log for appending"""
+        if self.file is None:
+            self.file = open(self.path, 'ab')
+            if self.file.tell():
+                with open(self.path, 'rb') as log:
+                    log.seek(-1, os.SEEK_END)
+                    partial = log.read(1) != b'\n'
+                if partial:
+                    # end the line a crash cut short
+                    self.file.write(b'\n')
+
+    def replay(self):
+        """Return the operations in the log, oldest first"""
+        operations = []
+        try:
+            with open(self.path, 'rb') as log:
+                for number, line in enumerate(log, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        operation = codec.loads(line)
+                    except ValueError:
+                        operation = None
+                    if isinstance(operation, dict):
+                        operations.append(operation)
+                    else:
+                        logging.warning('Skipping bad line %d of %s',
+                                        number, self.path)
+        except FileNotFoundError:
+            pass
+        self.count = len(operations)
+        return operations
+
+    def append(self, operation):
+        """Append an operation, returning once it is on disk"""
+        data = codec.dumpb(operation) + b'\n'
+        with self.lock:
+            self._open()
+            self.file.write(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.count += 1
+
+    def compact(self, keep):
+        """
+        Drop the operations for which keep(operation) is false, once the
+        changes they record are on disk elsewhere
+        """
+        with self.lock:
+            if not self.count:
+                return
+            operations = [operation for operation in self.replay()
+                          if keep(operation)]
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as log:
+                for operation in operations:
+                    log.write(codec.dumpb(operation) + b'\n')
+                log.flush()
+                os.fsync(log.fileno())
+            os.replace(tmp_path, self.path)
+            self.count = len(operations)
+
+    def close(self):
+        """Close the log"""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
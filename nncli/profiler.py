@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""profiler module"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import time
+
+from . import stats
+
+# number of functions listed in each section of the report
+PROFILE_REPORT_FUNCTIONS = 30
+
+class Profiler:
+    """
+    Profiler class
+
+    Runs nncli under cProfile and writes the raw pstats data to nncli.prof
+    and a text report to nncli-profile.txt. Only the main thread is
+    profiled; syncs done by the GUI's background worker show up in the
+    per-phase sync breakdown of the report instead.
+    """
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.start_time = None
+
+    def start(self):
+        """Start profiling"""
+        # the sync phase timers are needed for the report
+        stats.enable()
+        self.start_time = time.perf_counter()
+        self.profile.enable()
+
+    def stop(self, directory):
+        """
+        Stop profiling and write the results to directory. Returns the
+        paths of the pstats file and the report.
+        """
+        self.profile.disable()
+        wall_time = time.perf_counter() - self.start_time
+
+        prof_path = os.path.join(directory, 'nncli.prof')
+        report_path = os.path.join(directory, 'nncli-profile.txt')
+        self.profile.dump_stats(prof_path)
+        with open(report_path, 'w', encoding='utf-8') as report:
+            for line in self.report_lines(wall_time):
+                report.write(line + '\n')
+        return prof_path, report_path
+
+    def report_lines(self, wall_time):
+        """Format the profile as a list of text lines"""
+        lines = [
+                'Command: {}'.format(' '.join(sys.argv)),
+                'Wall time: {:.3f}s'.format(wall_time),
+                ''
+        ]
+
+        snapshot = stats.STATS.snapshot()
+        sync_timers = {name: entry
+                       for name, entry in snapshot['timers'].items()
+                       if name.startswith('sync.')}
+        if sync_timers:
+            lines.append('Sync phases')
+            lines.extend(stats.report_lines({'timers': sync_timers}))
+            lines.append('')
+
+        for title, sort_key in (('cumulative time', 'cumulative'),
+                                ('own time', 'tottime')):
+            output = io.StringIO()
+            pstats.Stats(self.profile, stream=output) \
+                  .strip_dirs() \
+                  .sort_stats(sort_key) \
+                  .print_stats(PROFILE_REPORT_FUNCTIONS)
+            lines.append('Top functions by {}'.format(title))
+            lines.extend(output.getvalue().strip('\n').splitlines())
+            lines.append('')
+        return lines
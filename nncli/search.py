@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""search module"""
+import atexit
+import bisect
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+
+# re has no public parser, regex_trigrams uses the private one re itself
+# uses; it is only touched here and in _parse_regex, so a change to it in
+# a later Python breaks nothing else
+try:
+    from re import _parser as _sre_parse
+except ImportError:
+    import sre_parse as _sre_parse
+# pylint: disable=no-member
+_LITERAL = _sre_parse.LITERAL
+_AT = _sre_parse.AT
+_SUBPATTERN = _sre_parse.SUBPATTERN
+_REPEATS = (_sre_parse.MAX_REPEAT, _sre_parse.MIN_REPEAT)
+# pylint: enable=no-member
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# total size of note contents below which searching stays in-process
+PARALLEL_SEARCH_MIN_BYTES = 4 * 1024 * 1024
+
+# work is split into this many chunks per worker to even out the load
+PARALLEL_SEARCH_CHUNKS_PER_WORKER = 4
+
+# how workers are started: nncli has threads running (sync worker, log
+# listener, editor watchers) and forking a threaded process may deadlock
+_START_METHOD = 'forkserver' \
+        if 'forkserver' in multiprocessing.get_all_start_methods() \
+        else 'spawn'
+
+# characters whose case-insensitive matches don't survive casefold()
+_IGNORECASE_UNSAFE = re.compile('[iI\u0130\u0131]')
+
+# shared memory segment attached in a worker process, as (name, segment)
+_ATTACHED = [None, None]
+
+def _attach(name):
+    """Attach to a shared memory segment from a worker process"""
+    if _ATTACHED[0] != name:
+        if _ATTACHED[1] is not None:
+            _ATTACHED[1].close()
+        # workers share the parent's resource tracker, so attaching
+        # here does not hand ownership of the segment to this process
+        _ATTACHED[0] = name
+        _ATTACHED[1] = shared_memory.SharedMemory(name=name)
+    return _ATTACHED[1]
+
+def _scan_chunk(name, spans, pattern, flags):
+    """
+    Worker entry point. Returns the indexes of the spans of the shared
+    buffer whose text matches the regex.
+    """
+    shm = _attach(name)
+    regex = re.compile(pattern, flags)
+    matches = []
+    for index, start, end in spans:
+        if regex.search(bytes(shm.buf[start:end]).decode('utf-8')):
+            matches.append(index)
+    return matches
+
+class ParallelRegexSearch:
+    """
+    ParallelRegexSearch class
+
+    Runs a regex over note contents in a pool of worker processes. The
+    contents are packed once per database generation into a shared
+    memory buffer so workers read them in place instead of receiving
+    pickled copies.
+    """
+    def __init__(self, workers=None):
+        self.workers = workers if workers else (os.cpu_count() or 1)
+        self.pool = None
+        self.shm = None
+        self.generation = None
+        self.spans = {}
+        atexit.register(self.close)
+
+    def usable(self, notes):
+        """True if notes are worth searching in parallel"""
+        if shared_memory is None or self.workers < 2:
+            return False
+        size = 0
+        for note in notes.values():
+            size += len(note.get('content') or '')
+            if size >= PARALLEL_SEARCH_MIN_BYTES:
+                return True
+        return False
+
+    def _pack(self, notes, generation):
+        """Pack the note contents into a fresh shared memory buffer"""
+        encoded = [(key, (note.get('content') or '').encode('utf-8'))
+                   for key, note in notes.items()]
+        size = sum(len(data) for _, data in encoded)
+
+        self._release()
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=max(size, 1))
+        self.spans = {}
+        offset = 0
+        for key, data in encoded:
+            self.shm.buf[offset:offset + len(data)] = data
+            self.spans[key] = (offset, offset + len(data))
+            offset += len(data)
+        self.generation = generation
+
+    def search(self, sspat, notes, keys, generation):
+        """
+        Return the set of keys whose note content matches the compiled
+        regex sspat
+        """
+        if self.generation != generation or self.shm is None:
+            self._pack(notes, generation)
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(_START_METHOD))
+
+        matched = set()
+        spans = []
+        for index, key in enumerate(keys):
+            span = self.spans.get(key)
+            if span is None:
+                # note appeared since the buffer was packed
+                if sspat.search(notes[key].get('content') or ''):
+                    matched.add(key)
+            else:
+                spans.append((index, span[0], span[1]))
+
+        # split into chunks of roughly equal size in bytes
+        total = sum(end - start for _, start, end in spans)
+        chunk_size = total // (self.workers *
+                               PARALLEL_SEARCH_CHUNKS_PER_WORKER) + 1
+        chunks = [[]]
+        chunk_bytes = 0
+        for span in spans:
+            if chunk_bytes >= chunk_size:
+                chunks.append([])
+                chunk_bytes = 0
+            chunks[-1].append(span)
+            chunk_bytes += span[2] - span[1]
+
+        try:
+            futures = [self.pool.submit(_scan_chunk, self.shm.name, chunk,
+                                        sspat.pattern, sspat.flags)
+                       for chunk in chunks if chunk]
+            for future in futures:
+                for index in future.result():
+                    matched.add(keys[index])
+        except BrokenExecutor:
+            # a worker died, the next search starts a fresh pool
+            self.pool.shutdown(wait=False)
+            self.pool = None
+            raise
+        return matched
+
+    def _release(self):
+        """Free the shared memory buffer"""
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+            self.generation = None
+            self.spans = {}
+
+    def close(self):
+        """Shut down the workers and free the shared memory buffer"""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        self._release()
+
+def _trigrams(text):
+    """Return the set of trigrams of the casefolded text"""
+    text = text.casefold()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _required_literals(parsed, ignorecase, fragments):
+    """
+    Walk a parsed regex and append to fragments the literal strings that
+    every match must contain, as (string, ignorecase) tuples
+    """
+    current = []
+    for opcode, arg in parsed:
+        if opcode == _LITERAL:
+            current.append(chr(arg))
+            continue
+        if opcode == _AT:
+            # anchors don't consume characters
+            continue
+        if current:
+            fragments.append((''.join(current), ignorecase))
+            current = []
+        if opcode == _SUBPATTERN:
+            _, add_flags, del_flags, subpattern = arg
+            sub_ignorecase = ignorecase
+            if add_flags & re.IGNORECASE:
+                sub_ignorecase = True
+            if del_flags & re.IGNORECASE:
+                sub_ignorecase = False
+            _required_literals(subpattern, sub_ignorecase, fragments)
+        elif opcode in _REPEATS and arg[0] >= 1:
+            _required_literals(arg[2], ignorecase, fragments)
+    if current:
+        fragments.append((''.join(current), ignorecase))
+
+def _parse_regex(sspat):
+    """
+    Parse the compiled regex sspat, return the parsed pattern and
+    whether it ignores case
+    """
+    parsed = _sre_parse.parse(sspat.pattern, sspat.flags)
+    return parsed, bool(parsed.state.flags & re.IGNORECASE)
+
+def regex_trigrams(sspat):
+    """
+    Return the trigrams that any text matched by the compiled regex
+    sspat must contain, or None if nothing useful can be derived
+    """
+    try:
+        parsed, ignorecase = _parse_regex(sspat)
+    except (re.error, TypeError, ValueError):
+        return None
+    fragments = []
+    _required_literals(parsed, ignorecase, fragments)
+    grams = set()
+    for fragment, ignorecase in fragments:
+        pieces = _IGNORECASE_UNSAFE.split(fragment) \
+                if ignorecase else [fragment]
+        for piece in pieces:
+            grams |= _trigrams(piece)
+    return grams if grams else None
+
+class TrigramIndex:
+    """
+    TrigramIndex class
+
+    Maps each trigram of the casefolded note contents to the keys of the
+    notes containing it, to narrow down the notes a regex has to be run
+    against. The index is built on first use and then kept up to date by
+    NotesDB as notes change.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.built = False
+        self.postings = {}
+        self.note_grams = {}
+
+    def build(self, notes):
+        """Index all notes"""
+        with self.lock:
+            self.postings = {}
+            self.note_grams = {}
+            for key, note in notes.items():
+                self._add(key, note.get('content') or '')
+            self.built = True
+
+    def _add(self, key, content):
+        """Add a note to the index, the lock must be held"""
+        grams = _trigrams(content)
+        self.note_grams[key] = grams
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(key)
+
+    def _remove(self, key):
+        """Remove a note from the index, the lock must be held"""
+        for gram in self.note_grams.pop(key, ()):
+            keys = self.postings[gram]
+            keys.discard(key)
+            if not keys:
+                del self.postings[gram]
+
+    def update(self, key, content):
+        """Reindex a note after its content changed"""
+        if not self.built:
+            return
+        with self.lock:
+            self._remove(key)
+            self._add(key, content or '')
+
+    def remove(self, key):
+        """Drop a note from the index"""
+        if not self.built:
+            return
+        with self.lock:
+            self._remove(key)
+
+    def candidates(self, sspat):
+        """
+        Return the set of keys of the notes that may match the compiled
+        regex sspat, or None if every note may match
+        """
+        grams = regex_trigrams(sspat)
+        if not grams:
+            return None
+        with self.lock:
+            postings = sorted((self.postings.get(gram, set())
+                               for gram in grams), key=len)
+            result = set(postings[0])
+            for keys in postings[1:]:
+                if not result:
+                    break
+                result &= keys
+        return result
+
+class CategoryIndex:
+    """
+    CategoryIndex class
+
+    Maps each category to the keys of the notes filed under it, so
+    category searches and listings don't have to visit every note.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_category = {}
+        self.note_category = {}
+        self.folded = None
+
+    def build(self, notes):
+        """Index all notes"""
+        with self.lock:
+            self.by_category = {}
+            self.note_category = {}
+            self.folded = None
+            for key, note in notes.items():
+                self._add(key, note.get('category'))
+
+    def _add(self, key, category):
+        """Add a note to the index, the lock must be held"""
+        category = category if category else ''
+        self.note_category[key] = category
+        self.by_category.setdefault(category, set()).add(key)
+
+    def _remove(self, key):
+        """Remove a note from the index, the lock must be held"""
+        category = self.note_category.pop(key, None)
+        if category is None:
+            return
+        keys = self.by_category[category]
+        keys.discard(key)
+        if not keys:
+            del self.by_category[category]
+
+    def update(self, key, category):
+        """Reindex a note after its category changed"""
+        with self.lock:
+            if self.note_category.get(key) == (category if category else ''):
+                return
+            self._remove(key)
+            self._add(key, category)
+            self.folded = None
+
+    def remove(self, key):
+        """Drop a note from the index"""
+        with self.lock:
+            self._remove(key)
+            self.folded = None
+
+    def _get_folded(self):
+        """
+        Return the sorted (casefolded category, category) list used for
+        prefix lookups, the lock must be held
+        """
+        if self.folded is None:
+            self.folded = sorted((category.casefold(), category)
+                                 for category in self.by_category
+                                 if category)
+        return self.folded
+
+    def keys_with_prefix(self, prefix):
+        """
+        Return the set of keys of the notes whose category starts with
+        prefix, ignoring case
+        """
+        prefix = prefix.casefold()
+        keys = set()
+        with self.lock:
+            folded = self._get_folded()
+            start = bisect.bisect_left(folded, (prefix,))
+            for folded_category, category in folded[start:]:
+                if not folded_category.startswith(prefix):
+                    break
+                keys |= self.by_category[category]
+        return keys
+
+    def keys_matching(self, sspat):
+        """
+        Return the set of keys of the notes whose category matches the
+        compiled regex sspat
+        """
+        keys = set()
+        with self.lock:
+            for category, category_keys in self.by_category.items():
+                if category and sspat.search(category):
+                    keys |= category_keys
+        return keys
+
+    def categories(self):
+        """Return a sorted list of (category, number of notes) tuples"""
+        with self.lock:
+            return [(category, len(self.by_category[category]))
+                    for _, category in self._get_folded()]
+
+    def ranks(self):
+        """Map each category to its position in sorted order"""
+        with self.lock:
+            ranks = {'': -1}
+            for rank, (_, category) in enumerate(self._get_folded()):
+                ranks[category] = rank
+            return ranks
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""stats module
+
+Lightweight timers and counters for the hot paths. Recording is a no-op
+until enable() is called, so instrumented code costs one attribute
+lookup when stats are turned off.
+"""
+import collections
+import contextlib
+import os
+import threading
+import time
+
+from . import codec
+
+# number of recent samples kept per timer
+RECENT_SAMPLES = 100
+
+_NULL_TIMER = contextlib.nullcontext()
+
+class Stats:
+    """Stats class. Holds the timers and counters of this process."""
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.timers = {}
+        self.counters = collections.Counter()
+
+    def record(self, name, seconds):
+        """Record a duration for the timer name"""
+        with self.lock:
+            entry = self.timers.get(name)
+            if entry is None:
+                entry = self.timers[name] = {
+                        'count': 0,
+                        'total': 0.0,
+                        'max': 0.0,
+                        'recent': collections.deque(maxlen=RECENT_SAMPLES)
+                }
+            entry['count'] += 1
+            entry['total'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            entry['recent'].append(seconds)
+
+    def count(self, name, amount=1):
+        """Add amount to the counter name"""
+        with self.lock:
+            self.counters[name] += amount
+
+    def snapshot(self):
+        """Return a copy of the stats that can be stored as JSON"""
+        with self.lock:
+            return {
+                    'timers': {name: dict(entry, recent=list(entry['recent']))
+                               for name, entry in self.timers.items()},
+                    'counters': dict(self.counters)
+            }
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        with self.lock:
+            self.timers = {}
+            self.counters = collections.Counter()
+
+class _Timer:
+    """Context manager timing a block into a Stats timer"""
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STATS.record(self.name, time.perf_counter() - self.start)
+        return False
+
+STATS = Stats()
+
+def enable(enabled=True):
+    """Turn recording on or off"""
+    STATS.enabled = enabled
+
+def timer(name):
+    """Return a context manager timing a block as name"""
+    if not STATS.enabled:
+        return _NULL_TIMER
+    return _Timer(name)
+
+def count(name, amount=1):
+    """Add amount to the counter name"""
+    if STATS.enabled:
+        STATS.count(name, amount)
+
+def clock():
+    """Return a start time to pass to elapsed()"""
+    return time.perf_counter()
+
+def elapsed(name, start):
+    """Record the time since start, as returned by clock(), as name"""
+    if STATS.enabled:
+        STATS.record(name, time.perf_counter() - start)
+
+def merge(old, new):
+    """Merge two stats snapshots"""
+    merged = {'timers': dict(old.get('timers', {})),
+              'counters': dict(old.get('counters', {}))}
+    for name, entry in new['timers'].items():
+        prev = merged['timers'].get(name)
+        if prev is None:
+            merged['timers'][name] = entry
+            continue
+        merged['timers'][name] = {
+                'count': prev['count'] + entry['count'],
+                'total': prev['total'] + entry['total'],
+                'max': max(prev['max'], entry['max']),
+                'recent': (prev['recent'] + entry['recent'])[-RECENT_SAMPLES:]
+        }
+    for name, value in new['counters'].items():
+        merged['counters'][name] = merged['counters'].get(name, 0) + value
+    return merged
+
+def load(path):
+    """Load a stats snapshot, empty if there is none"""
+    try:
+        return codec.load_file(path)
+    except (IOError, ValueError):
+        return {'timers': {}, 'counters': {}}
+
+def save(path):
+    """Merge the stats of this process into the file at path"""
+    if not STATS.enabled:
+        return
+    snapshot = STATS.snapshot()
+    if not snapshot['timers'] and not snapshot['counters']:
+        return
+    merged = merge(load(path), snapshot)
+    tmp_path = path + '.tmp'
+    try:
+        codec.dump_file(merged, tmp_path)
+        os.replace(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+def _percentile(samples, fraction):
+    """Return the given percentile of a list of samples"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def _ms(seconds):
+    """Format seconds as milliseconds"""
+    return '{:.1f}ms'.format(seconds * 1000)
+
+def report_lines(snapshot):
+    """Format a stats snapshot as a list of text lines"""
+    lines = []
+    timers = snapshot.get('timers', {})
+    if timers:
+        lines.append('{:<28} {:>7} {:>10} {:>10} {:>10} {:>10}'.format(
+                'Timer', 'Count', 'Mean', 'p50', 'p95', 'Max'))
+        for name in sorted(timers):
+            entry = timers[name]
+            recent = entry['recent'] or [0.0]
+            lines.append('{:<28} {:>7} {:>10} {:>10} {:>10} {:>10}'.format(
+                    name,
+                    entry['count'],
+                    _ms(entry['total'] / max(entry['count'], 1)),
+                    _ms(_percentile(recent, 0.5)),
+                    _ms(_percentile(recent, 0.95)),
+                    _ms(entry['max'])))
+    counters = snapshot.get('counters', {})
+    if counters:
+        if lines:
+            lines.append('')
+        lines.append('{:<28} {:>7}'.format('Counter', 'Value'))
+        for name in sorted(counters):
+            lines.append('{:<28} {:>7}'.format(name, counters[name]))
+    if not lines:
+        lines.append('No stats recorded')
+    return lines
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 """temp module"""
-import json
 import os
 import tempfile
 
+from . import codec
+
 def tempfile_create(note, raw=False, tempdir=None):
     """create a temp file"""
     if raw:
@@ -11,8 +12,7 @@ def tempfile_create(note, raw=False, tempdir=None):
         tfile = tempfile.NamedTemporaryFile(suffix='.json',
                                             delete=False, dir=tempdir)
 
-        contents = json.dumps(note, indent=2)
-        tfile.write(contents.encode('utf-8'))
+        tfile.write(codec.dumpb(note, pretty=True))
         tfile.flush()
     else:
         ext = '.mkd'
@@ -5,10 +5,12 @@ import urwid
 # pylint: disable=too-many-arguments
 class UserInput(urwid.Edit):
     """UserInput class"""
-    def __init__(self, config, caption, edit_text, callback_func, args):
+    def __init__(self, config, caption, edit_text, callback_func, args,
+                 change_func=None):
         self.config = config
         self.callback_func = callback_func
         self.callback_func_args = args
+        self.change_func = change_func
         super(UserInput, self).__init__(caption=caption,
                                         edit_text=edit_text,
                                         wrap='clip')
@@ -20,5 +22,9 @@ class UserInput(urwid.Edit):
         elif key == 'enter':
             self.callback_func(self.callback_func_args, self.edit_text)
         else:
-            return super(UserInput, self).keypress(size, key)
+            old_text = self.edit_text
+            key = super(UserInput, self).keypress(size, key)
+            if self.change_func and self.edit_text != old_text:
+                self.change_func(self.callback_func_args, self.edit_text)
+            return key
         return None
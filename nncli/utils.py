@@ -8,6 +8,7 @@ import subprocess
 from subprocess import CalledProcessError
 
 from . import temp
+from .editor import EditSession
 
 # pylint: disable=too-many-arguments,too-few-public-methods
 def get_editor(config, logger):
@@ -26,22 +27,8 @@ def get_pager(config, logger):
         return None
     return pager
 
-def exec_cmd_on_note(note, config, gui, logger, cmd=None, raw=False):
-    """Execute an external command to operate on the note"""
-
-    if not cmd:
-        cmd = get_editor(config, logger)
-    if not cmd:
-        return None
-
-    tfile = temp.tempfile_create(
-            note if note else None,
-            raw=raw,
-            tempdir=config.get_config('tempdir')
-            )
-    fname = temp.tempfile_name(tfile)
-
-
+def _note_cmd_list(cmd, fname, config, gui):
+    """Build the argument list to run cmd on the temp file fname"""
     focus_position = 0
     if config.state.do_gui:
         try:
@@ -56,13 +43,29 @@ def exec_cmd_on_note(note, config, gui, logger, cmd=None, raw=False):
     # this makes it fully backwards compatible with previous configs
     if '{fname}' not in cmd:
         cmd_list.append(fname)
+    return cmd_list
+
+def exec_cmd_on_note(note, config, gui, logger, cmd=None, raw=False):
+    """Execute an external command to operate on the note"""
 
-    logger.log("EXECUTING: {}".format(cmd_list))
+    if not cmd:
+        cmd = get_editor(config, logger)
+    if not cmd:
+        return None
+
+    tfile = temp.tempfile_create(
+            note if note else None,
+            raw=raw,
+            tempdir=config.get_config('tempdir')
+            )
+    cmd_list = _note_cmd_list(cmd, temp.tempfile_name(tfile), config, gui)
+
+    logger.log("EXECUTING: %s", cmd_list)
 
     try:
         subprocess.check_call(cmd_list)
     except CalledProcessError as ex:
-        logger.log('Command error: %s' % ex)
+        logger.log('Command error: %s', ex)
         temp.tempfile_delete(tfile)
         return None
 
@@ -80,6 +83,47 @@ def exec_cmd_on_note(note, config, gui, logger, cmd=None, raw=False):
 
     return content
 
+def edit_note_session(ndb, key, config, gui, logger,
+                      on_change=None, on_exit=None):
+    """
+    Edit an existing note in the external editor, saving every write of
+    the temp file back to the note as it happens
+
+    With cfg_editor_terminal set the editor is started in its own
+    terminal and this returns right away; on_exit(session) is called
+    from another thread once the editor has exited. Otherwise the editor
+    runs in this terminal and this returns once it has exited. Returns
+    the EditSession, or None if the editor couldn't be started.
+    """
+    cmd = get_editor(config, logger)
+    if not cmd:
+        return None
+
+    tfile = temp.tempfile_create(ndb.get_note(key),
+                                 tempdir=config.get_config('tempdir'))
+    cmd_list = _note_cmd_list(cmd, temp.tempfile_name(tfile), config, gui)
+    session = EditSession(ndb, key, tfile, on_change)
+
+    terminal = config.get_config('editor_terminal')
+    if terminal:
+        cmd_list = shlex.split(terminal) + cmd_list
+    logger.log("EXECUTING: %s", cmd_list)
+
+    try:
+        if terminal:
+            session.start(cmd_list, on_exit)
+        else:
+            session.run(cmd_list)
+    except OSError as ex:
+        logger.log('Command error: %s', ex)
+        return None
+
+    if config.state.do_gui and not terminal:
+        gui.nncli_loop.screen.clear()
+        gui.nncli_loop.draw_screen()
+
+    return session
+
 def generate_random_key():
     """Generate random 30 digit (15 byte) hex string.
 
@@ -95,6 +139,13 @@ def get_note_category(note):
         category = ''
     return category
 
+def get_note_account(note):
+    """get the name of the extra account a note belongs to, if any"""
+    localkey = note.get('localkey')
+    if isinstance(localkey, str) and ':' in localkey:
+        return localkey.split(':', 1)[0]
+    return ''
+
 def get_note_flags(note):
     """
     get the note flags
@@ -132,13 +183,19 @@ def sort_by_title_favorite(left):
     """sort notes by title, favorites on top"""
     return (not note_favorite(left.note), get_note_title(left.note))
 
-def sort_notes_by_categories(notes, favorite_ontop=False):
+def sort_notes_by_categories(notes, favorite_ontop=False, ranks=None):
     """
     sort notes by category, optionally pushing favorites to the
     top
+
+    ranks optionally maps each category to its precomputed sort position
     """
+    def category_key(note):
+        category = get_note_category(note)
+        return category if ranks is None else ranks.get(category, -1)
+
     notes.sort(key=lambda i: (favorite_ontop and not note_favorite(i.note),
-                              i.note.get('category'),
+                              category_key(i.note),
                               get_note_title(i.note)))
 
 def sort_by_modify_date_favorite(left):
@@ -1,32 +1,66 @@
 # -*- coding: utf-8 -*-
 """view_log module"""
+import os
+
 import urwid
 
+from .walker import LazyListWalker
+
 class ViewLog(urwid.ListBox):
     """
     ViewLog class
 
-    This class defines the urwid view class for the log viewer
+    This class defines the urwid view class for the log viewer. The log
+    file is tailed: each update only reads what was appended since the
+    last one, and widgets are only built for the lines on screen.
     """
     def __init__(self, config, logger):
         self.config = config
-        self.logger = logger
-        super(ViewLog, self).__init__(urwid.SimpleFocusListWalker([]))
+        # urwid widgets have a logger attribute of their own
+        self.logfile = logger.logfile
+        self.lines = []
+        self.offset = 0
+        self.file_id = None
+        # trailing bytes of a line that is still being written
+        self.partial = b''
+        super(ViewLog, self).__init__(
+                LazyListWalker(0, self.get_log_line_at))
+
+    def _read_appended(self):
+        """Read the lines appended to the log file since the last read"""
+        try:
+            logfile = open(self.logfile, 'rb')
+        except FileNotFoundError:
+            return
+        with logfile:
+            stat = os.fstat(logfile.fileno())
+            file_id = (stat.st_dev, stat.st_ino)
+            if file_id != self.file_id or stat.st_size < self.offset:
+                # the log was rotated, start over with the new file
+                self.lines = []
+                self.offset = 0
+                self.partial = b''
+                self.file_id = file_id
+            logfile.seek(self.offset)
+            data = logfile.read()
+        self.offset += len(data)
+        new_lines = (self.partial + data).split(b'\n')
+        self.partial = new_lines.pop()
+        self.lines.extend(line.decode('utf-8', 'replace').rstrip()
+                          for line in new_lines)
+
+    def get_log_line_at(self, position):
+        """Build the widget for the log line at position"""
+        if self.config.get_config('log_reversed') == 'yes':
+            position = len(self.lines) - 1 - position
+        return urwid.AttrMap(urwid.Text(self.lines[position]),
+                             'note_content',
+                             'note_content_focus')
 
     def update_log(self):
         """update the log"""
-        lines = []
-        with open(self.logger.logfile) as logfile:
-            for line in logfile:
-                lines.append(
-                        urwid.AttrMap(urwid.Text(line.rstrip()),
-                                      'note_content',
-                                      'note_content_focus')
-                        )
-        if self.config.get_config('log_reversed') == 'yes':
-            lines.reverse()
-        self.body[:] = urwid.SimpleFocusListWalker(lines)
-        self.focus_position = 0
+        self._read_appended()
+        self.body.reset(len(self.lines))
 
     def get_status_bar(self):
         """get the log view status bar"""
@@ -4,6 +4,17 @@ import time
 import urwid
 from . import utils
 from .clipboard import Clipboard
+from .walker import LazyListWalker
+
+def line_offsets(content):
+    """Return the offsets at which the lines of content start"""
+    offsets = [0]
+    find = content.find
+    offset = find('\n')
+    while offset != -1:
+        offsets.append(offset + 1)
+        offset = find('\n', offset + 1)
+    return offsets
 
 # pylint: disable=too-many-instance-attributes
 class ViewNote(urwid.ListBox):
@@ -11,7 +22,9 @@ class ViewNote(urwid.ListBox):
     ViewNote class
 
     This class defines the urwid class responsible for displaying an
-    individual note in an internal pager
+    individual note in an internal pager. The note is not split up
+    front: an index of where each line starts is kept, and widgets are
+    only built for the lines on screen.
     """
     def __init__(self, config, args):
         self.config = config
@@ -25,30 +38,54 @@ class ViewNote(urwid.ListBox):
         self.old_note = None
         self.tabstop = int(self.config.get_config('tabstop'))
         self.clipboard = Clipboard()
+        self.content = None
+        self.offsets = []
         super(ViewNote, self).__init__(
-                urwid.SimpleFocusListWalker(self.get_note_content_as_list()))
+                LazyListWalker(0, self.get_note_line_at))
+        self._index_content()
 
-    def get_note_content_as_list(self):
-        """return the contents of a note as a list of strings"""
-        lines = []
+    def _shown_content(self):
+        """Return the content being shown, None if there is no note"""
         if not self.key:
-            return lines
+            return None
         if self.old_note:
-            for line in self.old_note['content'].split('\n'):
-                lines.append(
-                        urwid.AttrMap(urwid.Text(
-                                line.replace('\t', ' ' * self.tabstop)),
-                                      'note_content_old',
-                                      'note_content_old_focus'))
-        else:
-            for line in self.note['content'].split('\n'):
-                lines.append(
-                        urwid.AttrMap(urwid.Text(
-                                line.replace('\t', ' ' * self.tabstop)),
-                                      'note_content',
-                                      'note_content_focus'))
-        lines.append(urwid.AttrMap(urwid.Divider('-'), 'default'))
-        return lines
+            return self.old_note['content']
+        return self.note['content']
+
+    def _index_content(self):
+        """
+        Index the lines of the content being shown, return False if it
+        hasn't changed since it was last indexed
+        """
+        content = self._shown_content()
+        if content is self.content or (content is not None and
+                                       content == self.content):
+            return False
+        self.content = content
+        self.offsets = line_offsets(content) if content is not None else []
+        # one more position for the divider closing the note
+        length = len(self.offsets) + 1 if self.offsets else 0
+        focus = min(self.body.focus, length - 1) if length else 0
+        self.body.reset(length, focus)
+        return True
+
+    def get_line(self, line):
+        """Return the text of the line at position line"""
+        start = self.offsets[line]
+        if line + 1 < len(self.offsets):
+            return self.content[start:self.offsets[line + 1] - 1]
+        return self.content[start:]
+
+    def get_note_line_at(self, position):
+        """Build the widget for the line at position"""
+        if position == len(self.offsets):
+            return urwid.AttrMap(urwid.Divider('-'), 'default')
+        text = urwid.Text(
+                self.get_line(position).replace('\t', ' ' * self.tabstop))
+        if self.old_note:
+            return urwid.AttrMap(text, 'note_content_old',
+                                 'note_content_old_focus')
+        return urwid.AttrMap(text, 'note_content', 'note_content_focus')
 
     def update_note_view(self, key=None):
         """update the view"""
@@ -56,29 +93,25 @@ class ViewNote(urwid.ListBox):
             self.key = key
             self.note = self.ndb.get_note(self.key)
             self.old_note = None
+            # a note with the same content still starts at the top
+            self.content = None
 
-        self.body[:] = \
-            urwid.SimpleFocusListWalker(self.get_note_content_as_list())
-        if not self.search_string:
+        if self._index_content() and not self.search_string:
             self.focus_position = 0
 
     def lines_after_current_position(self):
         """
-        return the number of lines after the currently-focused
+        return the positions of the lines after the currently-focused
         line
         """
-        lines_after_current_position = \
-                list(range(self.focus_position + 1,
-                           len(self.body.positions()) - 1))
-        return lines_after_current_position
+        return range(self.focus_position + 1, len(self.offsets))
 
     def lines_before_current_position(self):
         """
-        return the number of lines before the currently-focused line
+        return the positions of the lines before the currently-focused
+        line, closest first
         """
-        lines_before_current_position = list(range(0, self.focus_position))
-        lines_before_current_position.reverse()
-        return lines_before_current_position
+        return range(self.focus_position - 1, -1, -1)
 
     def search_note_view_next(self, search_string=None, search_mode=None):
         """move to the next match in search mode"""
@@ -104,19 +137,25 @@ class ViewNote(urwid.ListBox):
 
     def search_note_range(self, note_range):
         """search within a range of lines"""
+        if not self.offsets:
+            return
+        is_match = self.build_matcher(self.search_string)
+        if not is_match:
+            return
         for line in note_range:
-            line_content = self.note['content'].split('\n')[line]
-            if self.is_match(self.search_string, line_content):
+            if is_match(self.get_line(line)):
                 self.focus_position = line
                 break
-        self.update_note_view()
 
-    def is_match(self, term, full_text):
-        """returns True if there is a match, False otherwise"""
+    def build_matcher(self, term):
+        """
+        returns a function telling if a text matches term in the current
+        search mode, None if term is not a valid regex
+        """
         if self.search_mode == 'gstyle':
-            return term in full_text
+            return lambda text: term in text
         sspat = utils.build_regex_search(term)
-        return sspat and sspat.search(full_text)
+        return sspat.search if sspat else None
 
     def get_status_bar(self):
         """get the note view status bar"""
@@ -175,24 +214,21 @@ class ViewNote(urwid.ListBox):
 
     def copy_note_text(self):
         """copy the text of the note to the system clipboard"""
-        line_content = self.note['content'].split('\n')[self.focus_position]
-        self.clipboard.copy(line_content)
+        if self.focus_position < len(self.offsets):
+            self.clipboard.copy(self.get_line(self.focus_position))
 
     def keypress(self, size, key):
         if key == self.config.get_keybind('tabstop2'):
             self.tabstop = 2
-            self.body[:] = \
-                urwid.SimpleFocusListWalker(self.get_note_content_as_list())
+            self.body.reset(len(self.body), self.body.focus)
 
         elif key == self.config.get_keybind('tabstop4'):
             self.tabstop = 4
-            self.body[:] = \
-                urwid.SimpleFocusListWalker(self.get_note_content_as_list())
+            self.body.reset(len(self.body), self.body.focus)
 
         elif key == self.config.get_keybind('tabstop8'):
             self.tabstop = 8
-            self.body[:] = \
-                urwid.SimpleFocusListWalker(self.get_note_content_as_list())
+            self.body.reset(len(self.body), self.body.focus)
 
         else:
             return key
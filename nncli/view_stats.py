@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""view_stats module"""
+import urwid
+
+from . import stats
+
+class ViewStats(urwid.ListBox):
+    """
+    ViewStats class
+
+    This class defines the urwid view class for the timing and counter
+    stats of the running session
+    """
+    def __init__(self, config, ndb):
+        self.config = config
+        self.ndb = ndb
+        super(ViewStats, self).__init__(urwid.SimpleFocusListWalker([]))
+
+    def update_stats(self):
+        """update the stats"""
+        lines = []
+        if not stats.STATS.enabled:
+            lines.append('Stats are disabled (cfg_stats)')
+        else:
+            lines.extend(stats.report_lines(stats.STATS.snapshot()))
+        self.body[:] = urwid.SimpleFocusListWalker(
+                [urwid.AttrMap(urwid.Text(line, wrap='clip'),
+                               'note_content',
+                               'note_content_focus') for line in lines])
+        self.focus_position = 0
+
+    def get_status_bar(self):
+        """get the stats view status bar"""
+        status_title = \
+            urwid.AttrMap(urwid.Text('Stats ({0} notes, {1})'.format(
+                    len(self.ndb.notes), self.ndb.note.status),
+                                     wrap='clip'),
+                          'status_bar')
+        return urwid.AttrMap(urwid.Columns([status_title]), 'status_bar')
+
+    def keypress(self, size, key):
+        return key
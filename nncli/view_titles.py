@@ -4,7 +4,8 @@ import re
 import time
 import datetime
 import urwid
-from . import utils
+from . import stats, utils
+from .walker import LazyListWalker
 
 # pylint: disable=too-many-instance-attributes, too-many-statements
 class ViewTitles(urwid.ListBox):
@@ -17,6 +18,7 @@ class ViewTitles(urwid.ListBox):
         self.config = config
         self.ndb = args['ndb']
         self.search_string = args['search_string']
+        self.search_mode = 'gstyle'
         self.log = args['log']
         self.note_list, self.match_regex, self.all_notes_cnt = \
             self.ndb.filter_notes(
@@ -24,28 +26,26 @@ class ViewTitles(urwid.ListBox):
                     sort_mode=self.config.get_config('sort_mode')
                     )
         super(ViewTitles, self).__init__(
-                urwid.SimpleFocusListWalker(self.get_note_titles()))
+                LazyListWalker(len(self.note_list), self.get_note_title_at))
 
     def update_note_list(self, search_string,
-                         search_mode='gstyle', sort_mode='date'):
+                         search_mode='gstyle', sort_mode='date',
+                         log_empty=True):
         """update the note list"""
         self.search_string = search_string
+        self.search_mode = search_mode
         self.note_list, self.match_regex, self.all_notes_cnt = \
             self.ndb.filter_notes(
                     self.search_string, search_mode, sort_mode=sort_mode
                     )
-        self.body[:] = \
-            urwid.SimpleFocusListWalker(self.get_note_titles())
-        if not self.note_list:
+        self.body.reset(len(self.note_list))
+        if not self.note_list and log_empty:
             self.log('No notes found!')
-        else:
-            self.focus_position = 0
 
     def sort_note_list(self, sort_mode):
         """sort the note list"""
         self.ndb.filtered_notes_sort(self.note_list, sort_mode)
-        self.body[:] = \
-            urwid.SimpleFocusListWalker(self.get_note_titles())
+        self.body.reset(len(self.note_list))
 
     def format_title(self, note):
         """
@@ -58,6 +58,7 @@ class ViewTitles(urwid.ListBox):
         %T -- category
         %D -- date
         %N -- note title
+        %A -- account, for notes of extra accounts
         """
 
         localtime = time.localtime(float(note['modified']))
@@ -67,6 +68,7 @@ class ViewTitles(urwid.ListBox):
         title = utils.get_note_title(note)
         flags = utils.get_note_flags(note)
         category = utils.get_note_category(note)
+        account = utils.get_note_account(note)
 
         # get the age of the note
         dtime = datetime.datetime.fromtimestamp(time.mktime(localtime))
@@ -84,7 +86,7 @@ class ViewTitles(urwid.ListBox):
         def recursive_format(title_format):
             if not title_format:
                 return None
-            fmt = re.search(r'^(.*)%([-]*)([0-9]*)([FDTN])(.*)$', title_format)
+            fmt = re.search(r'^(.*)%([-]*)([0-9]*)([FDTNA])(.*)$', title_format)
             if not fmt:
                 attr_map = ('pack', urwid.AttrMap(urwid.Text(title_format),
                                                   'default'))
@@ -111,6 +113,11 @@ class ViewTitles(urwid.ListBox):
                                                                 align=align,
                                                                 wrap='clip'),
                                                      'note_category'))
+                elif fmt.group(4) == 'A':
+                    attr_map = (width, urwid.AttrMap(urwid.Text(account,
+                                                                align=align,
+                                                                wrap='clip'),
+                                                     'note_category'))
                 elif fmt.group(4) == 'N':
                     if   note_age == 'd':
                         attr = 'note_title_day'
@@ -166,12 +173,10 @@ class ViewTitles(urwid.ListBox):
                               'note_flags'         : 'note_focus',
                               'note_categories'    : 'note_focus'})
 
-    def get_note_titles(self):
-        """get the titles of all of the notes"""
-        lines = []
-        for note in self.note_list:
-            lines.append(self.get_note_title(note.note))
-        return lines
+    def get_note_title_at(self, position):
+        """get the title of the note at a position in the list"""
+        with stats.timer('titles.row'):
+            return self.get_note_title(self.note_list[position].note)
 
     def get_status_bar(self):
         """get the status bar"""
@@ -206,12 +211,11 @@ class ViewTitles(urwid.ListBox):
     def update_note_title(self, key=None):
         """update a note title"""
         if not key:
-            self.body[self.focus_position] = \
-                self.get_note_title(self.note_list[self.focus_position].note)
+            self.body.refresh(self.focus_position)
         else:
             for i in range(len(self.note_list)):
                 if self.note_list[i].note['localkey'] == key:
-                    self.body[i] = self.get_note_title(self.note_list[i].note)
+                    self.body.refresh(i)
 
     def focus_note(self, key):
         """set the focus on a given note"""
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""walker module"""
+import urwid
+
+# number of widgets kept around before the cache is flushed
+WIDGET_CACHE_SIZE = 1024
+
+class LazyListWalker(urwid.ListWalker):
+    """
+    LazyListWalker class
+
+    A list walker that only builds the widget for a position when the
+    ListBox asks for it, which in practice means the rows on screen. The
+    widgets are built by calling make_widget(position).
+    """
+    def __init__(self, length, make_widget):
+        self.length = length
+        self.make_widget = make_widget
+        self.widgets = {}
+        self.focus = 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.length:
+            raise IndexError(position)
+        widget = self.widgets.get(position)
+        if widget is None:
+            if len(self.widgets) >= WIDGET_CACHE_SIZE:
+                self.widgets = {}
+            widget = self.make_widget(position)
+            self.widgets[position] = widget
+        return widget
+
+    def next_position(self, position):
+        """return the position after position"""
+        if position + 1 >= self.length:
+            raise IndexError(position)
+        return position + 1
+
+    def prev_position(self, position):
+        """return the position before position"""
+        if position <= 0:
+            raise IndexError(position)
+        return position - 1
+
+    def set_focus(self, position):
+        """set the focus position"""
+        self.focus = position
+        self._modified()
+
+    def positions(self, reverse=False):
+        """return all of the positions"""
+        if reverse:
+            return range(self.length - 1, -1, -1)
+        return range(self.length)
+
+    def reset(self, length, focus=0):
+        """replace the contents with length fresh positions"""
+        self.length = length
+        self.widgets = {}
+        self.focus = focus
+        self._modified()
+
+    def refresh(self, position):
+        """rebuild the widget at position the next time it is needed"""
+        self.widgets.pop(position, None)
+        self._modified()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""tests for accounts module"""
+import collections
+import os
+
+import pytest
+
+from nncli.accounts import AccountConfig, open_accounts
+from nncli.notes_db import NotesDB
+
+class FakeServer:
+    """a NextCloud Notes server keeping its notes in memory"""
+    def __init__(self):
+        self.notes = {}
+        self.http = collections.Counter()
+        self.status = 'online'
+
+    def update_note(self, note):
+        note = dict(note)
+        if 'id' not in note:
+            note['id'] = len(self.notes) + 1
+        self.notes[note['id']] = dict(self.notes.get(note['id'], {}),
+                                      **note)
+        return dict(self.notes[note['id']]), 0
+
+    def iter_note_chunks(self, prune_before=None):
+        yield [{'id': key, 'modified': note['modified'], 'category': ''}
+               for key, note in self.notes.items()], True
+
+    def get_note(self, note_id):
+        return dict(self.notes[note_id]), 0
+
+@pytest.fixture
+def config(mocker, tmp_path):
+    """a config declaring one extra account"""
+    configs = {'db_path': str(tmp_path / 'main'),
+               'nn_username': 'user',
+               'nn_password': 'password',
+               'nn_host': 'main.example.org',
+               'favorite_ontop': 'yes',
+               'search_categories': 'yes',
+               'stats': 'no',
+               'metrics_file': None}
+    config = mocker.Mock()
+    config.get_config.side_effect = lambda name: configs[name]
+    config.accounts = {'work': {'nn_username': 'worker',
+                                'nn_password': 'secret',
+                                'nn_host': 'work.example.org',
+                                'db_path': str(tmp_path / 'work'),
+                                'metrics_file': None}}
+    return config
+
+def open_db(config, mocker):
+    """the merged database of all accounts in config"""
+    return open_accounts(NotesDB(config, mocker.Mock(), mocker.Mock()),
+                         config, mocker.Mock())
+
+def test_no_accounts(config, mocker):
+    """test that a single account gets a plain NotesDB"""
+    config.accounts = {}
+    assert isinstance(open_db(config, mocker), NotesDB)
+
+def test_account_config(config):
+    """test that account settings override the main config"""
+    account_config = AccountConfig(config, 'work')
+    assert account_config.get_config('nn_host') == 'work.example.org'
+    assert account_config.get_config('stats') == 'no'
+    assert account_config.state is config.state
+
+def test_sync_and_merge(config, mocker):
+    """test that accounts sync to their own server and list as one"""
+    ndb = open_db(config, mocker)
+    servers = {name: FakeServer() for name in ndb.dbs}
+    for name, account_db in ndb.dbs.items():
+        account_db.note = servers[name]
+
+    ndb.create_note('main note')
+    ndb.dbs['work'].create_note('work note')
+    ndb.sync_now()
+
+    # both servers handed out ID 1, the keys still differ
+    assert sorted(ndb.notes, key=str) == [1, 'work:1']
+    assert servers['work'].notes[1]['content'] == 'work note'
+    assert os.path.exists(os.path.join(config.accounts['work']['db_path'],
+                                       '1.json'))
+
+    notes, _, total = ndb.filter_notes('note')
+    assert total == 2
+    assert {n.key for n in notes} == {1, 'work:1'}
+
+    # pretend the sync happened a while ago
+    for note in ndb.notes.values():
+        note['syncdate'] -= 10
+    ndb.set_note_content('work:1', 'changed work note')
+    ndb.sync_now()
+    assert servers['work'].notes[1]['content'] == 'changed work note'
+    assert servers[''].notes[1]['content'] == 'main note'
+    assert ndb.note.status == 'online'
+
+    # the keys of the extra account survive a reload from disk
+    reloaded = open_db(config, mocker)
+    assert reloaded.get_note('work:1')['content'] == 'changed work note'
+    assert reloaded.get_note(1)['content'] == 'main note'
+
+def test_log_marks_account(config, mocker):
+    """test that messages of extra accounts name the account"""
+    ndb = open_db(config, mocker)
+    log = mocker.Mock()
+    ndb.log = log
+    ndb.dbs['work'].log('hello')
+    ndb.main.log('hi')
+    assert [c[0][0] for c in log.call_args_list] == ['[work] hello', 'hi']
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""tests for cli module"""
+import click
+import pytest
+
+from nncli.cli import NOTE_KEY
+
+def test_note_key():
+    """test the note keys accepted on the command line"""
+    assert NOTE_KEY.convert('12', None, None) == 12
+    assert NOTE_KEY.convert(12, None, None) == 12
+    assert NOTE_KEY.convert('work:12', None, None) == 'work:12'
+
+@pytest.mark.parametrize('value', ['', 'x', '²', '١٢', 'work:', 'work:²',
+                                   ':12'])
+def test_note_key_invalid(value):
+    """test that anything else is a usage error"""
+    with pytest.raises(click.BadParameter):
+        NOTE_KEY.convert(value, None, None)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""tests for codec module"""
+import json
+import timeit
+
+import pytest
+
+import nncli.codec
+
+def make_notes(count=200):
+    """build a list of notes shaped like the ones in the local db"""
+    return [{'id': i,
+             'localkey': i,
+             'title': 'note {}'.format(i),
+             'content': 'note {}\n\nsome text, ümlauts and "quotes"\n'
+                        .format(i) * 20,
+             'category': 'cat{}'.format(i % 7),
+             'modified': 1550000000 + i,
+             'savedate': 0,
+             'syncdate': 0,
+             'favorite': bool(i % 2),
+             'deleted': False} for i in range(count)]
+
+@pytest.fixture(params=['json', 'backend'])
+def backend(request, monkeypatch):
+    """run a test against the stdlib fallback and the selected backend"""
+    if request.param == 'json':
+        monkeypatch.setattr(nncli.codec, 'BACKEND', 'json')
+    return nncli.codec.BACKEND
+
+def test_roundtrip(backend):
+    """test that encoding and decoding is lossless"""
+    notes = make_notes(10)
+    assert nncli.codec.loads(nncli.codec.dumps(notes)) == notes
+    assert nncli.codec.loads(nncli.codec.dumpb(notes)) == notes
+    assert nncli.codec.loads(nncli.codec.dumps(notes, pretty=True)) == notes
+
+def test_compact(backend):
+    """test that the default encoding carries no whitespace padding"""
+    note = make_notes(1)[0]
+    encoded = nncli.codec.dumps(note)
+    assert '\n' not in encoded
+    assert ': ' not in encoded.replace(note['content'], '')
+    assert len(encoded) < len(json.dumps(note, indent=2))
+    notes = make_notes()
+    assert len(nncli.codec.dumpb(notes)) < \
+            len(json.dumps(notes, indent=2).encode('utf-8'))
+
+def test_pretty(backend):
+    """test that pretty output is indented for humans"""
+    encoded = nncli.codec.dumps({'content': 'x'}, pretty=True)
+    assert encoded.startswith('{\n  "content"')
+
+def test_loads_error(backend):
+    """test that malformed input raises ValueError"""
+    with pytest.raises(ValueError):
+        nncli.codec.loads('{"content": ')
+
+def test_file_roundtrip(backend, tmp_path):
+    """test the file helpers used by the notes database"""
+    note = make_notes(1)[0]
+    path = str(tmp_path / 'note.json')
+    nncli.codec.dump_file(note, path)
+    assert nncli.codec.load_file(path) == note
+
+@pytest.mark.benchmark
+def test_benchmark_encode():
+    """test that the on-disk encoding beats the old indented one"""
+    notes = make_notes()
+    old = min(timeit.repeat(lambda: json.dumps(notes, indent=2),
+                            number=5, repeat=5))
+    new = min(timeit.repeat(lambda: nncli.codec.dumpb(notes),
+                            number=5, repeat=5))
+    assert new < old
+
+@pytest.mark.benchmark
+def test_benchmark_decode():
+    """test that decoding the compact encoding is not slower"""
+    notes = make_notes()
+    old_data = json.dumps(notes, indent=2)
+    new_data = nncli.codec.dumpb(notes)
+    old = min(timeit.repeat(lambda: json.loads(old_data),
+                            number=5, repeat=5))
+    new = min(timeit.repeat(lambda: nncli.codec.loads(new_data),
+                            number=5, repeat=5))
+    assert new < old * 1.5
+
+def test_iter_array():
+    """test that arrays are decoded whatever the chunk boundaries"""
+    values = [12, -3.5e3, 1.5, 1.5e10, -0.25E-2, 7, 'x', True, None, [],
+              {'a': [1.25, 'ü']}, 100]
+    data = nncli.codec.dumpb(values, pretty=True)
+    for split in range(len(data) + 1):
+        assert list(nncli.codec.iter_array([data[:split],
+                                            data[split:]])) == values
+    notes = make_notes(10)
+    data = nncli.codec.dumpb(notes)
+    chunks = [data[i:i + 7] for i in range(0, len(data), 7)]
+    assert list(nncli.codec.iter_array(chunks)) == notes
+    assert list(nncli.codec.iter_array([b'[1.', b'5]'])) == [1.5]
+    assert list(nncli.codec.iter_array([b'[1.5e', b'10]'])) == [1.5e10]
+    assert list(nncli.codec.iter_array([b' [ ] '])) == []
+
+@pytest.mark.parametrize('data', [b'', b'{}', b'[1', b'[1 2]', b'[1,',
+                                  b'[{"a": 1]', b'[1.5x]'])
+def test_iter_array_malformed(data):
+    """test that malformed arrays raise ValueError"""
+    with pytest.raises(ValueError):
+        list(nncli.codec.iter_array([data]))
@@ -104,3 +104,68 @@ def test_get_color_descr(mocker):
     mock_cfg = mock_config_file(mocker, [])
     config = Config('test_cfg')
     assert config.get_color_descr('default_fg') == 'Default fg'
+
+def test_password_eval_cached(mocker):
+    """test that a cached password skips the password command"""
+    mock_config_file(mocker,
+            [
+                    '[nncli]',
+                    'cfg_nn_username=user',
+                    'cfg_nn_password_eval=password_cmd',
+                    'cfg_nn_password_cache_ttl=600',
+                    'cfg_nn_host=nextcloud.example.org'
+            ])
+    mocker.patch('subprocess.check_output',
+                 new=mocker.Mock(return_value='yes\n'))
+    mocker.patch('nncli.credcache.get', return_value='cached')
+    mocker.patch('nncli.credcache.put')
+
+    config = Config()
+
+    subprocess.check_output.assert_not_called()
+    assert config.get_config('nn_password') == 'cached'
+
+def test_password_eval_cache_miss(mocker):
+    """test that the password is cached after running the command"""
+    mock_config_file(mocker,
+            [
+                    '[nncli]',
+                    'cfg_nn_username=user',
+                    'cfg_nn_password_eval=password_cmd',
+                    'cfg_nn_password_cache_ttl=600',
+                    'cfg_nn_host=nextcloud.example.org'
+            ])
+    mocker.patch('subprocess.check_output',
+                 new=mocker.Mock(return_value='yes\n'))
+    mocker.patch('nncli.credcache.get', return_value=None)
+    put = mocker.patch('nncli.credcache.put')
+
+    config = Config()
+
+    subprocess.check_output.assert_called_once()
+    assert config.get_config('nn_password') == 'yes'
+    assert put.call_args[0][2:] == ('yes', 600)
+
+def test_accounts(mocker):
+    """test reading extra accounts"""
+    mock_config_file(mocker,
+            [
+                    '[nncli]',
+                    'cfg_nn_username=user',
+                    'cfg_nn_password=password',
+                    'cfg_nn_host=nextcloud.example.org',
+                    'cfg_db_path=/notes',
+                    '[account work]',
+                    'cfg_nn_username=worker',
+                    'cfg_nn_password=secret',
+                    'cfg_nn_host=work.example.org'
+            ])
+
+    config = Config()
+
+    assert list(config.accounts) == ['work']
+    assert config.accounts['work']['nn_host'] == 'work.example.org'
+    assert config.accounts['work']['nn_password'] == 'secret'
+    assert config.accounts['work']['db_path'] == os.path.join('/notes',
+                                                              'work')
+    assert config.get_config('nn_host') == 'nextcloud.example.org'
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""tests for credcache module"""
+import threading
+import time
+
+import pytest
+
+from nncli import credcache
+
+@pytest.fixture
+def agent(tmp_path, mocker):
+    """an agent serving from a thread"""
+    mocker.patch('nncli.credcache.AGENT_IDLE_TIMEOUT', 0.5)
+    agent = credcache.CredentialAgent(str(tmp_path / 'agent.sock'))
+    thread = threading.Thread(target=agent.serve, daemon=True)
+    thread.start()
+    yield agent
+    thread.join(5)
+
+def test_put_get(agent, mocker):
+    """test that a stored secret is returned until it expires"""
+    start = mocker.patch('nncli.credcache._start_agent')
+    key = credcache.secret_key('pass nextcloud', 'user', 'host')
+    assert credcache.get(agent.path, key) is None
+    assert credcache.put(agent.path, key, 'sec ret\n', 0.2)
+    assert credcache.get(agent.path, key) == 'sec ret\n'
+    assert credcache.get(agent.path, 'other') is None
+    start.assert_not_called()
+    time.sleep(0.3)
+    assert credcache.get(agent.path, key) is None
+
+def test_bad_request(agent):
+    """test that malformed requests get an error"""
+    assert credcache._request(agent.path, {'op': 'nope'}) == \
+            {'status': 'error'}
+    assert credcache._request(agent.path, {'op': 'get'}) == \
+            {'status': 'error'}
+
+def test_no_agent(tmp_path, mocker):
+    """test that an agent is started when none is running"""
+    start = mocker.patch('nncli.credcache._start_agent')
+    mocker.patch('nncli.credcache.CLIENT_TIMEOUT', 0.1)
+    path = str(tmp_path / 'agent.sock')
+    assert credcache.get(path, 'key') is None
+    assert not credcache.put(path, 'key', 'secret', 60)
+    start.assert_called_once_with(path)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""tests for daemon module"""
+import io
+import socket
+import sys
+import threading
+
+import pytest
+
+from nncli import daemon
+
+@pytest.fixture
+def runtime_dir(tmp_path, monkeypatch):
+    """a private directory for the daemon socket"""
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    return tmp_path
+
+def fake_run(args):
+    """a command runner printing its arguments and stdin"""
+    if args[0] == 'fail':
+        raise KeyError('nope')
+    print(' '.join(args))
+    print(sys.stdin.read(), file=sys.stderr, end='')
+    sys.exit(len(args))
+
+@pytest.fixture
+def server(runtime_dir, mocker):
+    """a daemon serving from a thread"""
+    nncli = mocker.MagicMock()
+    server = daemon.Daemon(nncli, daemon.socket_path('cfg'), fake_run)
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+    yield server
+    daemon.stop('cfg')
+    thread.join(5)
+    assert not thread.is_alive()
+
+def test_command_args():
+    """test finding the arguments of the subcommand"""
+    argv = ['-c', 'list', '-n', 'list', '-r', 'foo']
+    assert daemon.command_args(argv, 'list') == ['-r', 'foo']
+    assert daemon.command_args(['-k', '3'], None) is None
+
+def test_forwardable():
+    """test which commands are sent to the daemon"""
+    assert daemon.forwardable('list', [])
+    assert daemon.forwardable('create', ['-t', 'title', '-'])
+    assert not daemon.forwardable('create', ['-t', 'title'])
+    assert not daemon.forwardable('edit', ['-k', '1'])
+    assert not daemon.forwardable(None, None)
+
+def test_socket_path(runtime_dir):
+    """test that each config file gets its own daemon"""
+    assert daemon.socket_path().startswith(str(runtime_dir))
+    assert daemon.socket_path('a') != daemon.socket_path('b')
+    assert daemon.socket_path() != daemon.socket_path('a')
+
+def test_forward(server, capsys, monkeypatch):
+    """test that output, stdin and exit status are passed through"""
+    monkeypatch.setattr('sys.stdin', io.StringIO('note\n'))
+    assert daemon.forward('cfg', ['-n', 'create', '-']) == 3
+    out, err = capsys.readouterr()
+    assert out == '-n create -\n'
+    assert err == 'note\n'
+
+def test_forward_exception(server, capsys):
+    """test that a failing command reports its traceback"""
+    assert daemon.forward('cfg', ['fail']) == 1
+    assert 'KeyError' in capsys.readouterr().err
+
+def test_forward_no_daemon(runtime_dir, monkeypatch):
+    """test falling back when no daemon is running"""
+    assert daemon.forward('cfg', ['list']) is None
+    open(daemon.socket_path('cfg'), 'w').close()
+    stdin = io.StringIO('note\n')
+    monkeypatch.setattr('sys.stdin', stdin)
+    assert daemon.forward('cfg', ['create', '-']) is None
+    assert sys.stdin.read() == 'note\n'
+
+def test_forward_wedged_daemon(runtime_dir, monkeypatch):
+    """test falling back when the daemon doesn't answer"""
+    monkeypatch.setattr('nncli.daemon.CLIENT_TIMEOUT', 0.1)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        # listening, but never accepting
+        sock.bind(daemon.socket_path('cfg'))
+        sock.listen(5)
+        stdin = io.StringIO('note\n')
+        monkeypatch.setattr('sys.stdin', stdin)
+        assert daemon.forward('cfg', ['create', '-']) is None
+        assert sys.stdin is stdin
+        assert not daemon.stop('cfg')
+
+def test_bad_request(server):
+    """test that a malformed request gets an error"""
+    reply = daemon._send(server.path, {'op': 'run'})
+    assert reply['status'] == 2
+
+def test_sync(server):
+    """test that the daemon syncs between requests"""
+    sync_now = server.nncli.ndb.sync_now
+    assert daemon.forward('cfg', ['list']) == 1
+    sync_now.assert_called_with(server.nncli.config.state.do_server_sync)
+    assert sync_now.call_count == 1
+
+def test_already_running(server, mocker):
+    """test that a second daemon refuses to start"""
+    with pytest.raises(OSError):
+        daemon.Daemon(mocker.MagicMock(), server.path, fake_run)
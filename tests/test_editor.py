@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""tests for editor module"""
+import collections
+import os
+import sys
+import threading
+
+import pytest
+
+from nncli import editor
+from nncli.notes_db import NotesDB
+
+@pytest.fixture
+def ndb(mocker):
+    """a notes database holding one note"""
+    ndb = mocker.Mock()
+    ndb.get_note.return_value = {'localkey': 'key', 'content': 'old\n'}
+    ndb.current_key.side_effect = lambda key: key
+    ndb.note_lock.return_value = threading.Lock()
+    return ndb
+
+@pytest.fixture
+def tfile(tmp_path):
+    """an open temp file holding the note"""
+    path = tmp_path / 'note.mkd'
+    path.write_text('old\n')
+    return open(str(path), 'rb')
+
+def wait_for(event):
+    """wait a bounded time for event"""
+    assert event.wait(5)
+
+@pytest.mark.parametrize('inotify', [True, False])
+def test_file_watcher(mocker, tmp_path, inotify):
+    """test that writes and renames over the file are reported"""
+    if not inotify:
+        mocker.patch.object(editor, '_libc', return_value=None)
+    path = tmp_path / 'note.mkd'
+    path.write_text('one')
+    changed = threading.Event()
+    watcher = editor.FileWatcher(str(path), changed.set, interval=0.05)
+    watcher.start()
+    try:
+        path.write_text('two!')
+        wait_for(changed)
+        changed.clear()
+        new = tmp_path / 'note.mkd.swp'
+        new.write_text('three')
+        os.replace(str(new), str(path))
+        wait_for(changed)
+    finally:
+        watcher.stop()
+    assert not watcher.is_alive()
+
+def test_debouncer(mocker):
+    """test that a burst of triggers calls func once"""
+    called = threading.Event()
+    func = mocker.Mock(side_effect=lambda: called.set())
+    debouncer = editor.Debouncer(0.05, func)
+    for _ in range(10):
+        debouncer.trigger()
+    wait_for(called)
+    assert func.call_count == 1
+
+def test_debouncer_flush(mocker):
+    """test that flush calls func right away, and only if triggered"""
+    func = mocker.Mock()
+    debouncer = editor.Debouncer(60, func)
+    debouncer.flush()
+    assert func.call_count == 0
+    debouncer.trigger()
+    debouncer.flush()
+    assert func.call_count == 1
+
+def test_edit_session_apply(ndb, tfile):
+    """test that each save is applied once"""
+    session = editor.EditSession(ndb, 'key', tfile)
+    session.apply()
+    ndb.set_note_content.assert_not_called()
+    with open(tfile.name, 'w') as note:
+        note.write('new\n')
+    session.apply()
+    session.apply()
+    ndb.set_note_content.assert_called_once_with('key', 'new\n')
+    assert session.changed
+    session.finish()
+    assert not os.path.exists(tfile.name)
+    ndb.sync_worker_go.assert_called_once_with()
+
+def test_edit_session_run(ndb, tfile):
+    """test that saves made while the editor runs are applied"""
+    session = editor.EditSession(ndb, 'key', tfile)
+    session.run([sys.executable, '-c',
+                 'import sys; open(sys.argv[1], "w").write("new\\n")',
+                 tfile.name])
+    ndb.set_note_content.assert_called_with('key', 'new\n')
+    assert not os.path.exists(tfile.name)
+
+def test_edit_session_start(ndb, tfile):
+    """test that a background editor reports its exit"""
+    session = editor.EditSession(ndb, 'key', tfile)
+    done = threading.Event()
+    session.start([sys.executable, '-c', 'pass'], lambda s: done.set())
+    wait_for(done)
+    assert not session.changed
+    ndb.set_note_content.assert_not_called()
+
+def test_edit_session_note_pushed(mocker, tmp_path):
+    """test that saves follow a new note to the key the server gave it"""
+    configs = {'db_path': str(tmp_path / 'db'), 'favorite_ontop': 'yes',
+               'search_categories': 'yes', 'metrics_file': None}
+    config = mocker.Mock()
+    config.get_config.side_effect = lambda name: configs[name]
+    ndb = NotesDB(config, mocker.Mock(), mocker.Mock())
+    key = ndb.create_note('new note')
+    path = tmp_path / 'note.mkd'
+    path.write_text('new note')
+    session = editor.EditSession(ndb, key, open(str(path), 'rb'))
+
+    ndb.note = mocker.Mock(http=collections.Counter(), status='online')
+    ndb.note.update_note.side_effect = lambda note: (dict(note, id=42), 0)
+    ndb.note.iter_note_chunks.side_effect = lambda prune_before: iter([(
+            [{'id': 42, 'modified': 0, 'category': ''}], True)])
+    ndb.sync_notes()
+    assert list(ndb.notes) == [42]
+
+    path.write_text('edited')
+    session.finish()
+    assert not session.failed
+    assert ndb.get_note(42)['content'] == 'edited'
+    assert not path.exists()
+
+def test_edit_session_note_gone(ndb, tfile):
+    """test that a save to a deleted note is reported, not raised"""
+    ndb.set_note_content.side_effect = KeyError('key')
+    session = editor.EditSession(ndb, 'key', tfile)
+    with open(tfile.name, 'w') as note:
+        note.write('new\n')
+    session.finish()
+    assert session.failed
+    assert not session.changed
+    assert not os.path.exists(tfile.name)
+
+def test_edit_session_waits_for_sync(ndb, tfile):
+    """test that a save isn't applied while the note is being synced"""
+    session = editor.EditSession(ndb, 'key', tfile)
+    with open(tfile.name, 'w') as note:
+        note.write('new\n')
+    lock = ndb.note_lock.return_value
+    with lock:
+        thread = threading.Thread(target=session.apply)
+        thread.start()
+        thread.join(0.1)
+        ndb.set_note_content.assert_not_called()
+    thread.join(5)
+    ndb.set_note_content.assert_called_once_with('key', 'new\n')
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 """tests for gui module"""
+import collections
+
 import pytest
+import urwid
 
 import nncli.gui
 
@@ -127,3 +130,124 @@ def test_gui_stop():
 @pytest.mark.skip
 def test_gui():
     pass
+
+def make_gui(mocker, keybinds, context='titles'):
+    """a GUI with keybinds, built without a terminal"""
+    config = mocker.Mock()
+    config.keybinds = collections.OrderedDict(
+            (name, [keys, uses, '']) for name, keys, uses in keybinds)
+    config.get_keybind.side_effect = lambda name: config.keybinds[name][0]
+    config.get_keybind_use.side_effect = \
+            lambda name: config.keybinds[name][1]
+    gui = nncli.gui.NncliGui.__new__(nncli.gui.NncliGui)
+    gui.config = config
+    gui.key_count = ''
+    gui.key_pending = ()
+    for name, _, _ in keybinds:
+        if not name.startswith('tabstop'):
+            # tabstop keys are handled by the note view itself
+            setattr(gui, '_key_' + name, mocker.Mock(return_value=None))
+    gui._gui_build_keymap()
+    gui._gui_key_context = lambda: context
+    gui._gui_update_status_bar = mocker.Mock()
+    gui.master_frame = mocker.Mock()
+    gui.master_frame.keypress = gui._gui_frame_keypress
+    gui.body = mocker.Mock()
+    gui.gui_body_get = lambda: gui.body
+    return gui
+
+KEYBINDS = [('down', 'j', ['common']),
+            ('top', 'g,g', ['common']),
+            ('quit', 'q', ['common']),
+            ('tabstop2', '2', ['notes'])]
+
+def test_keymap(mocker):
+    """test the tables built from the keybinds"""
+    gui = make_gui(mocker, KEYBINDS)
+    assert set(gui.keymap) == {('j',), ('g', 'g'), ('q',)}
+    assert gui.keymap_prefixes == {('g',)}
+    assert gui.keymap_repeatable == {'j'}
+    assert gui.key_digits == {'2': {'notes'}}
+
+def test_count(mocker):
+    """test that digits typed before a key give its count"""
+    gui = make_gui(mocker, KEYBINDS)
+    for key in '25j':
+        assert gui._gui_handle_keypress((80, 24), key) is None
+    gui._key_down.assert_called_once_with((80, 24), 'j', 25)
+    gui._gui_handle_keypress((80, 24), 'j')
+    gui._key_down.assert_called_with((80, 24), 'j', None)
+
+def test_count_digit_keybind(mocker):
+    """test that a digit bound in the current view is not a count"""
+    gui = make_gui(mocker, KEYBINDS, context='notes')
+    gui._gui_handle_keypress((80, 24), '2')
+    assert gui.key_count == ''
+    gui.body.keypress.assert_called_once_with((80, 24), '2')
+    gui._gui_handle_keypress((80, 24), '1')
+    gui._gui_handle_keypress((80, 24), '2')
+    assert gui.key_count == '12'
+
+@pytest.mark.parametrize('key', ['0', '²', '٣'])
+def test_count_not_digits(mocker, key):
+    """test that a leading 0 and non-ASCII digits are plain keys"""
+    gui = make_gui(mocker, KEYBINDS)
+    gui._gui_handle_keypress((80, 24), key)
+    gui._gui_handle_keypress((80, 24), 'j')
+    gui._key_down.assert_called_once_with((80, 24), 'j', None)
+
+def test_sequence(mocker):
+    """test multi-key sequences, and esc cancelling them"""
+    gui = make_gui(mocker, KEYBINDS)
+    gui._gui_handle_keypress((80, 24), 'g')
+    assert gui.key_pending == ('g',)
+    gui._gui_handle_keypress((80, 24), 'g')
+    gui._key_top.assert_called_once_with((80, 24), 'g', None)
+    gui._gui_handle_keypress((80, 24), '3')
+    gui._gui_handle_keypress((80, 24), 'g')
+    gui._gui_handle_keypress((80, 24), 'esc')
+    assert gui.key_count == '' and gui.key_pending == ()
+    gui._gui_handle_keypress((80, 24), 'g')
+    gui._gui_handle_keypress((80, 24), 'q')
+    gui._key_quit.assert_called_once_with((80, 24), 'q', None)
+
+def test_input_filter(mocker):
+    """test that runs of a movement key are applied as one move"""
+    gui = make_gui(mocker, KEYBINDS)
+    keys = gui._gui_input_filter(['j', 'j', 'j', 'q', 'j'], [])
+    assert keys == ['j', 'q', 'j']
+    assert keys[0].repeat == 3
+    gui._gui_handle_keypress((80, 24), keys[0])
+    gui._key_down.assert_called_once_with((80, 24), 'j', 3)
+    gui.key_pending = ('g',)
+    assert gui._gui_input_filter(['j', 'j'], []) == ['j', 'j']
+
+def test_key_down_up(mocker):
+    """test that line moves only change the focus, within bounds"""
+    gui = make_gui(mocker, [])
+    gui.body.body.positions.return_value = range(10)
+    gui.body.focus_position = 2
+    gui._key_down((80, 24), 'j', 5)
+    assert gui.body.focus_position == 7
+    gui._key_down((80, 24), 'j', 5)
+    assert gui.body.focus_position == 9
+    gui._key_up((80, 24), 'k', None)
+    assert gui.body.focus_position == 8
+    gui._key_up((80, 24), 'k', 20)
+    assert gui.body.focus_position == 0
+    gui.body.render.assert_not_called()
+
+def test_stop_with_open_editor(mocker):
+    """test that quitting waits for detached editors to be closed"""
+    gui = make_gui(mocker, [])
+    gui.ndb = mocker.Mock()
+    gui.log = mocker.Mock()
+    gui._gui_clear = mocker.Mock()
+    session = mocker.Mock(failed=False, changed=True)
+    gui.edit_sessions = {session}
+    gui._gui_stop()
+    gui.ndb.verify_all_saved.assert_not_called()
+    gui._gui_edit_done(session)
+    gui.log.assert_called_with('Note updated')
+    with pytest.raises(urwid.ExitMainLoop):
+        gui._gui_stop()
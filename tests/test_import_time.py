@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""tests for the import cost of the nncli entry points"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+import nncli
+
+# microseconds the import of each entry point may take, about three
+# times what it takes now so only real regressions fail
+IMPORT_BUDGET_US = {
+        'nncli.cli': 150000,
+        'nncli.nncli': 150000,
+}
+
+# modules that must only be loaded when actually used
+HEAVY_MODULES = ('urwid', 'requests', 'nncli.gui', 'nncli.profiler')
+
+def run_python(*args):
+    """run a fresh interpreter that can import nncli, return its stderr"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(nncli.__file__))
+    return subprocess.run([sys.executable] + list(args), env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+def import_time(module):
+    """the cumulative import time of module in microseconds"""
+    for line in run_python('-X', 'importtime', '-c',
+                           'import ' + module).stderr.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1])
+    raise AssertionError('no import time reported for ' + module)
+
+@pytest.mark.parametrize('module', sorted(IMPORT_BUDGET_US))
+def test_heavy_modules_deferred(module):
+    """test that importing an entry point leaves heavy modules alone"""
+    loaded = run_python('-c', 'import sys, {0}; print(" ".join(sorted('
+                        'sys.modules)))'.format(module)).stdout.split()
+    assert not set(HEAVY_MODULES) & set(loaded)
+
+@pytest.mark.parametrize('module', sorted(IMPORT_BUDGET_US))
+def test_import_budget(module):
+    """test that importing an entry point stays within its budget"""
+    # the best of a few runs, to not fail on a busy machine
+    assert min(import_time(module) for _ in range(3)) < \
+            IMPORT_BUDGET_US[module]
+
+def test_version():
+    """test that --version doesn't load the notes database"""
+    result = run_python('-X', 'importtime', '-m', 'nncli', '--version')
+    assert result.stdout.strip().endswith(nncli.__version__)
+    assert 'nncli.nncli' not in result.stderr
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""tests for log module"""
+import logging
+
+from nncli.log import Logger, RateLimitFilter
+
+def make_record(msg, *args):
+    """a debug record for msg"""
+    return logging.LogRecord('root', logging.DEBUG, __file__, 0, msg, args,
+                             None)
+
+def test_rate_limit():
+    """test that a burst of one message type is cut short and counted"""
+    ratelimit = RateLimitFilter(burst=3, interval=3600)
+    passed = [ratelimit.filter(make_record('Saved note (key=%s)', key))
+              for key in range(10)]
+    assert passed == [True] * 3 + [False] * 7
+    assert ratelimit.filter(make_record('Other message'))
+    summaries = ratelimit.flush()
+    assert [record.getMessage() for record in summaries] == \
+        ['7 similar messages suppressed: Saved note (key=%s)']
+    assert not ratelimit.flush()
+
+def test_rate_limit_window(mocker):
+    """test that the suppressed count is reported in the next window"""
+    clock = mocker.patch('time.monotonic', return_value=0.0)
+    ratelimit = RateLimitFilter(burst=1, interval=1.0)
+    assert ratelimit.filter(make_record('msg %d', 1))
+    assert not ratelimit.filter(make_record('msg %d', 2))
+    clock.return_value = 1.5
+    record = make_record('msg %d', 3)
+    assert ratelimit.filter(record)
+    assert record.getMessage() == 'msg 3 [1 similar messages suppressed]'
+
+def test_rate_limit_pruned(mocker):
+    """test that windows of types no longer logged are dropped"""
+    clock = mocker.patch('time.monotonic', return_value=0.0)
+    ratelimit = RateLimitFilter(burst=1, interval=1.0)
+    for key in range(100):
+        assert ratelimit.filter(make_record('msg {}'.format(key)))
+    assert ratelimit.filter(make_record('other %d', 1))
+    assert not ratelimit.filter(make_record('other %d', 2))
+    assert len(ratelimit.windows) == 101
+    clock.return_value = 1.5
+    assert ratelimit.filter(make_record('new'))
+    assert set(ratelimit.windows) == {(logging.DEBUG, 'other %d'),
+                                      (logging.DEBUG, 'new')}
+
+def test_logger(mocker, tmp_path):
+    """test that records reach the log file through the queue"""
+    config = mocker.Mock()
+    configs = {'db_path': str(tmp_path), 'log_level': 'info'}
+    config.get_config.side_effect = lambda name: configs[name]
+    config.state.do_gui = True
+    logger = Logger(config)
+    logger.log('Saved %d notes to disk', 812)
+    logging.debug('not written at info level')
+    logger.close()
+    with open(logger.logfile) as logfile:
+        lines = logfile.read().splitlines()
+    assert len(lines) == 1
+    assert lines[0].endswith('[INFO] Saved 812 notes to disk')
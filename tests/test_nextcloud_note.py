@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""tests for nextcloud_note module"""
+import pytest
+import requests
+
+from nncli import codec
+from nncli.nextcloud_note import NextcloudNote
+
+def response(status, body, headers=None):
+    """an HTTP response with a JSON body"""
+    res = requests.Response()
+    res.status_code = status
+    res._content = codec.dumpb(body)
+    res.headers.update(headers or {})
+    return res
+
+@pytest.fixture
+def note(mocker):
+    """a client with its HTTP session mocked"""
+    note = NextcloudNote('user', 'password', 'nextcloud.example.org')
+    note.session = mocker.Mock()
+    return note
+
+def requested(note):
+    """the URLs and params of the requests made"""
+    return [(call[0][0].split('/api/')[1], call[1]['params'])
+            for call in note.session.get.call_args_list]
+
+def test_chunks_v1(note):
+    """test that the note list is fetched chunk by chunk with v1"""
+    note.session.get.side_effect = [
+            response(200, [{'id': 1}], {'X-Notes-API-Versions': '0.2, 1.3',
+                                        'X-Notes-Chunk-Cursor': 'next'}),
+            response(200, [{'id': 2}])]
+    chunks = list(note.iter_note_chunks(prune_before=5, chunk_size=1))
+    assert chunks == [([{'id': 1}], False), ([{'id': 2}], True)]
+    assert requested(note) == [
+            ('v1/notes', {'chunkSize': 1, 'pruneBefore': 5}),
+            ('v1/notes', {'chunkSize': 1, 'pruneBefore': 5,
+                          'chunkCursor': 'next'})]
+    assert note.api_version == '1'
+    assert note.url.endswith('/api/v1/notes')
+    assert note.http['requests'] == 2
+
+@pytest.mark.parametrize('v1_response', [
+        response(404, {}),
+        response(200, [], {'X-Notes-API-Versions': '0.2'})])
+def test_chunks_v02(note, v1_response):
+    """test the fallback to v0.2 for servers without v1"""
+    note.session.get.side_effect = [v1_response,
+                                    response(200, [{'id': 1}]),
+                                    response(200, [{'id': 2}])]
+    assert list(note.iter_note_chunks()) == [([{'id': 1}], True)]
+    assert list(note.iter_note_chunks()) == [([{'id': 2}], True)]
+    assert [url for url, _ in requested(note)] == \
+        ['v1/notes', 'v0.2/notes', 'v0.2/notes']
+    assert note.api_version == '0.2'
+    assert note.url.endswith('/api/v0.2/notes')
+
+def test_chunks_error(note):
+    """test that a failed request leaves the version undecided"""
+    note.session.get.return_value = response(500, {})
+    with pytest.raises(requests.exceptions.HTTPError):
+        list(note.iter_note_chunks())
+    assert note.api_version is None
+    assert note.http['errors'] == 1
@@ -14,20 +14,37 @@ import nncli.utils
 def mock_nncli(mocker):
     """mock the major interfaces for the Nncli class"""
     mocker.patch('nncli.nncli.NotesDB')
-    mocker.patch('nncli.nncli.NncliGui')
+    mocker.patch('nncli.gui.NncliGui')
     mocker.patch('nncli.nncli.Config')
     mocker.patch('nncli.nncli.Logger')
+    mocker.patch('nncli.nncli.atexit')
     mocker.patch('os.mkdir')
     mocker.patch('subprocess.check_output')
     mocker.patch('os.path.exists',
                  new=mocker.MagicMock(return_value=True))
 
+@pytest.mark.parametrize('enabled', ['yes', 'no'])
+def test_init_stats(mocker, mock_nncli, enabled):
+    """test that the stats are saved once, to the main account's file"""
+    config = nncli.nncli.Config.return_value
+    config.get_config.side_effect = \
+            lambda name: enabled if name == 'stats' else 'x'
+    mocker.patch('nncli.stats.enable')
+    main_ndb = nncli.nncli.NotesDB.return_value
+    mocker.patch('nncli.nncli.open_accounts')
+    nncli.nncli.Nncli(False)
+    if enabled == 'yes':
+        nncli.nncli.atexit.register.assert_called_once_with(
+                nncli.stats.save, main_ndb.stats_file)
+    else:
+        nncli.nncli.atexit.register.assert_not_called()
+
 def test_init_no_local_db(mocker, mock_nncli):
     """test initialization when there is no local notes database"""
     mocker.patch('os.path.exists',
                  new=mocker.MagicMock(return_value=False))
     nn_obj = nncli.nncli.Nncli(False)
-    assert nn_obj.config.get_config.call_count == 2
+    assert nn_obj.config.get_config.call_count == 3
     nn_obj.ndb.set_update_view.assert_called_once()
     os.mkdir.assert_called_once()
     nn_obj.ndb.sync_now.assert_called_once()
@@ -35,7 +52,8 @@ def test_init_no_local_db(mocker, mock_nncli):
 def test_init(mocker, mock_nncli):
     """test nominal initialization"""
     nn_obj = nncli.nncli.Nncli(False)
-    nn_obj.config.get_config.assert_called_once()
+    assert [args for args, _ in nn_obj.config.get_config.call_args_list] == \
+            [('db_path',), ('stats',)]
     nn_obj.ndb.set_update_view.assert_called_once()
     assert os.mkdir.call_count == 0
 
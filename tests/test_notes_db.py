@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""tests for notes_db module"""
+import collections
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from nncli.notes_db import NotesDB
+
+@pytest.fixture
+def ndb(mocker, tmp_path):
+    """a notes database in a temporary directory"""
+    configs = {'db_path': str(tmp_path),
+               'nn_username': 'user',
+               'nn_password': 'password',
+               'nn_host': 'nextcloud.example.org',
+               'favorite_ontop': 'yes',
+               'search_categories': 'yes',
+               'stats': 'no',
+               'metrics_file': None}
+    config = mocker.Mock()
+    config.get_config.side_effect = lambda name: configs[name]
+    ndb = NotesDB(config, mocker.Mock(), mocker.Mock())
+    ndb.create_note('shopping list\n\napples bananas')
+    ndb.create_note('todo\n\nbuy apples')
+    ndb.create_note('meeting notes\n\nnothing to buy')
+    return ndb
+
+def keys_of(notes):
+    """the set of keys in a filter_notes result"""
+    return {n.key for n in notes}
+
+def test_filter_notes_cached(ndb, mocker):
+    """test that an identical query is answered from the cache"""
+    first, _, _ = ndb.filter_notes('apples')
+    mocker.patch.object(ndb, '_filter_notes_gstyle')
+    second, _, _ = ndb.filter_notes('apples')
+    ndb._filter_notes_gstyle.assert_not_called()
+    assert keys_of(first) == keys_of(second)
+    assert first is not second
+
+def test_filter_notes_refined(ndb, mocker):
+    """test that a narrowing query only filters the cached candidates"""
+    broad, _, _ = ndb.filter_notes('buy')
+    assert len(broad) == 2
+    spy = mocker.spy(ndb, '_filter_notes_gstyle')
+    narrow, _, _ = ndb.filter_notes('buy apples')
+    assert set(spy.call_args[0][1]) == keys_of(broad)
+    assert len(narrow) == 1
+    assert narrow[0].note['title'] == 'todo'
+
+def test_filter_notes_not_refined(ndb, mocker):
+    """test that an unrelated query scans all notes"""
+    ndb.filter_notes('buy')
+    spy = mocker.spy(ndb, '_filter_notes_gstyle')
+    result, _, _ = ndb.filter_notes('shopping')
+    assert spy.call_args[0][1] is None
+    assert len(result) == 1
+
+def test_filter_notes_invalidated(ndb):
+    """test that mutations invalidate cached results"""
+    result, _, _ = ndb.filter_notes('apples')
+    assert len(result) == 2
+    ndb.set_note_content(result[0].key, 'no fruit here')
+    result, _, _ = ndb.filter_notes('apples')
+    assert len(result) == 1
+
+def test_gstyle_narrows():
+    """test the query narrowing rules"""
+    parse = NotesDB._helper_gstyle_parse
+    narrows = NotesDB._helper_gstyle_narrows
+    assert narrows(parse('foo'), parse('foo bar'))
+    assert narrows(parse('foo'), parse('Food'))
+    assert narrows(parse('category:wo'), parse('category:work x'))
+    assert not narrows(parse('foo bar'), parse('foo'))
+    assert not narrows(parse('category:foo'), parse('foo'))
+
+def test_filter_notes_regex_parallel(ndb, mocker):
+    """test that the parallel regex scan matches the serial one"""
+    for i in range(50):
+        ndb.create_note('generated {0}\n\n{1}'.format(
+                i, 'apples' if i % 3 else 'pears'))
+    ndb.set_note_category(ndb.create_note('categorised'), 'apples')
+    serial, _, _ = ndb.filter_notes('app.es', search_mode='regex')
+
+    mocker.patch('nncli.search.PARALLEL_SEARCH_MIN_BYTES', 0)
+    ndb.regex_search.workers = 2
+    ndb._touch()
+    spy = mocker.spy(ndb.regex_search, 'search')
+    parallel, _, _ = ndb.filter_notes('app.es', search_mode='regex')
+    ndb.regex_search.close()
+
+    spy.assert_called_once()
+    assert [(n.key, n.catfound) for n in parallel] == \
+        [(n.key, n.catfound) for n in serial]
+
+def test_filter_notes_regex_broken_pool(ndb, mocker):
+    """test that a broken worker pool is replaced after a serial search"""
+    serial, _, _ = ndb.filter_notes('buy', search_mode='regex')
+    mocker.patch('nncli.search.PARALLEL_SEARCH_MIN_BYTES', 0)
+    ndb.regex_search.workers = 2
+    pool = mocker.Mock()
+    pool.submit.side_effect = BrokenProcessPool('worker died')
+    ndb.regex_search.pool = pool
+    ndb._touch()
+    result, _, _ = ndb.filter_notes('buy', search_mode='regex')
+    ndb.regex_search.close()
+    assert keys_of(result) == keys_of(serial)
+    pool.shutdown.assert_called_once_with(wait=False)
+    assert ndb.regex_search.pool is None
+
+def test_filter_notes_regex_index_updated(ndb):
+    """test that the trigram index follows note changes"""
+    result, _, _ = ndb.filter_notes('bananas', search_mode='regex')
+    assert len(result) == 1
+    ndb.set_note_content(result[0].key, 'no fruit here')
+    key = ndb.create_note('more bananas')
+    result, _, _ = ndb.filter_notes('bananas', search_mode='regex')
+    assert [n.key for n in result] == [key]
+
+def test_filter_notes_category(ndb):
+    """test category searches in both search modes"""
+    keys = list(ndb.notes.keys())
+    ndb.set_note_category(keys[0], 'Groceries')
+    ndb.set_note_category(keys[1], 'work')
+    result, _, _ = ndb.filter_notes('category:gro')
+    assert [(n.key, n.catfound) for n in result] == [(keys[0], 1)]
+    result, _, _ = ndb.filter_notes('category:gro bananas')
+    assert len(result) == 1
+    result, _, _ = ndb.filter_notes('category:roc')
+    assert not result
+    result, _, _ = ndb.filter_notes('^w', search_mode='regex')
+    assert [(n.key, n.catfound) for n in result] == [(keys[1], 1)]
+    assert ndb.get_categories() == [('Groceries', 1), ('work', 1)]
+
+def test_sync_metrics(ndb, mocker, tmp_path):
+    """test that a server sync writes its metrics textfile"""
+    metrics_file = tmp_path / 'nncli.prom'
+    ndb.metrics_file = str(metrics_file)
+    ndb.note = mocker.Mock(http=collections.Counter(), status='online')
+    new_ids = iter(range(100, 200))
+
+    def update_note(note):
+        ndb.note.http['requests'] += 1
+        return dict(note, id=next(new_ids)), 0
+
+    ndb.note.update_note.side_effect = update_note
+    ndb.note.iter_note_chunks.side_effect = lambda prune_before: iter([(
+            [{'id': key, 'modified': 0, 'category': ''} for key in ndb.notes],
+            True)])
+    ndb.sync_notes(server_sync=True, full_sync=True)
+
+    assert sorted(ndb.notes) == [100, 101, 102]
+    lines = metrics_file.read_text().splitlines()
+    assert 'nncli_sync_notes{action="pushed"} 3' in lines
+    assert 'nncli_sync_notes{action="deleted"} 0' in lines
+    assert 'nncli_sync_http_requests 3' in lines
+    assert 'nncli_sync_errors 0' in lines
+    assert 'nncli_sync_status{status="online"} 1' in lines
+    assert any(line.startswith('nncli_sync_duration_seconds{phase="total"}')
+               for line in lines)
+    assert any(line.startswith('nncli_sync_last_success_timestamp_seconds')
+               for line in lines)
+    assert lines[-1] == '# EOF'
+    assert not (tmp_path / 'nncli.prom.tmp').exists()
+
+def server_notes(count):
+    """notes as listed by the server, with their content"""
+    return [{'id': i, 'modified': 1, 'category': '', 'favorite': False,
+             'title': 'note {}'.format(i), 'content': 'note {}'.format(i)}
+            for i in range(1000, 1000 + count)]
+
+def mock_server(ndb, mocker, notes):
+    """have ndb sync with a server holding notes"""
+    ndb.notes.clear()
+    ndb.needs_save.clear()
+    ndb.needs_push.clear()
+    ndb.note = mocker.Mock(http=collections.Counter(), status='online')
+    ndb.note.iter_note_chunks.side_effect = lambda prune_before: iter([(
+            [{key: value for key, value in note.items() if key != 'content'}
+             for note in notes], True)])
+    by_id = {note['id']: note for note in notes}
+    ndb.note.get_note.side_effect = lambda note_id: (dict(by_id[note_id]), 0)
+    ndb.note.iter_notes.side_effect = lambda: (dict(note) for note in notes)
+
+def test_sync_bulk_fetch(ndb, mocker):
+    """test that pulling many notes takes one listing of all notes"""
+    mock_server(ndb, mocker, server_notes(50))
+    assert ndb.sync_notes() == 0
+    ndb.note.iter_notes.assert_called_once_with()
+    ndb.note.get_note.assert_not_called()
+    assert len(ndb.notes) == 50
+    assert ndb.notes[1049]['content'] == 'note 1049'
+    assert ndb.notes[1049]['syncdate']
+
+def test_sync_few_notes(ndb, mocker):
+    """test that pulling a few notes fetches them one by one"""
+    notes = server_notes(50)
+    mock_server(ndb, mocker, notes)
+    ndb.sync_notes()
+    notes[0]['modified'] = notes[1]['modified'] = 2
+    mock_server(ndb, mocker, notes)
+    ndb.notes.update({note['id']: dict(note, modified=1, syncdate=1,
+                                       savedate=1, deleted=False)
+                      for note in notes})
+    assert ndb.sync_notes() == 0
+    ndb.note.iter_notes.assert_not_called()
+    assert ndb.note.get_note.call_count == 2
+    assert ndb.notes[1000]['modified'] == 2
+
+def test_sync_bulk_fetch_failed(ndb, mocker):
+    """test that notes a failed listing missed are fetched one by one"""
+    notes = server_notes(20)
+    mock_server(ndb, mocker, notes)
+
+    def broken_listing():
+        yield dict(notes[0])
+        raise ValueError('truncated')
+
+    ndb.note.iter_notes.side_effect = broken_listing
+    assert ndb.sync_notes() == 0
+    assert ndb.note.get_note.call_count == 19
+    assert len(ndb.notes) == 20
+
+def test_sync_chunks(ndb, mocker, tmp_path):
+    """test that notes listed with content are pulled chunk by chunk"""
+    notes = server_notes(3)
+    mock_server(ndb, mocker, notes)
+    saved = []
+
+    def chunks(prune_before):
+        assert prune_before is None
+        yield [notes[0], {'id': notes[2]['id']}], False
+        saved.append(sorted(path.name for path in tmp_path.glob('*.json')))
+        yield [notes[1], {'id': notes[0]['id']}], True
+
+    ndb.note.iter_note_chunks.side_effect = chunks
+    assert ndb.sync_notes() == 0
+    assert saved == [['1000.json']]
+    ndb.note.get_note.assert_called_once_with(1002)
+    assert sorted(ndb.notes) == [1000, 1001, 1002]
+    assert ndb.notes[1001]['content'] == 'note 1001'
+    assert (tmp_path / '1002.json').exists()
+    ndb.log.assert_any_call('Listed %d notes from server', 2)
+
+    ndb.note.iter_note_chunks.side_effect = lambda prune_before: iter(
+            [([{'id': note['id']} for note in notes], True)])
+    ndb.note.get_note.reset_mock()
+    assert ndb.sync_notes() == 0
+    ndb.note.iter_note_chunks.assert_called_with(1 - 24 * 60 * 60)
+    ndb.note.get_note.assert_not_called()
+    assert len(ndb.notes) == 3
+
+def test_dirty_sets(ndb, mocker):
+    """test that changed notes are tracked until saved and pushed"""
+    keys = list(ndb.notes)
+    assert set(ndb.needs_save) == set(ndb.needs_push) == set(keys)
+    assert not ndb.verify_all_saved()
+    ndb.sync_notes(server_sync=False)
+    assert not ndb.needs_save
+    assert set(ndb.needs_push) == set(keys)
+    assert ndb.verify_all_saved()
+
+    reloaded = NotesDB(ndb.config, mocker.Mock(), mocker.Mock())
+    assert set(reloaded.needs_push) == set(keys)
+
+    ndb.note = mocker.Mock(http=collections.Counter(), status='online')
+    new_ids = iter(range(100, 200))
+    ndb.note.update_note.side_effect = \
+            lambda note: (dict(note, id=next(new_ids)), 0)
+    ndb.note.iter_note_chunks.side_effect = lambda prune_before: iter([(
+            [{'id': key, 'modified': 0} for key in range(100, 103)], True)])
+    ndb.sync_notes()
+    assert not ndb.needs_save
+    assert not ndb.needs_push
+
+    ndb.set_note_content(100, 'changed')
+    ndb.set_note_favorite(101, True)
+    assert set(ndb.needs_save) == set(ndb.needs_push) == {100, 101}
+    assert 100 in ndb.needs_save
+    assert 102 not in ndb.needs_push
+
+def test_oplog_recovery(ndb, mocker):
+    """test that changes not yet saved to disk survive a crash"""
+    ndb.sync_notes(server_sync=False)
+    assert ndb.oplog.replay() == []
+    key = next(iter(ndb.notes))
+    ndb.set_note_content(key, 'rewritten')
+    ndb.set_note_category(key, 'work')
+    new_key = ndb.create_note('unsaved note')
+
+    # a new process reading the same database
+    recovered = NotesDB(ndb.config, mocker.Mock(), mocker.Mock())
+    assert recovered.notes[key]['content'] == 'rewritten'
+    assert recovered.notes[key]['category'] == 'work'
+    assert recovered.notes[key]['what_changed'] == ['content', 'category']
+    assert recovered.notes[new_key]['content'] == 'unsaved note'
+    assert set(recovered.needs_save) == {key, new_key}
+    assert recovered.get_categories() == [('work', 1)]
+    recovered.log.assert_called_with('Recovered %d unsaved change%s', 3,
+                                    's')
+
+    recovered.sync_notes(server_sync=False)
+    assert recovered.oplog.replay() == []
+    again = NotesDB(ndb.config, mocker.Mock(), mocker.Mock())
+    assert again.notes[key]['content'] == 'rewritten'
+    assert not again.needs_save
+
+def test_oplog_compacted_before_unlink(ndb, mocker):
+    """test that a crash while unlinking can't replay a pushed note"""
+    ndb.sync_notes(server_sync=False)
+    key = next(iter(ndb.notes))
+    ndb.set_note_content(key, 'rewritten')
+    ndb.note = mocker.Mock(http=collections.Counter(), status='online')
+    new_ids = iter(range(100, 200))
+    ndb.note.update_note.side_effect = \
+            lambda note: (dict(note, id=next(new_ids)), 0)
+    ndb.note.iter_note_chunks.side_effect = lambda prune_before: iter([(
+            [{'id': key, 'modified': 0, 'category': ''}
+             for key in range(100, 103)], True)])
+    mocker.patch('nncli.notes_db.os.unlink', side_effect=RuntimeError)
+    with pytest.raises(RuntimeError):
+        ndb.sync_notes()
+    assert ndb.oplog.replay() == []
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""tests for oplog module"""
+from nncli.oplog import OperationLog
+
+def test_append_replay(tmp_path):
+    """test that operations are read back in order"""
+    path = str(tmp_path / 'nncli.oplog')
+    log = OperationLog(path)
+    assert log.replay() == []
+    log.append({'op': 'content', 'key': 'a', 'value': 'one'})
+    log.append({'op': 'favorite', 'key': 1, 'value': True})
+    log.close()
+    assert OperationLog(path).replay() == [
+            {'op': 'content', 'key': 'a', 'value': 'one'},
+            {'op': 'favorite', 'key': 1, 'value': True}]
+
+def test_partial_line(tmp_path):
+    """test that a line cut short by a crash is skipped"""
+    path = tmp_path / 'nncli.oplog'
+    path.write_bytes(b'{"op":"create","key":"a"}\n{"op":"cont')
+    log = OperationLog(str(path))
+    assert log.replay() == [{'op': 'create', 'key': 'a'}]
+    log.append({'op': 'content', 'key': 'a'})
+    assert log.replay() == [{'op': 'create', 'key': 'a'},
+                            {'op': 'content', 'key': 'a'}]
+
+def test_not_an_operation(tmp_path):
+    """test that lines holding anything but an operation are skipped"""
+    path = tmp_path / 'nncli.oplog'
+    path.write_bytes(b'[1, 2]\n"create"\n{"op":"create","key":"a"}\nnull\n')
+    log = OperationLog(str(path))
+    assert log.replay() == [{'op': 'create', 'key': 'a'}]
+    log.compact(lambda operation: operation.get('key') == 'a')
+    assert log.replay() == [{'op': 'create', 'key': 'a'}]
+
+def test_compact(tmp_path):
+    """test that compacting keeps only the operations asked for"""
+    path = tmp_path / 'nncli.oplog'
+    log = OperationLog(str(path))
+    for key in 'abab':
+        log.append({'op': 'content', 'key': key})
+    log.compact(lambda operation: operation['key'] == 'b')
+    assert log.count == 2
+    log.append({'op': 'content', 'key': 'c'})
+    assert [operation['key'] for operation in log.replay()] == \
+        ['b', 'b', 'c']
+    log.compact(lambda operation: False)
+    assert path.read_bytes() == b''
+    assert not (tmp_path / 'nncli.oplog.tmp').exists()
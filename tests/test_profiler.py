@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""tests for profiler module"""
+import pstats
+
+import nncli.stats as stats
+from nncli.profiler import Profiler
+
+def test_profile(tmp_path):
+    """test that the pstats file and the report are written"""
+    stats.STATS.reset()
+    profiler = Profiler()
+    profiler.start()
+    with stats.timer('sync.pull'):
+        sorted(range(1000), key=str)
+    prof_path, report_path = profiler.stop(str(tmp_path))
+    stats.enable(False)
+    stats.STATS.reset()
+
+    assert pstats.Stats(prof_path).total_calls > 0
+    with open(report_path) as report:
+        lines = report.read().splitlines()
+    assert lines[1].startswith('Wall time: ')
+    assert lines[3] == 'Sync phases'
+    assert lines[5].split()[:2] == ['sync.pull', '1']
+    assert 'Top functions by cumulative time' in lines
+    assert 'Top functions by own time' in lines
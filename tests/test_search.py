@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""tests for search module"""
+import re
+
+import pytest
+
+from nncli.search import CategoryIndex, TrigramIndex, regex_trigrams
+
+CONTENTS = {
+        'a': 'Shopping list\n\napples, bananas',
+        'b': 'Meeting notes\n\nDiscussed the budget',
+        'c': 'ΑΣ and σ and Straße',
+        'd': 'LISTING of ıtems',
+        'e': '',
+}
+
+@pytest.mark.parametrize('pattern,expected', [
+        ('apples', {'app', 'ppl', 'ple', 'les'}),
+        ('^foo$', {'foo'}),
+        ('foo.*bar', {'foo', 'bar'}),
+        ('(abc)+x', {'abc'}),
+        ('(abc)?x', None),
+        ('foo|bar', None),
+        ('[a-z]+', None),
+        ('ab', None),
+])
+def test_regex_trigrams(pattern, expected):
+    """test the literal trigrams extracted from patterns"""
+    assert regex_trigrams(re.compile(pattern)) == expected
+
+def test_regex_trigrams_ignorecase():
+    """test that fragments are split on unsafe characters"""
+    assert regex_trigrams(re.compile('listing', re.IGNORECASE)) is None
+    assert regex_trigrams(re.compile('listing')) == \
+        {'lis', 'ist', 'sti', 'tin', 'ing'}
+    assert regex_trigrams(re.compile('(?i)abcixyz')) == {'abc', 'xyz'}
+
+@pytest.mark.parametrize('pattern', [
+        'apples', 'APPLES/i', 'list', 'listing/i', 'σ', 'ΑΣ', 'ss',
+        'straße/i', 'notes.*budget', '(?i)meeting', 'nothing',
+])
+def test_candidates_superset(pattern):
+    """test that the prefilter never drops a matching note"""
+    flags = re.IGNORECASE if pattern.endswith('/i') else 0
+    sspat = re.compile(pattern.replace('/i', ''), flags)
+    index = TrigramIndex()
+    index.build({k: {'content': v} for k, v in CONTENTS.items()})
+    candidates = index.candidates(sspat)
+    matching = {k for k, v in CONTENTS.items() if sspat.search(v)}
+    if candidates is not None:
+        assert matching <= candidates
+
+def test_update_and_remove():
+    """test incremental maintenance of the index"""
+    index = TrigramIndex()
+    index.update('a', 'ignored before the first build')
+    assert not index.note_grams
+    index.build({'a': {'content': 'apples'}})
+    index.update('a', 'pears')
+    index.update('b', 'apples')
+    assert index.candidates(re.compile('apples')) == {'b'}
+    index.remove('b')
+    assert index.candidates(re.compile('apples')) == set()
+    assert 'app' not in index.postings
+
+def test_category_index():
+    """test category lookups and maintenance"""
+    index = CategoryIndex()
+    index.build({'a': {'category': 'Work'},
+                 'b': {'category': 'work/projects'},
+                 'c': {'category': 'home'},
+                 'd': {'category': None}})
+    assert index.keys_with_prefix('WO') == {'a', 'b'}
+    assert index.keys_with_prefix('work/') == {'b'}
+    assert index.keys_with_prefix('x') == set()
+    assert index.keys_matching(re.compile('^h')) == {'c'}
+    assert index.keys_matching(re.compile('.*')) == {'a', 'b', 'c'}
+    index.update('c', 'work')
+    index.remove('b')
+    assert index.categories() == [('Work', 1), ('work', 1)]
+    assert index.ranks()[''] == -1
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""tests for stats module"""
+import pytest
+
+import nncli.stats as stats
+
+@pytest.fixture
+def enabled():
+    """enable recording for a test and clean up afterwards"""
+    stats.STATS.reset()
+    stats.enable()
+    yield stats.STATS
+    stats.enable(False)
+    stats.STATS.reset()
+
+def test_disabled():
+    """test that nothing is recorded while disabled"""
+    stats.STATS.reset()
+    with stats.timer('test.timer'):
+        pass
+    stats.count('test.counter')
+    stats.elapsed('test.elapsed', stats.clock())
+    assert stats.STATS.snapshot() == {'timers': {}, 'counters': {}}
+
+def test_enabled(enabled):
+    """test timers and counters"""
+    with stats.timer('test.timer'):
+        pass
+    stats.elapsed('test.timer', stats.clock())
+    stats.count('test.counter', 3)
+    snapshot = enabled.snapshot()
+    assert snapshot['timers']['test.timer']['count'] == 2
+    assert len(snapshot['timers']['test.timer']['recent']) == 2
+    assert snapshot['counters'] == {'test.counter': 3}
+
+def test_save_merges(enabled, tmp_path):
+    """test that saving adds to what earlier runs recorded"""
+    path = str(tmp_path / 'nncli.stats')
+    stats.count('test.counter')
+    enabled.record('test.timer', 0.5)
+    stats.save(path)
+    stats.save(path)
+    merged = stats.load(path)
+    assert merged['counters'] == {'test.counter': 2}
+    assert merged['timers']['test.timer']['count'] == 2
+    assert merged['timers']['test.timer']['max'] == 0.5
+    lines = stats.report_lines(merged)
+    assert lines[1].split()[:3] == ['test.timer', '2', '500.0ms']
+    assert lines[-1].split() == ['test.counter', '2']
+
+def test_report_empty():
+    """test the report with nothing recorded"""
+    assert stats.report_lines({}) == ['No stats recorded']
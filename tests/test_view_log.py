@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""tests for view_log module"""
+import os
+
+import pytest
+
+from nncli.view_log import ViewLog
+
+@pytest.fixture
+def logfile(tmp_path):
+    """an empty log file"""
+    path = tmp_path / 'nncli.log'
+    path.write_text('')
+    return path
+
+def make_view(mocker, logfile, reversed_log='no'):
+    """a log view on logfile"""
+    config = mocker.Mock()
+    config.get_config.return_value = reversed_log
+    return ViewLog(config, mocker.Mock(logfile=str(logfile)))
+
+def text_at(view, position):
+    """the text of the log line widget at position"""
+    return view.body[position].original_widget.text
+
+def test_update_log_appended(mocker, logfile):
+    """test that only appended lines are read"""
+    view = make_view(mocker, logfile)
+    logfile.write_text('one\ntwo\nthr')
+    view.update_log()
+    assert view.lines == ['one', 'two']
+    with open(str(logfile), 'a') as log:
+        log.write('ee\nfour\n')
+    mocker.spy(view.body, 'make_widget')
+    view.update_log()
+    assert view.lines == ['one', 'two', 'three', 'four']
+    assert len(view.body) == 4
+    assert text_at(view, 3) == 'four'
+    assert view.body.make_widget.call_count == 1
+
+def test_update_log_rotated(mocker, logfile):
+    """test that a rotated log is read from the start"""
+    view = make_view(mocker, logfile)
+    logfile.write_text('old 1\nold 2\n')
+    view.update_log()
+    os.rename(str(logfile), str(logfile) + '.1')
+    logfile.write_text('new\n')
+    view.update_log()
+    assert view.lines == ['new']
+
+def test_update_log_reversed(mocker, logfile):
+    """test that the newest line comes first"""
+    view = make_view(mocker, logfile, 'yes')
+    logfile.write_text('one\ntwo\n')
+    view.update_log()
+    assert [text_at(view, pos) for pos in view.body.positions()] == \
+        ['two', 'one']
+    assert view.focus_position == 0
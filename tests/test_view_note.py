@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""tests for view_note module"""
+import pytest
+import urwid
+
+from nncli.view_note import ViewNote, line_offsets
+
+@pytest.fixture
+def note():
+    """a note of a few lines"""
+    return {'localkey': 'key', 'content': 'one\n\ttwo\nthree\nTwo\n',
+            'modified': 0}
+
+def make_view(mocker, note):
+    """a note view showing note"""
+    config = mocker.Mock()
+    config.get_config.return_value = '4'
+    ndb = mocker.Mock()
+    ndb.get_note.return_value = note
+    return ViewNote(config, {'ndb': ndb, 'id': 'key', 'log': mocker.Mock()})
+
+def text_at(view, position):
+    """the text of the line widget at position"""
+    return view.body[position].original_widget.text
+
+@pytest.mark.parametrize('content', ['', 'a', 'a\n', '\n\nb\nc'])
+def test_line_offsets(content):
+    """test that the offsets agree with splitting the content"""
+    offsets = line_offsets(content)
+    ends = [offset - 1 for offset in offsets[1:]] + [len(content)]
+    assert [content[start:end] for start, end in zip(offsets, ends)] == \
+        content.split('\n')
+
+def test_lines(mocker, note):
+    """test that lines are built on demand, with tabs expanded"""
+    view = make_view(mocker, note)
+    assert len(view.body) == 6
+    assert view.body.widgets == {}
+    assert text_at(view, 1) == '    two'
+    assert text_at(view, 4) == ''
+    assert isinstance(view.body[5].original_widget, urwid.Divider)
+    assert list(view.body.widgets) == [1, 4, 5]
+
+def test_search(mocker, note):
+    """test that searching moves the focus without rebuilding lines"""
+    view = make_view(mocker, note)
+    view.search_direction = 'forward'
+    text_at(view, 0)
+    view.search_note_view_next('two', 'gstyle')
+    assert view.focus_position == 1
+    view.search_note_view_next('two/i', 'regex')
+    assert view.focus_position == 3
+    view.search_note_view_prev()
+    assert view.focus_position == 1
+    assert 0 in view.body.widgets
+    view.search_note_view_next('(', 'regex')
+    assert view.focus_position == 1
+
+def test_build_matcher(mocker, note):
+    """test matching in both search modes"""
+    view = make_view(mocker, note)
+    view.search_mode = 'gstyle'
+    assert view.build_matcher('wo')('two')
+    assert not view.build_matcher('Wo')('two')
+    view.search_mode = 'regex'
+    assert view.build_matcher('W./i')('two')
+    assert view.build_matcher('(') is None
+
+def test_update_note_view(mocker, note):
+    """test that the lines are only rebuilt when the content changes"""
+    view = make_view(mocker, note)
+    view.focus_position = 2
+    text_at(view, 2)
+    view.update_note_view()
+    assert view.focus_position == 2
+    assert 2 in view.body.widgets
+    note['content'] = 'new'
+    view.update_note_view()
+    assert view.focus_position == 0
+    assert len(view.body) == 2
+    assert text_at(view, 0) == 'new'
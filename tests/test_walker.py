@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""tests for walker module"""
+import pytest
+import urwid
+
+from nncli.walker import LazyListWalker
+
+def make_walker(length):
+    """a walker of text rows that records which rows were built"""
+    built = []
+    def make_widget(position):
+        built.append(position)
+        return urwid.Text('row {}'.format(position))
+    return LazyListWalker(length, make_widget), built
+
+def test_only_visible_rows_built():
+    """test that rendering builds just the rows on screen"""
+    walker, built = make_walker(100000)
+    listbox = urwid.ListBox(walker)
+    listbox.render((20, 5))
+    assert sorted(built) == list(range(5))
+
+def test_bounds():
+    """test out of range positions"""
+    walker, _ = make_walker(2)
+    with pytest.raises(IndexError):
+        walker[2]
+    with pytest.raises(IndexError):
+        walker.next_position(1)
+    with pytest.raises(IndexError):
+        walker.prev_position(0)
+    assert list(walker.positions(reverse=True)) == [1, 0]
+
+def test_refresh_and_reset():
+    """test that refresh rebuilds one row and reset rebuilds all rows"""
+    walker, built = make_walker(3)
+    walker[1]
+    walker[1]
+    assert built == [1]
+    walker.refresh(1)
+    walker[1]
+    assert built == [1, 1]
+    walker.reset(1)
+    assert len(walker) == 1
+    assert walker.focus == 0